@@ -0,0 +1,90 @@
+# ------------------------------------------ #
+# Extract surface velocity of many time      #
+# windows from a MintPy timeseries file      #
+# (geo_timeseries.h5, geo_timeseries_ramp.h5)#
+#                                            #
+# Python version of Extract_Timespan.m for   #
+# any number of windows: the file is read    #
+# once and every window is fitted from       #
+# cumulative sums (velocity_engine.py).      #
+# The t-values come from the table of        #
+# Tlookup.m (tlookup.py)                     #
+# ------------------------------------------ #
+
+import os
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Velocity, its standard error and t-based confidence bounds of many time windows of a mintpy timeseries file, with one read of the file')
+    parser.add_argument('--data','-d',type=str,required=True,help='Full path to the timeseries file [Example: /data/mintpy/geo/geo_timeseries_ramp.h5]')
+    parser.add_argument('--timespan','-t',type=int,nargs=2,action='append',required=False,help='Window [StartT EndT] in yyyymmdd, dates included. Repeat for more windows [Example: -t 20151008 20221117 -t 20180101 20181231]')
+    parser.add_argument('--yearly',default=False,action='store_true',required=False,help='Add one window per calendar year of the time series')
+    parser.add_argument('--rolling',type=int,nargs=2,required=False,help='Add rolling windows of LENGTH days every STEP days from the first date [Example: --rolling 365 90]')
+    parser.add_argument('--event',type=int,required=False,help='Add the pre-event [first date, EVENT] and post-event [EVENT, last date] windows [Example: --event 20190704]')
+    parser.add_argument('--output','-o',type=str,required=False,help='Output HDF5 file, one group <StartT>_<EndT> per window [Default: velocity_windows.h5 next to the input]')
+    parser.add_argument('--alpha','-a',type=float,default=0.95,required=False,help='Confidence of the bounds, one of 0.5 0.6 0.7 0.8 0.9 0.95 0.98 0.99 0.998 0.999 [Default: 0.95]')
+    parser.add_argument('--memory','-m',type=float,default=512,required=False,help='Memory budget in MB: the file is read in row blocks of about this size [Default: 512]')
+    parser.add_argument('--grd',type=str,required=False,help='Also write velocity, velocityErr and interceptErr of every window as .grd files (as grdwrite2 would) in this directory. Geocoded files only [Example: --grd ./grd]')
+    args = parser.parse_args()
+
+    ## Imports
+    import h5py
+    from velocity_engine import read_dates, check_date, usable_windows, yearly_windows, rolling_windows, event_windows, velocity_windows, window_name, write_grd
+    from tlookup import ALPHA
+
+    ## Pass variables
+    Input = args.data
+    Datadir = os.path.split(Input)[0]
+    Output = args.output or os.path.join(Datadir,'velocity_windows.h5')
+    if args.alpha not in ALPHA:
+        parser.error('--alpha must be one of '+' '.join(str(x) for x in ALPHA))
+
+    #### Windows
+    with h5py.File(Input, 'r') as f:
+        Dates = read_dates(f)
+    Windows = [(check_date(a), check_date(b)) for a, b in (args.timespan or [])]
+    Generated = []
+    if args.yearly:
+        Generated += yearly_windows(Dates)
+    if args.rolling:
+        Generated += rolling_windows(Dates, args.rolling[0], args.rolling[1])
+    if args.event:
+        Generated += event_windows(Dates, check_date(args.event))
+    # Generated windows with fewer than 3 epochs are left out, given ones raise an error
+    Usable = usable_windows(Dates, Generated)
+    if len(Usable) < len(Generated):
+        print('*** Skip',len(Generated)-len(Usable),'generated windows with fewer than 3 epochs')
+    Windows += Usable
+    # Duplicates would write the same group twice
+    Windows = list(dict.fromkeys(Windows))
+    if not Windows:
+        parser.error('Give at least one window with -t, --yearly, --rolling or --event')
+
+    print('')
+    print('Input data:',Input)
+    print('Dates:',Dates[0],'~',Dates[-1],'(',len(Dates),'epochs )')
+    print('Windows:',len(Windows))
+    print('')
+
+    Ranges = velocity_windows(Input, Windows, Output, Alpha=args.alpha, MemoryMB=args.memory)
+    for Window, (a, b) in zip(Windows, Ranges):
+        print('Extracting data between:',Dates[a],'~',Dates[b-1],'(',b-a,'epochs ) ->',window_name(Window))
+    print('*** Save velocities to',Output)
+
+    #### Grids for GMT / grdread2
+    if args.grd:
+        with h5py.File(Output, 'r') as o:
+            if 'lon' not in o:
+                print('*** No X_FIRST/Y_FIRST in',Input,', not geocoded: no .grd written')
+                return
+            os.makedirs(args.grd, exist_ok=True)
+            for Window in Windows:
+                for Layer in ['velocity', 'velocityErr', 'interceptErr']:
+                    Path = os.path.join(args.grd,window_name(Window)+'_'+Layer+'.grd')
+                    write_grd(Path, o['lon'][()], o['lat'][()], o[window_name(Window)][Layer][()], Title=Layer+' '+window_name(Window))
+        print('*** Save .grd files to',args.grd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+# ------------------------------------------ #
+# Velocity of many time windows in one pass  #
+# over timeseries.h5                         #
+#                                            #
+# The stack is read once in row blocks. For  #
+# every pixel the sums n, St, Stt, Sd, Std,  #
+# Sdd are accumulated up to every window     #
+# boundary, so the linear fit of any window  #
+# is a difference of two cumulative sums.    #
+# Memory is bounded by the row block         #
+# ------------------------------------------ #
+
+import datetime
+import numpy as np
+import h5py
+from tlookup import tlookup
+
+# Sufficient statistics of the linear fit, in the order they are stacked
+STATS = ['n', 'St', 'Stt', 'Sd', 'Std', 'Sdd']
+# Output layers of every window
+LAYERS = ['velocity', 'velocityStd', 'velocityErr', 'velocityLower', 'velocityUpper', 'interceptErr', 'numEpoch']
+
+
+def read_dates(f):
+    """/date of a MintPy timeseries file as yyyymmdd integers"""
+    return np.array([int(x.decode() if isinstance(x, bytes) else x) for x in f['date'][()]], dtype=np.int64)
+
+
+def decimal_year(Dates):
+    """yyyymmdd integers to decimal years, (day of year - 1)/days in the year as decyear of Matlab"""
+    Out = []
+    for x in Dates:
+        Day = datetime.date(int(x) // 10000, int(x) // 100 % 100, int(x) % 100)
+        Length = (datetime.date(Day.year+1, 1, 1) - datetime.date(Day.year, 1, 1)).days
+        Out.append(Day.year + (Day.timetuple().tm_yday - 1)/Length)
+    return np.array(Out)
+
+
+def check_date(x):
+    if len(str(int(x))) != 8:
+        raise ValueError('Input time format needs to be 8 digits (yyyymmdd): '+str(x))
+    datetime.datetime.strptime(str(int(x)), '%Y%m%d')
+    return int(x)
+
+
+def yearly_windows(Dates):
+    """One window per calendar year covered by Dates"""
+    return [(y*10000+101, y*10000+1231) for y in range(int(Dates[0]) // 10000, int(Dates[-1]) // 10000 + 1)]
+
+
+def rolling_windows(Dates, Length, Step):
+    """Windows of Length days every Step days from the first date, as long as they end before the last date"""
+    First = datetime.datetime.strptime(str(int(Dates[0])), '%Y%m%d').date()
+    Last = datetime.datetime.strptime(str(int(Dates[-1])), '%Y%m%d').date()
+    Out = []
+    Start = First
+    while Start + datetime.timedelta(days=Length) <= Last:
+        End = Start + datetime.timedelta(days=Length)
+        Out.append((int(Start.strftime('%Y%m%d')), int(End.strftime('%Y%m%d'))))
+        Start += datetime.timedelta(days=Step)
+    return Out
+
+
+def event_windows(Dates, Event):
+    """Pre-event [first date, Event] and post-event [Event, last date] windows"""
+    return [(int(Dates[0]), int(Event)), (int(Event), int(Dates[-1]))]
+
+
+def usable_windows(Dates, Windows, MinEpochs=3):
+    """Windows holding at least MinEpochs dates (generated windows may fall in a gap of the acquisitions)"""
+    return [(a, b) for a, b in Windows if np.count_nonzero((Dates >= a) & (Dates <= b)) >= MinEpochs]
+
+
+def window_index(Dates, Windows):
+    """Epoch range [first, last+1) of every window [StartT, EndT] (dates included)
+
+    Windows with fewer than 3 epochs cannot give an uncertainty and raise a ValueError
+    """
+    Out = []
+    for StartT, EndT in Windows:
+        Ind = np.where((Dates >= StartT) & (Dates <= EndT))[0]
+        if len(Ind) < 3:
+            raise ValueError('Window '+str(StartT)+'~'+str(EndT)+' holds '+str(len(Ind))+' epochs, at least 3 are needed')
+        Out.append((int(Ind[0]), int(Ind[-1])+1))
+    return Out
+
+
+def cumulative_stats(Block, T, Bounds):
+    """Sums of STATS of every pixel from Bounds[0] up to every epoch of Bounds
+
+    Block is (epochs, pixels) displacement, NaN for no data, and T the epoch
+    times. Returns (len(Bounds), 6, pixels) float64, so the sums over the
+    epochs [a, b) are Out[index of b] - Out[index of a]. Only the epochs between
+    the first and the last bound are used, one segment sum per pair of bounds.
+    """
+    Seg = Block[Bounds[0]:Bounds[-1]].astype(np.float64)
+    Tc = T[Bounds[0]:Bounds[-1], None]
+    Valid = ~np.isnan(Seg)
+    D = np.where(Valid, Seg, 0.0)
+    Tv = np.where(Valid, Tc, 0.0)
+    Starts = np.asarray(Bounds[:-1]) - Bounds[0]
+    Out = np.zeros((len(Bounds), len(STATS), Block.shape[1]))
+    for k, X in enumerate([Valid.astype(np.float64), Tv, Tv*Tc, D, Tv*D, D*D]):
+        Out[1:, k] = np.cumsum(np.add.reduceat(X, Starts, axis=0), axis=0)
+    return Out
+
+
+def fit_window(Sums, T0, Alpha=0.95):
+    """Least squares velocity of one window from its sums (6, pixels), with times relative to T0
+
+    Returns the LAYERS: slope, its standard error, the t-based half width of
+    the Alpha confidence interval (velocityErr, as Extract_Timespan.m), the
+    lower and upper bounds, the half width of the intercept at year 0 (as
+    Extract_Timespan.m) and the number of epochs. Pixels with fewer than
+    3 epochs are NaN.
+    """
+    n, St, Stt, Sd, Std, Sdd = Sums
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Dx = n*Stt - St**2
+        Ok = (n >= 3) & (Dx > 0)
+        Slope = np.where(Ok, (n*Std - St*Sd)/Dx, np.nan)
+        Se2 = np.maximum((n*Sdd - Sd**2 - Slope**2*Dx)/(n*(n - 2)), 0)
+        Sb2 = n*Se2/Dx
+        # Intercept at year 0: the sum of the squared times is taken about 0, not T0
+        Sa2 = Sb2*(Stt + 2*T0*St + n*T0**2)/n
+        Tval = tlookup(Alpha, np.maximum(n - 2, 1))
+        Std0 = np.sqrt(Sb2)
+        Err = Tval*Std0
+    Layers = {'velocity': Slope, 'velocityStd': np.where(Ok, Std0, np.nan), 'velocityErr': np.where(Ok, Err, np.nan),
+              'velocityLower': Slope - Err, 'velocityUpper': Slope + Err,
+              'interceptErr': np.where(Ok, Tval*np.sqrt(Sa2), np.nan), 'numEpoch': n}
+    return Layers
+
+
+def block_rows(Shape, Windows, MemoryMB):
+    """Rows per block so that the block and its cumulative sums fit in MemoryMB"""
+    Epochs, Rows, Cols = Shape
+    # The float32 block and about five float64 work arrays per epoch, the sums at every bound and the layers
+    PerRow = Cols*(Epochs*44 + (2*len(Windows)+1)*len(STATS)*8 + len(LAYERS)*8)
+    return int(max(1, min(Rows, MemoryMB*1024**2 // PerRow)))
+
+
+def geo_axes(Attrs, Rows, Cols):
+    """Lon and Lat vectors of the frame as in Extract_Timespan.m, None without X_FIRST/Y_FIRST
+
+    The steps are stretched so that the vectors span [X_FIRST, X_FIRST +
+    X_STEP*Cols] (and the same for Lat), the correction Extract_Timespan.m
+    applies for grdwrite2. Lat follows the rows of the file (north first).
+    """
+    if 'X_FIRST' not in Attrs or 'Y_FIRST' not in Attrs:
+        return None, None
+    Out = []
+    for First, Step, Count in [('X_FIRST', 'X_STEP', Cols), ('Y_FIRST', 'Y_STEP', Rows)]:
+        x0, dx = float(Attrs[First]), float(Attrs[Step])
+        Out.append(np.linspace(x0, x0 + dx*Count, Count) if Count > 1 else np.array([x0]))
+    return Out[0], Out[1]
+
+
+def window_name(Window):
+    return str(Window[0])+'_'+str(Window[1])
+
+
+def velocity_windows(Input, Windows, Output, Alpha=0.95, MemoryMB=512, Dataset='timeseries'):
+    """Velocity of every window [StartT, EndT] of Input written to Output, reading Input once
+
+    Output (HDF5) keeps the attributes of Input (geocoding included), holds
+    lon/lat vectors for geocoded files and one group <StartT>_<EndT> per
+    window with the LAYERS as (rows, cols) datasets. Returns the epoch range
+    used by every window.
+    """
+    with h5py.File(Input, 'r') as f:
+        Dates = read_dates(f)
+        Dset = f[Dataset]
+        Epochs, Rows, Cols = Dset.shape
+        T = decimal_year(Dates)
+        T0 = T[0]
+        Ranges = window_index(Dates, Windows)
+        Bounds = np.unique(np.array(Ranges).ravel())
+        Where = {int(b): k for k, b in enumerate(Bounds)}
+        Step = block_rows(Dset.shape, Windows, MemoryMB)
+        Lon, Lat = geo_axes(f.attrs, Rows, Cols)
+
+        with h5py.File(Output, 'w') as o:
+            for Key, Value in f.attrs.items():
+                o.attrs[Key] = Value
+            o.attrs['FILE_TYPE'] = 'velocity'
+            o.attrs['SOURCE'] = Input
+            o.attrs['ALPHA'] = Alpha
+            if Lon is not None:
+                o.create_dataset('lon', data=Lon)
+                o.create_dataset('lat', data=Lat)
+            Out = {}
+            for Window, (a, b) in zip(Windows, Ranges):
+                Grp = o.create_group(window_name(Window))
+                Grp.attrs['START_DATE'], Grp.attrs['END_DATE'] = str(Window[0]), str(Window[1])
+                Grp.attrs['FIRST_EPOCH'], Grp.attrs['LAST_EPOCH'] = str(Dates[a]), str(Dates[b-1])
+                for Layer in LAYERS:
+                    Out[Window, Layer] = Grp.create_dataset(Layer, shape=(Rows, Cols), dtype=np.int16 if Layer == 'numEpoch' else np.float32,
+                                                            chunks=(min(Step, Rows), Cols))
+
+            ## One read of every row block, all the windows from its cumulative sums
+            for r0 in range(0, Rows, Step):
+                r1 = min(Rows, r0+Step)
+                Block = Dset[Bounds[0]:Bounds[-1], r0:r1, :]
+                Cum = cumulative_stats(Block.reshape(Block.shape[0], -1), T[Bounds[0]:Bounds[-1]] - T0, Bounds - Bounds[0])
+                for Window, (a, b) in zip(Windows, Ranges):
+                    Layers = fit_window(Cum[Where[b]] - Cum[Where[a]], T0, Alpha)
+                    for Layer in LAYERS:
+                        Out[Window, Layer][r0:r1, :] = Layers[Layer].reshape(r1-r0, Cols)
+                print('Rows',r0,'-',r1,'of',Rows,'done')
+    return Ranges
+
+
+def write_grd(Path, Lon, Lat, Frame, Title=''):
+    """Frame (rows north first) as a netCDF-4 grid (x, y, z) that grdread2/GMT read like a grdwrite2 output
+
+    Lat is written south first with the rows flipped, as grdwrite2 does.
+    Written with h5py as netCDF-4 (HDF5 with dimension scales).
+    """
+    Order = np.argsort(Lat)
+    with h5py.File(Path, 'w') as g:
+        g.attrs['Conventions'] = np.bytes_('COARDS, CF-1.5')
+        g.attrs['title'] = np.bytes_(Title)
+        x = g.create_dataset('x', data=np.asarray(Lon, dtype=np.float64))
+        y = g.create_dataset('y', data=np.asarray(Lat, dtype=np.float64)[Order])
+        for Scale, Name, Id in [(x, 'x', 1), (y, 'y', 0)]:
+            Scale.make_scale(Name)
+            Scale.attrs['long_name'] = np.bytes_('longitude' if Name == 'x' else 'latitude')
+            Scale.attrs['actual_range'] = np.array([Scale[0], Scale[-1]])
+            Scale.attrs['_Netcdf4Dimid'] = np.int32(Id)
+        z = g.create_dataset('z', data=np.asarray(Frame, dtype=np.float32)[Order], fillvalue=np.float32(np.nan))
+        z.attrs['_FillValue'] = np.float32(np.nan)
+        z.attrs['long_name'] = np.bytes_('z')
+        z.attrs['actual_range'] = np.array([np.nanmin(z[()]), np.nanmax(z[()])]) if np.any(np.isfinite(z[()])) else np.array([np.nan, np.nan])
+        z.dims[0].attach_scale(y)
+        z.dims[1].attach_scale(x)
@@ -0,0 +1,73 @@
+# ------------------------------------------ #
+# Extract the LOS displacement timeseries    #
+# from a MintPy product into a text file     #
+# (timeseries.h5, timeseries_ERA5_ramp.h5..) #
+#                                            #
+# Python version of h5TS_to_Text.m that      #
+# streams the subset in blocks: only the     #
+# bbox is read, block by block through the   #
+# mask, so memory follows the block size     #
+# and not the scene (ts_export.py)           #
+# ------------------------------------------ #
+
+import os
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a mintpy timeseries file into a text file (Lon, Lat and the displacement of every date, one pixel per line), or a columnar NPZ')
+    parser.add_argument('--data','-d',type=str,required=True,help='Path to the timeseries h5 file [Example: /data/mintpy/timeseries_ERA5.h5]')
+    parser.add_argument('--mask','-m',type=str,required=False,help='Temporal coherence mask (or any mask with the same coverage). Leave blank to not mask [Example: /data/mintpy/maskTempCoh.h5]')
+    parser.add_argument('--bbox','-b',type=float,nargs=4,required=False,help='Subset bounding box [W E S N]. Leave blank to output every pixel [Example: -b 120 121 22 23]')
+    parser.add_argument('--format','-f',type=str,default='txt',choices=['txt','gz','npz'],required=False,help='Output format: text as h5TS_to_Text.m (txt), gzip text (gz), or NPZ with the arrays lon, lat, date and timeseries (npz) [Default: txt]')
+    parser.add_argument('--output','-o',type=str,required=False,help='Output file [Default: timeseries_textfile/<name>_[masked][_subset] in the current directory, as h5TS_to_Text.m]')
+    parser.add_argument('--memory',type=float,default=256,required=False,help='Memory budget in MB of one block (per worker) [Default: 256]')
+    parser.add_argument('--workers','-w',type=int,default=1,required=False,help='Number of worker processes. Each one writes an ordered shard of the blocks, joined in order at the end [Default: 1]')
+    args = parser.parse_args()
+
+    ## Imports
+    import time
+    from ts_export import export, EXTENSION
+
+    ## Pass variables
+    h5TS = args.data
+    h5TempMask = args.mask
+    Bbox = args.bbox
+    Format = args.format
+    TSname = os.path.splitext(os.path.basename(h5TS))[0]
+
+    if h5TempMask and Bbox:
+        print('*** Extract timeseries with masking and subsetting')
+        Suffix = '_masked_subset'
+    elif h5TempMask:
+        print('*** Extract timeseries with masking but without subsetting')
+        Suffix = '_masked'
+    elif Bbox:
+        print('*** Extract timeseries with subsetting but without masking')
+        Suffix = '_subset'
+    else:
+        print('*** Extract timeseries without masking or subsetting')
+        Suffix = '_'
+    print('* h5 timeseries file:',h5TS)
+    if h5TempMask:
+        print('* Temporal coherence mask file:',h5TempMask)
+    if Bbox:
+        print('* Subset bounding box:',Bbox)
+    print('------------------------------------------')
+
+    Output = args.output
+    if not Output:
+        os.makedirs('timeseries_textfile', exist_ok=True)
+        Output = os.path.join('timeseries_textfile',TSname+Suffix+EXTENSION[Format])
+
+    Start = time.perf_counter()
+    try:
+        Count = export(h5TS, Output, MaskFile=h5TempMask, Bbox=Bbox, Format=Format, Workers=args.workers, MemoryMB=args.memory)
+    except ValueError as Error:
+        print('*** '+str(Error)+'. ABORT!')
+        exit(1)
+    print('*** Writing timeseries of',Count,'pixels into',Output,'(%.1f s)' % (time.perf_counter() - Start))
+
+
+if __name__ == '__main__':
+    main()
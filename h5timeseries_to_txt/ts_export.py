@@ -0,0 +1,183 @@
+# ------------------------------------------ #
+# Streaming export of a MintPy timeseries    #
+#                                            #
+# The bbox is turned into a hyperslab before #
+# anything is read, and the subset is read   #
+# in blocks of columns that go through the   #
+# mask and straight to the output (text,     #
+# gzip text or NPZ). Rows come out in the    #
+# order of h5TS_to_Text.m: longitude by      #
+# longitude, latitude ascending              #
+# ------------------------------------------ #
+
+import os
+import gzip
+import shutil
+import zipfile
+import multiprocessing as mp
+import numpy as np
+import h5py
+
+FORMATS = ['txt', 'gz', 'npz']
+EXTENSION = {'txt': '.txt', 'gz': '.txt.gz', 'npz': '.npz'}
+
+
+def read_dates(f):
+    return [x.decode() if isinstance(x, bytes) else str(x) for x in f['date'][()]]
+
+
+def geo_axes(Attrs, Rows, Cols):
+    """Lon and Lat of the columns and rows as in h5TS_to_Text.m (Lat north first, as the rows of the file)"""
+    Out = []
+    for First, Step, Count in [('X_FIRST', 'X_STEP', Cols), ('Y_FIRST', 'Y_STEP', Rows)]:
+        x0, dx = float(Attrs[First]), float(Attrs[Step])
+        Out.append(np.linspace(x0, x0 + dx*Count, Count) if Count > 1 else np.array([x0]))
+    return Out[0], Out[1]
+
+
+def bbox_slices(Lon, Lat, Bbox):
+    """Row and column slices of the pixels inside Bbox [W E S N], the whole frame when Bbox is None"""
+    if Bbox is None:
+        return slice(0, len(Lat)), slice(0, len(Lon))
+    W, E, S, N = Bbox
+    Cols = np.where((Lon >= W) & (Lon <= E))[0]
+    Rows = np.where((Lat >= S) & (Lat <= N))[0]
+    if len(Cols) == 0 or len(Rows) == 0:
+        raise ValueError('The bounding box '+str(list(Bbox))+' holds no pixel')
+    return slice(int(Rows[0]), int(Rows[-1])+1), slice(int(Cols[0]), int(Cols[-1])+1)
+
+
+def valid_frame(f, MaskFile, Rows, Cols, Dataset='timeseries'):
+    """Pixels of the subset that are exported: in the mask and not NaN at the first epoch (as h5TS_to_Text.m)"""
+    Valid = ~np.isnan(f[Dataset][0, Rows, Cols])
+    if MaskFile:
+        with h5py.File(MaskFile, 'r') as m:
+            Valid &= m['mask'][Rows, Cols].astype(bool)
+    return Valid
+
+
+def column_blocks(Cols, Rows, Epochs, MemoryMB):
+    """Column ranges of the subset whose (epochs, rows, columns) block fits MemoryMB with its table"""
+    # The float32 block, its reordered copy and the float64 table of the text writers
+    PerCol = max(1, (Rows.stop - Rows.start)*Epochs*4*5)
+    Step = int(max(1, MemoryMB*1024**2 // PerCol))
+    return [(c, min(Cols.stop, c+Step)) for c in range(Cols.start, Cols.stop, Step)]
+
+
+def block_table(Dset, Valid, Lon, Lat, Rows, Cols, Block):
+    """Lon, Lat and displacement history (pixels, epochs) of the valid pixels of the column block
+
+    Valid is the boolean frame of the subset Rows x Cols, Block the column range.
+    Only this block is read, as one hyperslab.
+    """
+    c0, c1 = Block
+    Sel = Valid[::-1, c0-Cols.start:c1-Cols.start].T
+    if not Sel.any():
+        return np.zeros(0), np.zeros(0), np.zeros((0, Dset.shape[0]), dtype=np.float32)
+    Data = Dset[:, Rows, c0:c1]
+    # Longitude by longitude, latitude ascending (the rows of the file are north first)
+    Data = Data[:, ::-1, :].transpose(2, 1, 0)[Sel]
+    C, R = np.nonzero(Sel)
+    return Lon[c0 + C], Lat[Rows][::-1][R], Data
+
+
+def _write_text(Out, LonCol, LatCol, Data):
+    if len(LonCol) == 0:
+        return
+    Table = np.column_stack([LonCol, LatCol, Data.astype(np.float64)])
+    np.savetxt(Out, Table, fmt=['%.15g', '%.15g'] + ['%.9g']*Data.shape[1], delimiter=',')
+
+
+def _open_text(Path, Format, Mode='wt'):
+    # Gzip members written by different workers can be concatenated into one valid gzip file
+    return gzip.open(Path, Mode, compresslevel=1) if Format == 'gz' else open(Path, Mode)
+
+
+def _shard_task(Task):
+    """Write the column blocks Blocks of Input to the shard Path (text or raw float32), Mode 'w' or 'a'"""
+    Input, Valid, Lon, Lat, Rows, Cols, Blocks, Path, Mode, Format, Dataset = Task
+    Count = 0
+    with h5py.File(Input, 'r') as f:
+        Dset = f[Dataset]
+        with (open(Path, Mode+'b') if Format == 'npz' else _open_text(Path, Format, Mode+'t')) as Out:
+            for Block in Blocks:
+                LonCol, LatCol, Data = block_table(Dset, Valid, Lon, Lat, Rows, Cols, Block)
+                if Format == 'npz':
+                    Out.write(np.ascontiguousarray(Data, dtype=np.float32).tobytes())
+                else:
+                    _write_text(Out, LonCol, LatCol, Data)
+                Count += len(LonCol)
+                print('Columns',Block[0],'-',Block[1],'of',Cols.stop,'done')
+    return Path, Count
+
+
+def _npz_member(Zip, Name, Array=None, Shape=None, Dtype=None, Parts=()):
+    """Write one .npy member to the open ZipFile Zip, from Array or streamed from the raw files Parts"""
+    Shape = Array.shape if Array is not None else Shape
+    Dtype = Array.dtype if Array is not None else np.dtype(Dtype)
+    with Zip.open(Name+'.npy', 'w', force_zip64=True) as Member:
+        np.lib.format.write_array_header_1_0(Member, {'descr': np.lib.format.dtype_to_descr(Dtype), 'fortran_order': False, 'shape': Shape})
+        if Array is not None:
+            Member.write(np.ascontiguousarray(Array).tobytes())
+        for Part in Parts:
+            with open(Part, 'rb') as p:
+                shutil.copyfileobj(p, Member, 16*1024**2)
+
+
+def export(Input, Output, MaskFile=None, Bbox=None, Format='txt', Workers=1, MemoryMB=256, Dataset='timeseries'):
+    """Write the displacement history of the valid pixels of Input to Output
+
+    Text formats have the header Lon,Lat,<dates> and one pixel per line, as
+    h5TS_to_Text.m. NPZ holds lon, lat (pixels,), date (epochs,) and
+    timeseries (pixels, epochs) float32. The subset is read in column blocks
+    of about MemoryMB; with Workers the blocks are split into ordered
+    shards written in parallel and joined in order. Returns the number of
+    pixels written.
+    """
+    with h5py.File(Input, 'r') as f:
+        Dates = read_dates(f)
+        Epochs, NRow, NCol = f[Dataset].shape
+        Lon, Lat = geo_axes(f.attrs, NRow, NCol)
+        Rows, Cols = bbox_slices(Lon, Lat, Bbox)
+        Valid = valid_frame(f, MaskFile, Rows, Cols, Dataset)
+    Blocks = column_blocks(Cols, Rows, Epochs, MemoryMB)
+    Total = int(Valid.sum())
+    print('*** Subset rows',Rows.start,'-',Rows.stop,', columns',Cols.start,'-',Cols.stop,':',Total,'pixels in',len(Blocks),'blocks')
+
+    ## Ordered shards: contiguous runs of blocks, one per worker (the output itself with one worker)
+    Workers = max(1, min(Workers, len(Blocks)))
+    Shards = [list(x) for x in np.array_split(np.arange(len(Blocks)), Workers) if len(x)]
+    # A single text writer appends to the output right after the header
+    Direct = len(Shards) == 1 and Format != 'npz'
+    Paths = [Output] if Direct else [Output+'.part%03d' % k for k in range(len(Shards))]
+    Tasks = [(Input, Valid, Lon, Lat, Rows, Cols, [Blocks[i] for i in x], p, 'a' if Direct else 'w', Format, Dataset) for x, p in zip(Shards, Paths)]
+
+    # The header goes first, the shards are appended in order
+    if Format != 'npz':
+        with _open_text(Output, Format) as Out:
+            Out.write(','.join(['Lon', 'Lat'] + Dates)+'\n')
+    if len(Tasks) == 1:
+        Done = [_shard_task(Tasks[0])]
+    else:
+        with mp.Pool(len(Tasks)) as Pool:
+            Done = Pool.map(_shard_task, Tasks)
+    Count = sum(x[1] for x in Done)
+    if Direct:
+        return Count
+
+    if Format == 'npz':
+        Sel = Valid[::-1].T
+        C, R = np.nonzero(Sel)
+        with zipfile.ZipFile(Output, 'w', zipfile.ZIP_STORED, allowZip64=True) as Zip:
+            _npz_member(Zip, 'lon', Lon[Cols.start + C])
+            _npz_member(Zip, 'lat', Lat[Rows][::-1][R])
+            _npz_member(Zip, 'date', np.array(Dates, dtype='S8'))
+            _npz_member(Zip, 'timeseries', Shape=(Count, Epochs), Dtype=np.float32, Parts=[x[0] for x in Done])
+    else:
+        with open(Output, 'ab') as Out:
+            for Path, _ in Done:
+                with open(Path, 'rb') as p:
+                    shutil.copyfileobj(p, Out, 16*1024**2)
+    for Path, _ in Done:
+        os.remove(Path)
+    return Count
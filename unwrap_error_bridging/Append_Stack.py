@@ -0,0 +1,63 @@
+# ------------------------------------------ #
+# Append the new pairs of an added stack to  #
+# an existing ifgramStack.h5                 #
+#                                            #
+# For the sequential updates of              #
+# topsStack_add_stack: load the added stack  #
+# alone with MintPy, then only its new pairs #
+# are appended (unwrapPhase,                 #
+# connectComponent, date, bperp, ...)        #
+# instead of loading the whole stack again.  #
+# Bridge them with Profile_Bridging.py       #
+# --newPairs                                 #
+# ------------------------------------------ #
+
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Append the pairs of a newer mintpy ifgramStack.h5 that are not in the existing ifgramStack.h5 yet, in place')
+    parser.add_argument('--data','-d',type=str,required=True,help='Full path to the existing ifgramStack.h5 [Example: /data/topsStack/mintpy/inputs/ifgramStack.h5]')
+    parser.add_argument('--add','-a',type=str,required=False,help='Full path to the ifgramStack.h5 of the added stack, same frame [Example: /data/topsStack2/mintpy/inputs/ifgramStack.h5]')
+    parser.add_argument('--list','-l',default=False,action='store_true',required=False,help='List the appends and the pairs that are new for the next bridging run, and exit')
+    args = parser.parse_args()
+
+    ## Imports
+    import h5py
+    from stack_append import append_stack, list_appends, new_pairs
+    from stage_timer import StageTimer
+
+    ## Pass variables
+    Input = args.data
+    Add = args.add
+
+    #### List the appends
+    if args.list:
+        with h5py.File(Input, 'r') as f:
+            for Append in list_appends(f):
+                print('Append',Append['append'],Append['attrs'])
+                print('   pairs:',Append['pair'].tolist())
+            print('Pairs new for the next bridging run:',new_pairs(f))
+        exit(0)
+    if not Add:
+        print('*** Give the ifgramStack.h5 of the added stack with -a. ABORT!')
+        exit(1)
+
+    print('')
+    print('Existing stack:',Input)
+    print('Added stack:',Add)
+    print('')
+
+    Timer = StageTimer()
+    with Timer('append'):
+        Pairs = append_stack(Input, Add)
+    if not Pairs:
+        print('*** Every pair of',Add,'is already in',Input)
+        exit(0)
+    print('*** Appended pairs:',Pairs)
+    print(Timer.summary()[0])
+    print('*** Bridge them with: Profile_Bridging.py -d',Input,'--newPairs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# ------------------------------------------ #
+# Benchmark of the profile bridging engine   #
+#                                            #
+# Generate a synthetic ifgramStack.h5 with   #
+# known 2 pi jumps, bridge every band        #
+# boundary, restore, and report the time and #
+# peak memory of each stage together with    #
+# the jumps recovered against the truth      #
+# ------------------------------------------ #
+
+import os
+import sys
+import json
+import argparse
+import resource
+import tracemalloc
+from contextlib import redirect_stdout
+
+
+def check_truth(Runs, Jump):
+    """Compare the deltas of the latest bridging run with the injected jumps
+
+    Band b of pair i is expected to be shifted by Jump[i, b-1], whichever band
+    it is bridged to. Returns the counts of correct, missed and false
+    corrections and the pairs in error.
+    """
+    Expect = {(i, b, int(Jump[i,b-1])) for i in range(Jump.shape[0]) for b in range(2, Jump.shape[1]+1) if Jump[i,b-1] != 0}
+    Found = set()
+    if Runs:
+        Run = Runs[-1]
+        Found = {(int(i), int(b), int(s)) for i, b, s in zip(Run['pair'], Run['backComp'], Run['shift'])}
+    Missed = Expect - Found
+    Wrong = Found - Expect
+    return {'expected': len(Expect), 'correct': len(Expect & Found), 'missed': len(Missed), 'false': len(Wrong),
+            'pairsInError': sorted({x[0] for x in Missed | Wrong})}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark profile bridging on a synthetic ifgramStack.h5: time and peak memory of every stage, and the recovered jumps against the ground truth')
+    parser.add_argument('--dir','-o',type=str,default='.',required=False,help='Working directory of the synthetic stack [Default: current directory]')
+    parser.add_argument('--npair','-n',type=int,default=50,required=False,help='Number of pairs [Default: 50]')
+    parser.add_argument('--size','-s',type=int,nargs=2,default=[1000,800],required=False,help='Frame size [Rows Cols] [Default: 1000 800]')
+    parser.add_argument('--ncomp','-c',type=int,default=3,required=False,help='Number of connect components (bands) [Default: 3]')
+    parser.add_argument('--jumpRate',type=float,default=0.3,required=False,help='Probability of a jump for every band of every pair [Default: 0.3]')
+    parser.add_argument('--holes',type=int,default=5,required=False,help='NaN holes per pair [Default: 5]')
+    parser.add_argument('--seed',type=int,default=0,required=False,help='Random seed [Default: 0]')
+    parser.add_argument('--chunk',type=int,default=128,required=False,help='Chunk tile size, 0 for a contiguous layout [Default: 128]')
+    parser.add_argument('--compression',type=str,default=None,required=False,help='h5py compression (gzip, lzf) [Default: none]')
+    parser.add_argument('--workers','-w',type=int,default=1,required=False,help='Worker processes of the bridging engine [Default: 1]')
+    parser.add_argument('--repeat','-r',type=int,default=1,required=False,help='Number of bridge/restore rounds on the same stack. The fastest round is reported [Default: 1]')
+    parser.add_argument('--multi',default=False,action='store_true',required=False,help='Bridge all bands with one multi-step profile instead of one profile per boundary')
+    parser.add_argument('--graph',default=False,action='store_true',required=False,help='Bridge with the connect component adjacency graph (bridging.run_graph) instead of profiles')
+    parser.add_argument('--prefetch',type=int,default=2,required=False,help='Pairs read ahead by a reader thread and corrected slices queued for a writer thread while a pair is processed, 0 for blocking reads and writes. The I/O wait of every stage is reported [Default: 2]')
+    parser.add_argument('--chunkCache',type=float,required=False,help='HDF5 chunk cache of ifgramStack.h5 in MB [Default: h5py default, 1 MB]')
+    parser.add_argument('--reuse',default=False,action='store_true',required=False,help='Reuse the synthetic stack of the working directory if it exists')
+    parser.add_argument('--report',type=str,required=False,help='Write the results to this JSON file')
+    parser.add_argument('--verbose','-v',default=False,action='store_true',required=False,help='Show the output of the bridging engine')
+    args = parser.parse_args()
+
+    import numpy as np
+    import h5py
+    from synthetic_stack import make_stack, profile_jobs, truth_name
+    from bridging import run_jobs, run_graph, restore
+    from bridge_history import list_history
+    from stage_timer import StageTimer
+    from prefetch import set_prefetch
+    set_prefetch(args.prefetch, args.chunkCache)
+
+    Input = os.path.join(args.dir, 'ifgramStack.h5')
+    Config = {'npair': args.npair, 'size': args.size, 'ncomp': args.ncomp, 'jumpRate': args.jumpRate, 'holes': args.holes,
+              'seed': args.seed, 'chunk': args.chunk, 'compression': args.compression, 'workers': args.workers, 'multi': args.multi, 'graph': args.graph}
+    os.makedirs(args.dir, exist_ok=True)
+    if args.reuse and os.path.isfile(Input) and os.path.isfile(truth_name(Input)):
+        print('*** Reuse',Input)
+        Truth = dict(np.load(truth_name(Input)))
+        with h5py.File(Input, 'r') as f:
+            Config['npair'] = f['unwrapPhase'].shape[0]
+            Config['size'] = list(f['unwrapPhase'].shape[1:])
+    else:
+        print('*** Generate',Input)
+        Gen = StageTimer()
+        with Gen('generate'):
+            Truth = make_stack(Input, NPair=args.npair, Shape=tuple(args.size), NComp=args.ncomp, JumpRate=args.jumpRate,
+                               Holes=args.holes, Seed=args.seed, Chunk=args.chunk, Compression=args.compression)
+        print(Gen.summary()[0])
+    Jobs = [] if args.graph else profile_jobs(Truth, Multi=args.multi)
+
+    ## Per pair checksum to verify that restoring gives back the original stack
+    with h5py.File(Input, 'r') as f:
+        Checksum = np.array([np.nansum(f['unwrapPhase'][i].astype(np.float64)) for i in range(f['unwrapPhase'].shape[0])])
+
+    Rounds = []
+    Quiet = open(os.devnull, 'w')
+    for r in range(args.repeat):
+        Timer = StageTimer()
+        tracemalloc.start()
+        with redirect_stdout(sys.stdout if args.verbose else Quiet):
+            if args.graph:
+                run_graph(Input, Fix=True, Workers=args.workers, Timer=Timer)
+            else:
+                run_jobs(Input, Jobs, Fix=True, Workers=args.workers, Timer=Timer)
+            with h5py.File(Input, 'r') as f:
+                Accuracy = check_truth(list_history(f), Truth['jump'])
+            with Timer('restore'):
+                restore(Input)
+        tracemalloc.stop()
+        with h5py.File(Input, 'r') as f:
+            After = np.array([np.nansum(f['unwrapPhase'][i].astype(np.float64)) for i in range(f['unwrapPhase'].shape[0])])
+        Accuracy['restoreMaxError'] = float(np.max(np.abs(After - Checksum)/np.maximum(np.abs(Checksum), 1)))
+        Rounds.append({'stages': dict(Timer.Stages), 'total': Timer.total(), 'accuracy': Accuracy})
+        print('')
+        print('#### Round',r+1,'of',args.repeat)
+        for Line in Timer.summary():
+            print(Line)
+        print('%-10s %9.3f s' % ('total', Timer.total()))
+        print('Jumps recovered:',Accuracy['correct'],'/',Accuracy['expected'],' missed:',Accuracy['missed'],' false:',Accuracy['false'])
+        if Accuracy['pairsInError']:
+            print('Pairs in error:',Accuracy['pairsInError'])
+        print('Restore relative checksum error:',Accuracy['restoreMaxError'])
+    Quiet.close()
+
+    Best = min(Rounds, key=lambda x: x['total'])
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    MaxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/(1024**2 if sys.platform == 'darwin' else 1024)
+    print('')
+    print('Fastest round:','%.3f s' % Best['total'],' peak RSS:','%.1f MB' % MaxRSS)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'config': Config, 'jobs': Jobs, 'best': Best, 'rounds': Rounds, 'lifetimeMaxRSSMB': MaxRSS}, f, indent=1)
+        print('*** Save report to',args.report)
+
+
+if __name__ == '__main__':
+    main()
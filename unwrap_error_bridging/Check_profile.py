@@ -1,97 +1,150 @@
 import os
-import numpy as np
-import h5py
 import argparse
-import fnmatch
-from numpy.linalg import inv
-from matplotlib import pyplot as plt
-from mintpy.objects import timeseries, sensor
-from mintpy.utils import readfile, writefile
-from mintpy.defaults.plot import *
-from mintpy import view
-
-parser = argparse.ArgumentParser(description='Check the profile that samples the unwrapPhase with the given start and end points')
-parser.add_argument('--data','-d',type=str,required=True,help='Full path to ifgramStack.h5 e.g. /data/UAVSAR/mintpy/inputs/ifgramStack.h5')
-parser.add_argument('--pair','-p',type=int,nargs=1,required=True,help='The pair to check the profile line. Put only 1 pair number')
-parser.add_argument('--profileStart','-ps',type=int,nargs=2,required=True,help='The start point of the profile. Row Col e.g.: 2500 2500')
-parser.add_argument('--profileEnd','-pe',type=int,nargs=2,required=True,help='The end point of the profile. Row Col e.g.: 17500 2500')
-parser.add_argument('--vminmax','-v',type=int,nargs=2,required=False,help='Colorbar of the unwrapped phase. e.g. -v -5 5')
-args = parser.parse_args()
-
-## Pass variables
-Input = args.data
-UserPair = args.pair[0]
-Pstart = args.profileStart
-Pend = args.profileEnd
-Datadir = os.path.split(Input)[0]
-v = args.vminmax
-
-if not v:
-    v = [-15,15]
-
-
-print('')
-print('Data directory:',Datadir)
-print('Input data:',Input)
-print('Profile starting point:',Pstart)
-print('Profile ending point:',Pend)
-print('Looking pair',UserPair)
-print('')
-
-
-## Profile line
-dist = np.int64(np.sqrt((Pend[1]-Pstart[1])**2+(Pend[0]-Pstart[0])**2))
-Prof_X = np.int64(np.round(np.linspace(Pstart[1],Pend[1],num=dist)))
-Prof_Y = np.int64(np.round(np.linspace(Pstart[0],Pend[0],num=dist)))
-
-with h5py.File(Input, 'r') as f:
-    Conn = f['connectComponent'][UserPair]
-    Upha = f['unwrapPhase'][UserPair]
-    
-    # Get the profile
-    UphaProf = Upha[Prof_Y,Prof_X] 
-    
-    # Prepare for grid-serach model inversion
-    d = UphaProf.copy()
-    X = np.arange(0,len(d),1)
-    m = np.zeros((len(X),2))
-    RMSE = np.zeros((len(X),1))
-    for j in range(len(X)):
-        # Skip for the first and the last point to avoid singularity
-        if j == 0 or j == X[-1]:
-            m[j,:] = np.nan
-            RMSE[j] = np.nan
-        else:
-            StepF = np.hstack([np.zeros(j),np.ones(len(X)-j)])
-            G = np.vstack([np.ones(len(X)),StepF]).T
-            m[j,:] = np.matmul(np.matmul(inv(np.matmul(G.T,G)),G.T),d)
-            RMSE[j] = np.sqrt(np.mean((d - (m[j,0] + StepF*m[j,1]))**2))
-            
-    Ind = np.nanargmin(RMSE).astype(int)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the profile that samples the unwrapPhase with the given start and end points')
+    parser.add_argument('--data','-d',type=str,required=True,help='Full path to ifgramStack.h5 e.g. /data/UAVSAR/mintpy/inputs/ifgramStack.h5')
+    parser.add_argument('--pair','-p',type=int,nargs=1,required=True,help='The pair to check the profile line. Put only 1 pair number')
+    parser.add_argument('--profileStart','-ps',type=int,nargs=2,required=True,help='The start point of the profile. Row Col e.g.: 2500 2500')
+    parser.add_argument('--profileEnd','-pe',type=int,nargs=2,required=True,help='The end point of the profile. Row Col e.g.: 17500 2500')
+    parser.add_argument('--vminmax','-v',type=int,nargs=2,required=False,help='Colorbar of the unwrapped phase. e.g. -v -5 5')
+    parser.add_argument('--multi',default=False,action='store_true',required=False,help='Show every phase step along the profile as found by Profile_Bridging.py --multi')
+    parser.add_argument('--output','-o',type=str,required=False,help='Headless mode: save the figure to this file instead of showing it e.g. -o profile_pair3.png')
+    parser.add_argument('--maxPixels',type=int,default=1000,required=False,help='Longest side of the decimated overview of the frame. The frame is read with this stride, or from the multilook level kept by Profile_Bridging.py --keepPyramid [Default: 1000]')
+    parser.add_argument('--zoom',type=int,default=100,required=False,help='Half size in pixels of the full resolution window around the largest phase step, 0 to leave it out [Default: 100]')
+    args = parser.parse_args()
+
+    ## Imports
+    import numpy as np
+    import h5py
+    import matplotlib
+    if args.output:
+        matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    from stack_io import profile_coords, gather_pixels
+    from step_fit import step_fit, segment
+    from overview import overview_step, read_overview, polyline, window_slices
+
+    ## Pass variables
+    Input = args.data
+    UserPair = args.pair[0]
+    Pstart = args.profileStart
+    Pend = args.profileEnd
+    Datadir = os.path.split(Input)[0]
+    v = args.vminmax
+    Half = args.zoom
+
+    if not v:
+        v = [-15,15]
+
+
+    print('')
+    print('Data directory:',Datadir)
+    print('Input data:',Input)
+    print('Profile starting point:',Pstart)
+    print('Profile ending point:',Pend)
+    print('Looking pair',UserPair)
+    print('')
+
+
+    ## Profile line
+    Prof_Y, Prof_X = profile_coords(Pstart, Pend)
+
+    ## Only the profile pixels are read at full resolution
+    with h5py.File(Input, 'r') as f:
+        Shape = f['unwrapPhase'].shape[1:]
+        UphaProf = gather_pixels(f['unwrapPhase'], [UserPair], Prof_Y, Prof_X)[0].astype(np.float64)
+
+    # Closed-form step fit over every breakpoint
+    X = np.arange(0,len(UphaProf),1)
+    Ind, PhaseStep, _ = step_fit(UphaProf)
+    Ind = Ind[0]
+    PhaseStep = PhaseStep[0]
     StepF = np.hstack([np.zeros(Ind),np.ones(len(X)-Ind)])
-    PhaseStep = m[Ind,:]
-
-print('*** Show image ***')
-
-plt.figure(figsize=(12,10))
-plt.subplot(1,3,1)
-plt.imshow(Upha,vmin=v[0],vmax=v[1])
-plt.colorbar(pad=0.01)
-plt.plot(Prof_X,Prof_Y,'r.',markersize='1')
-plt.plot(Prof_X[Ind],Prof_Y[Ind],'ks')
-plt.title('unwrapped phase')
-plt.subplot(1,3,2)
-plt.imshow(Conn)
-plt.title('connect component')
-plt.plot(Prof_X,Prof_Y,'r.',markersize='1')
-plt.plot(Prof_X[Ind],Prof_Y[Ind],'ks')
-plt.colorbar(pad=0.01)
-plt.subplot(1,3,3)
-plt.plot(X,UphaProf,'.',label='unwrapped phase')
-plt.plot(X,PhaseStep[0] + StepF*PhaseStep[1],label='Modeled step')
-plt.text(Ind,PhaseStep[0],str(round(PhaseStep[1],2)),fontsize=16,weight='bold')
-plt.xlabel('X')
-plt.ylabel('unwrapped phase')
-plt.legend()
-plt.tight_layout()
-plt.show()
+    Model = PhaseStep[0] + StepF*PhaseStep[1]
+    Breaks = np.array([Ind])
+    Steps = np.array([PhaseStep[1]])
+
+    # Every step of the multi-step mode, as a piecewise constant model
+    if args.multi:
+        Breaks, Means = segment(UphaProf)
+        Model = np.repeat(Means, np.diff(np.concatenate([[0], Breaks, [len(X)]])))
+        Steps = np.diff(Means)
+        print('Phase steps at',Breaks.tolist(),':',np.round(Steps,2).tolist())
+
+    ## Decimated overview of the frame for the figure
+    Dec = overview_step(Shape, args.maxPixels)
+    Upha, Dec = read_overview(Input, 'unwrapPhase', UserPair, Dec)
+    Conn, _ = read_overview(Input, 'connectComponent', UserPair, Dec)
+    Extent = (-0.5, Upha.shape[1]*Dec-0.5, Upha.shape[0]*Dec-0.5, -0.5)
+    print('*** Overview decimated by',Dec,':',Upha.shape,'of',Shape)
+
+    ## Full resolution window around the largest step
+    Zoom = None
+    if Half > 0 and len(Breaks):
+        Big = Breaks[np.argmax(np.abs(Steps))] if len(Steps) else Breaks[0]
+        Rows, Cols = window_slices(Shape, Prof_Y[Big], Prof_X[Big], Half)
+        with h5py.File(Input, 'r') as f:
+            Zoom = (f['unwrapPhase'][UserPair, Rows, Cols], f['connectComponent'][UserPair, Rows, Cols],
+                    (Cols.start-0.5, Cols.stop-0.5, Rows.stop-0.5, Rows.start-0.5), Big)
+
+    ## The profile is drawn as a polyline of at most 200 vertices, the samples thinned to at most 4000 points
+    Line = polyline(Prof_Y, Prof_X)
+    Thin = np.arange(0, len(X), max(1, len(X)//4000))
+
+    print('*** Show image ***' if not args.output else '*** Draw image ***')
+
+    Nrow = 2 if Zoom else 1
+    plt.figure(figsize=(15,5*Nrow))
+    plt.subplot(Nrow,3,1)
+    plt.imshow(Upha,vmin=v[0],vmax=v[1],extent=Extent,interpolation='nearest')
+    plt.colorbar(pad=0.01)
+    plt.plot(Prof_X[Line],Prof_Y[Line],'r-',linewidth=1)
+    plt.plot(Prof_X[Breaks],Prof_Y[Breaks],'ks')
+    plt.title('unwrapped phase (1/'+str(Dec)+')')
+    plt.subplot(Nrow,3,2)
+    plt.imshow(Conn,extent=Extent,interpolation='nearest')
+    plt.title('connect component (1/'+str(Dec)+')')
+    plt.plot(Prof_X[Line],Prof_Y[Line],'r-',linewidth=1)
+    plt.plot(Prof_X[Breaks],Prof_Y[Breaks],'ks')
+    plt.colorbar(pad=0.01)
+    plt.subplot(Nrow,3,3)
+    plt.plot(X[Thin],UphaProf[Thin],'.',label='unwrapped phase')
+    plt.plot(X,Model,label='Modeled step')
+    for Break, Step in zip(Breaks, Steps):
+        plt.text(Break,Model[Break-1] if Break > 0 else Model[0],str(round(Step,2)),fontsize=16,weight='bold')
+    plt.xlabel('X')
+    plt.ylabel('unwrapped phase')
+    plt.legend()
+    if Zoom:
+        ZUpha, ZConn, ZExtent, Big = Zoom
+        Near = np.where((np.abs(Prof_Y - Prof_Y[Big]) <= Half) & (np.abs(Prof_X - Prof_X[Big]) <= Half))[0]
+        plt.subplot(Nrow,3,4)
+        plt.imshow(ZUpha,vmin=v[0],vmax=v[1],extent=ZExtent,interpolation='nearest')
+        plt.colorbar(pad=0.01)
+        plt.plot(Prof_X[Near],Prof_Y[Near],'r-',linewidth=1)
+        plt.plot(Prof_X[Big],Prof_Y[Big],'ks')
+        plt.title('unwrapped phase (full res.)')
+        plt.subplot(Nrow,3,5)
+        plt.imshow(ZConn,extent=ZExtent,interpolation='nearest')
+        plt.colorbar(pad=0.01)
+        plt.plot(Prof_X[Near],Prof_Y[Near],'r-',linewidth=1)
+        plt.plot(Prof_X[Big],Prof_Y[Big],'ks')
+        plt.title('connect component (full res.)')
+        plt.subplot(Nrow,3,6)
+        plt.plot(X[Near],UphaProf[Near],'.',label='unwrapped phase')
+        plt.plot(X[Near],Model[Near],label='Modeled step')
+        plt.xlabel('X')
+        plt.ylabel('unwrapped phase')
+        plt.legend()
+    plt.tight_layout()
+    if args.output:
+        plt.savefig(args.output,dpi=150)
+        print('*** Save figure to',args.output)
+    else:
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
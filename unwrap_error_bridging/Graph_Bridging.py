@@ -0,0 +1,105 @@
+# ------------------------------------------ #
+# Automatic bridging from the connect        #
+# component adjacency graph                  #
+#                                            #
+# No profile is needed: every pair of        #
+# touching connect components is an edge,    #
+# its 2 pi offset is the median phase jump   #
+# across their boundary, and the integer     #
+# shift of every connect component relative  #
+# to the one of the reference point comes    #
+# from a spanning tree (or least squares).   #
+# Bridged runs are undone by Restore_PB.py   #
+# argument: --newPairs                       #
+# Only the pairs appended by Append_Stack.py #
+# since the last bridging run                #
+# argument: --resume, --noCheckpoint         #
+# Every bridged pair committed on its own,   #
+# a killed run goes on from its last pair    #
+# ------------------------------------------ #
+
+import os
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bridge every connect component of every pair of mintpy ifgramStack.h5 from the adjacency graph of the connect components, without profiles')
+    parser.add_argument('--data','-d',type=str,required=True,help='Full path to ifgramStack.h5  [Example: /data/UAVSAR/mintpy/inputs/ifgramStack.h5]')
+    parser.add_argument('--pair','-p',type=int,nargs='+',required=False,help='Pairs that are going to be bridged. Leave blank for all pairs. [Example: -p 3 10 15 26]')
+    parser.add_argument('--resume',default=False,action='store_true',required=False,help='Go on with a --fix run that was killed: the saved detection results are reused and the pairs already bridged are skipped, once the arguments and ifgramStack.h5 are checked to be unchanged')
+    parser.add_argument('--noCheckpoint',default=False,action='store_true',required=False,help='Do not checkpoint the --fix run in Bridging_checkpoint next to ifgramStack.h5. Saves the copy of the original block and the flush of every pair, but a killed run cannot be resumed')
+    parser.add_argument('--newPairs',default=False,action='store_true',required=False,help='Only bridge the pairs appended by Append_Stack.py since the last bridging run. Cannot be used with -p')
+    parser.add_argument('--method',type=str,default='tree',choices=['tree','lsq'],required=False,help='Solve the shifts along the maximum weight spanning tree of the boundaries (tree), or by weighted least squares over all boundaries (lsq) [Default: tree]')
+    parser.add_argument('--minPixels',type=int,default=10,required=False,help='Boundaries with fewer neighbouring pixel pairs are ignored [Default: 10]')
+    parser.add_argument('--save',default=False,action='store_true',required=False,help='Save before/after/difference figures of the bridged pairs (a preview without --fix) and their mosaic next to ifgramStack.h5')
+    parser.add_argument('--fix',default=False,action='store_true',required=False,help='Fix (Bridge) it or not. Leave blank for not fixing just for checking which pairs are detected')
+    parser.add_argument('--overwrite',default=False,action='store_true',required=False,help='Merge the corrections into the latest bridging run, so Restore_PB.py undoes both at once')
+    parser.add_argument('--memory','-m',type=float,default=1024,required=False,help='Memory budget in MB for the connect component label indices held while bridging (4 B/pixel each). Building the index of one frame peaks at about 12 B/pixel, outside the budget [Default: 1024]')
+    parser.add_argument('--cacheIndex',default=False,action='store_true',required=False,help='Cache the connect component label index in connectComponent_index.h5 next to ifgramStack.h5 and reuse it in later runs')
+    parser.add_argument('--workers','-w',type=int,default=1,required=False,help='Number of worker processes. The graphs of the pairs are built in parallel [Default: 1]')
+    parser.add_argument('--prefetch',type=int,default=2,required=False,help='Pairs read ahead by a reader thread and corrected slices queued for a writer thread while a pair is processed, 0 for blocking reads and writes. The I/O wait of every stage is reported [Default: 2]')
+    parser.add_argument('--chunkCache',type=float,required=False,help='HDF5 chunk cache of ifgramStack.h5 in MB [Default: h5py default, 1 MB]')
+    args = parser.parse_args()
+
+    ## Imports
+    import numpy as np
+    np.set_printoptions(suppress=True)
+    import h5py
+    from bridging import run_graph
+    from stack_append import new_pairs
+    from stage_timer import StageTimer
+    from prefetch import set_prefetch
+    set_prefetch(args.prefetch, args.chunkCache)
+
+    ## Pass variables
+    Input = args.data
+    Fix = args.fix
+    Pairs = args.pair
+    Datadir = os.path.split(Input)[0]
+
+    print('')
+    print('Data directory:',Datadir)
+    print('Input data:',Input)
+    print('Method:',args.method,', minimum boundary pixels:',args.minPixels)
+    print('')
+    if not Fix:
+        print('*** No bridging will be performed. Only searching. To fix, put the key --fix to turn on fixing')
+        print('')
+    if args.newPairs:
+        if Pairs:
+            print('*** New pairs are found from the stack, --newPairs cannot be used with -p. ABORT!')
+            exit(1)
+        with h5py.File(Input, 'r') as f:
+            Pairs = new_pairs(f)
+        if not Pairs:
+            print('*** No pair appended since the last bridging run. Exit')
+            exit(0)
+        print('*** Only the',len(Pairs),'pairs appended since the last bridging run:',Pairs)
+        print('')
+
+    Timer = StageTimer()
+    try:
+        Results, Run = run_graph(Input, Pairs=Pairs, Fix=Fix, Workers=args.workers, Memory=args.memory, CacheIndex=args.cacheIndex,
+                                 Overwrite=args.overwrite, MinPixels=args.minPixels, Method=args.method, Timer=Timer,
+                                 Checkpoint=not args.noCheckpoint, Resume=args.resume)
+    except ValueError as Error:
+        print('*** '+str(Error)+'. ABORT!')
+        exit(1)
+    print('')
+    for Line in Timer.summary():
+        print(Line)
+    if Run is not None:
+        print('*** Bridging run',Run,'. Undo with Restore_PB.py -d',Input)
+
+    #### Quality check figures of the bridged pairs
+    if args.save:
+        from qc_figures import render_qc
+        Bridge = {i: [[2*np.pi*s, x['reference'], c, i] for c, s in sorted(x['shift'].items())] for i, x in Results.items() if x['shift']}
+        Tag = 'unwrapPhase_graph_'+str(Run) if Run is not None else 'unwrapPhase_graph_preview'
+        Outname = os.path.join(Datadir,Tag)+'.png'
+        Paths = render_qc(Input, Bridge, os.path.join(Datadir,Tag), Outname, Applied=Run is not None, Workers=args.workers)
+        print('*** Save',len(Paths),'pair figures to',os.path.join(Datadir,Tag),'and the mosaic to',Outname)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# ------------------------------------------ #
+# Rewrite unwrapPhase and connectComponent   #
+# of ifgramStack.h5 in a layout for per pair #
+# access                                     #
+#                                            #
+# MintPy picks its own chunking. The         #
+# datasets are rewritten in place as         #
+# (1, tile, tile) chunks or contiguous (then #
+# memory mapped by the bridging and restore  #
+# tools), with a choice of compression, and  #
+# the throughput of frame, profile and       #
+# window reads is reported before and after  #
+# ------------------------------------------ #
+
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rewrite unwrapPhase and connectComponent of mintpy ifgramStack.h5 in place, in a storage layout tuned for per pair access, and report the read throughput before and after')
+    parser.add_argument('--data','-d',type=str,required=True,help='Full path to ifgramStack.h5 [Example: /data/topsStack/mintpy/inputs/ifgramStack.h5]')
+    parser.add_argument('--layout',type=str,default='chunked',choices=['chunked','contiguous'],required=False,help='chunked: chunks of 1 pair by --tile x --tile pixels, resizable for Append_Stack.py. contiguous: one block per dataset, memory mapped by the bridging and restore tools when uncompressed, but of fixed size [Default: chunked]')
+    parser.add_argument('--tile','-t',type=int,default=256,required=False,help='Rows and columns of a chunk with --layout chunked [Default: 256]')
+    parser.add_argument('--compression','-c',type=str,default='none',choices=['none','gzip','lzf'],required=False,help='Compression of the chunked layout, with the shuffle filter [Default: none]')
+    parser.add_argument('--level',type=int,default=4,required=False,help='gzip level 1-9 [Default: 4]')
+    parser.add_argument('--datasets',type=str,nargs='+',default=['unwrapPhase','connectComponent'],required=False,help='Datasets to rewrite [Default: unwrapPhase connectComponent]')
+    parser.add_argument('--sample','-s',type=int,default=8,required=False,help='Number of pairs, spread over the stack, read to measure the throughput [Default: 8]')
+    parser.add_argument('--memory','-m',type=float,default=64,required=False,help='Memory budget in MB of one copy batch [Default: 64]')
+    parser.add_argument('--measure',default=False,action='store_true',required=False,help='Only print the layout and the throughput of the file, do not rewrite it')
+    args = parser.parse_args()
+
+    ## Imports
+    import numpy as np
+    import h5py
+    from stack_layout import layout_args, rewrite_layout, measure_throughput, describe
+    from stack_io import repair_swaps
+    from checkpoint import rollback
+    from stage_timer import StageTimer
+
+    ## Pass variables
+    Input = args.data
+    Names = args.datasets
+
+    def _layouts(Title):
+        print(Title)
+        with h5py.File(Input, 'r') as f:
+            for Name in Names:
+                print('  ',Name,f[Name].shape,f[Name].dtype,':',describe(f[Name]))
+
+    def _throughput():
+        return {Name: measure_throughput(Input, Name, Pairs) for Name in Names}
+
+    with h5py.File(Input, 'r') as f:
+        Missing = [x for x in Names if x not in f]
+        if Missing:
+            print('***',Missing,'not in',Input,'. ABORT!')
+            exit(1)
+        NPair = f[Names[0]].shape[0]
+        Shape = {Name: f[Name].shape for Name in Names}
+    Pairs = np.unique(np.linspace(0, NPair-1, max(1, min(args.sample, NPair))).astype(np.int64))
+
+    print('')
+    _layouts('Layout of '+Input+':')
+    print('*** Measure the throughput on',len(Pairs),'pairs',Pairs.tolist())
+    Before = _throughput()
+    if args.measure:
+        for Name in Names:
+            for Pattern, (Rate, Ms) in Before[Name].items():
+                print('  %-17s %-8s %9.1f MB/s (%8.2f ms/pair)' % (Name, Pattern, Rate, Ms))
+        exit(0)
+
+    try:
+        Args = {Name: layout_args(Shape[Name], args.layout, args.tile, args.compression, args.level) for Name in Names}
+    except ValueError as Error:
+        print('*** '+str(Error)+'. ABORT!')
+        exit(1)
+    if args.layout == 'contiguous':
+        print('*** Contiguous datasets cannot grow: Append_Stack.py rewrites them as chunks (1, 256, 256) before appending pairs')
+
+    #### Rewrite in place, pair batches through <name>_swap
+    Timer = StageTimer()
+    Rolled = rollback(Input)
+    if Rolled:
+        print('*** Roll back pairs',Rolled,'left half written by an interrupted bridging run')
+    with Timer('rewrite'):
+        with h5py.File(Input, 'r+') as f:
+            for Name in repair_swaps(f):
+                print('*** Finish the interrupted rewrite of',Name)
+            for Name in Names:
+                if rewrite_layout(f, Name, Args[Name], int(args.memory*1024**2)):
+                    print('Rewrite',Name)
+                else:
+                    print(Name,'is already in this layout')
+    _layouts('New layout:')
+    After = _throughput()
+
+    #### Throughput of the access patterns of the bridging tools
+    print('')
+    print('Throughput (best of 2 rounds)          before                         after')
+    for Name in Names:
+        for Pattern in Before[Name]:
+            (Rate0, Ms0), (Rate1, Ms1) = Before[Name][Pattern], After[Name][Pattern]
+            print('  %-17s %-8s %9.1f MB/s (%8.2f ms/pair)  %9.1f MB/s (%8.2f ms/pair)  x%.2f' % (Name, Pattern, Rate0, Ms0, Rate1, Ms1, Ms0/max(Ms1, 1e-9)))
+    print(Timer.summary()[0])
+    print('*** The space of the old datasets is given back by h5repack (which keeps the new layout)')
+
+
+if __name__ == '__main__':
+    main()
@@ -9,91 +9,79 @@
 # Updates: 2024.05.17                        #
 # Allow desgnated pair restoration           #
 # given by argument -p                       #
+#                                            #
+# Updates: 2026.10.18                        #
+# Undo runs stored as deltas in              #
+# /bridgeHistory in place, argument --list   #
+# Restore logic in bridging.restore()        #
+#                                            #
+# Updates: 2026.10.18                        #
+# Any history version in one step,           #
+# argument --version. Only the restored      #
+# pairs are read and written                 #
+# argument: --prefetch, --chunkCache         #
+# Reads and writes overlapped in threads     #
 # ------------------------------------------ #
 
-import os
-import numpy as np
-import h5py
 import argparse
-import fnmatch
-from numpy.linalg import inv
-from matplotlib import pyplot as plt
-from mintpy.objects import timeseries, sensor
-from mintpy.utils import readfile, writefile
-from mintpy.defaults.plot import *
-from mintpy import view
-
-parser = argparse.ArgumentParser(description='Restore the previous manually bridging result, remove the current one. Use when the current bridging result is not satisfactory')
-parser.add_argument('--data','-d',type=str,required=True,help='Full path to ifgramStack.h5 e.g. /data/UAVSAR/mintpy/inputs/ifgramStack.h5')
-parser.add_argument('--pair','-p',type=int,nargs='+',required=False,help='Desired pairs that need to be restored. Leave blank will restore all pairs. e.g. 3 10 15 26')
-args = parser.parse_args()
 
-## Pass variables
-Input = args.data
-Pair = args.pair
 
-if Pair: 
-    print('*** Restore pairs,',Pair)
-    print('')
+def main():
+    parser = argparse.ArgumentParser(description='Restore the previous manually bridging result, remove the current one. Use when the current bridging result is not satisfactory')
+    parser.add_argument('--data','-d',type=str,required=True,help='Full path to ifgramStack.h5 e.g. /data/UAVSAR/mintpy/inputs/ifgramStack.h5')
+    parser.add_argument('--pair','-p',type=int,nargs='+',required=False,help='Desired pairs that need to be restored. Leave blank will restore all pairs. e.g. 3 10 15 26')
+    parser.add_argument('--version','-v',type=int,required=False,help='Restore to this history version in one step: 0 is the original unwrapped phase, N the result of bridging run N (see --list). Leave blank to undo the latest run. e.g. -v 0')
+    parser.add_argument('--prefetch',type=int,default=2,required=False,help='Pairs read ahead by a reader thread and restored slices queued for a writer thread, 0 for blocking reads and writes [Default: 2]')
+    parser.add_argument('--chunkCache',type=float,required=False,help='HDF5 chunk cache of ifgramStack.h5 in MB [Default: h5py default, 1 MB]')
+    parser.add_argument('--list','-l',default=False,action='store_true',required=False,help='List the bridging history and exit. No unwrapped phase is read')
+    args = parser.parse_args()
 
-else:
-    print('*** No input pairs. Restore all pairs')
-    print('')
+    ## Imports
+    from bridging import history, restore
+    from stage_timer import StageTimer
+    from prefetch import set_prefetch
+    set_prefetch(args.prefetch, args.chunkCache)
 
-with h5py.File(Input, 'r+') as f:
-    keys = np.array(list(f.keys()))
-    mBridge_search = fnmatch.filter(keys,'unwrapPhase_mBridge_*')
-    times = str(len(mBridge_search))
-    DataSet = 'unwrapPhase_mBridge_'+times
-    ImgCount = f['unwrapPhase'].shape[0]
-    if np.any(keys == 'unwrapPhase_orig'):
-        print('***Previous manual bridging detected***')
-        if not mBridge_search:
-            if Pair:
-                print('Restoring pairs:',Pair,'from unwrapPhase_orig')
-                ResMat = np.zeros(f['unwrapPhase'].shape)
-                for i in range(ImgCount):
-                    if np.any(i in Pair):
-                        print(i,'Restore it')
-                        ResMat[i,:,:] = f['unwrapPhase_orig'][i,:,:]
-                    else:
-                        print(i,'Remains unchanged')
-                        ResMat[i,:,:] = f['unwrapPhase'][i,:,:]
+    ## Pass variables
+    Input = args.data
+    Pair = args.pair
+    List = args.list
+    Version = args.version
 
-                print('*** Creating .h5 dataset /unwrapPhase')
-                del f['unwrapPhase']
-                f.create_dataset('/unwrapPhase',data=ResMat)
+    #### List the bridging history
+    if List:
+        Runs, Legacy = history(Input)
+        for Run in Runs:
+            print('Run',Run['run'],Run['attrs'])
+            print('   pairs:',Run['pair'].tolist())
+            print('   shift (2 pi):',Run['shift'].tolist())
+            print('   front connComp:',Run['frontComp'].tolist(),' back connComp:',Run['backComp'].tolist(),' mask pair:',Run['maskPair'].tolist())
+        if Legacy:
+            print('Full copies from older versions:',Legacy)
+        if not Runs and not Legacy:
+            print('No bridging history')
+        exit(0)
 
-            else:
-                print('Move unwrapPhase_orig to unwrapPhase')
-                del f['unwrapPhase']
-                f['unwrapPhase'] = f['unwrapPhase_orig']
-                del f['unwrapPhase_orig']
+    if Pair:
+        print('*** Restore pairs,',Pair)
+        print('')
 
-        else:
-            if Pair:
-                print('Restoring pairs:',Pair,'from',DataSet)
-                ResMat = np.zeros(f['unwrapPhase'].shape)
-                for i in range(ImgCount):
-                    if np.any(i in Pair):
-                        print(i,'Restore it')
-                        ResMat[i,:,:] = f[DataSet][i,:,:]
-                    else:
-                        print(i,'Remains unchanged')
-                        ResMat[i,:,:] = f['unwrapPhase'][i,:,:]
-
-                print('*** Creating .h5 dataset /unwrapPhase')
-                del f['unwrapPhase']
-                f.create_dataset('/unwrapPhase',data=ResMat)
+    else:
+        print('*** No input pairs. Restore all pairs')
+        print('')
 
-            else:    
-                print('Move',DataSet,'to unwrapPhase')
-                del f['unwrapPhase']
-                f['unwrapPhase'] = f[DataSet]
-                del f[DataSet]
+    if Version is not None:
+        print('*** Restore to version',Version)
+        print('')
 
-    else:
-        print('Already at the original state')
-        print('Exit')
+    #### Undo the later runs in place (or restore the full copies of older versions)
+    Timer = StageTimer()
+    with Timer('restore'):
+        Restored = restore(Input, Pair, Version)
+    if Restored is not None:
+        print('Restored pairs:',Restored)
+        print(Timer.summary()[0])
 
 
+if __name__ == '__main__':
+    main()
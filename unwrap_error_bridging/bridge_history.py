@@ -0,0 +1,135 @@
+# ------------------------------------------ #
+# Bridging history of ifgramStack.h5         #
+#                                            #
+# Each --fix run is stored as compact per    #
+# pair deltas in /bridgeHistory/<run>:       #
+# pair, integer 2 pi multiple, front/back    #
+# connect component and the pair whose       #
+# connect component was used as the mask.    #
+# /unwrapPhase always holds the latest run,  #
+# earlier versions are rebuilt on demand     #
+# ------------------------------------------ #
+
+import time
+import numpy as np
+from conncomp_index import StackIndex, shift_pairs
+
+HISTORY = 'bridgeHistory'
+FIELDS = ['pair', 'shift', 'frontComp', 'backComp', 'maskPair']
+
+
+def list_history(f):
+    """Runs recorded in the file, oldest first. Only reads the small delta tables
+
+    Returns a list of dicts with the run number, its attributes and its deltas
+    """
+    if HISTORY not in f:
+        return []
+    Runs = []
+    for Name in sorted(f[HISTORY].keys(), key=int):
+        Grp = f[HISTORY][Name]
+        Run = {'run': int(Name), 'attrs': dict(Grp.attrs)}
+        for Key in FIELDS:
+            Run[Key] = Grp[Key][()]
+        Runs.append(Run)
+    return Runs
+
+
+def _write_run(Grp, Deltas):
+    for Key in FIELDS:
+        if Key in Grp:
+            del Grp[Key]
+        Grp.create_dataset(Key, data=np.asarray(Deltas[Key], dtype=np.int32))
+
+
+def record_bridge(f, Bridge, Attrs=None, Append=False):
+    """Store the corrections of one run as deltas and return the run number
+
+    Bridge maps pair -> list of [2 pi shift, front connComp, back connComp, pair of the connComp mask].
+    With Append the deltas are added to the latest run (used by --overwrite),
+    so that undoing the latest run also undoes these corrections.
+    """
+    Hist = f.require_group(HISTORY)
+    Entries = [(i, e) for i in sorted(Bridge) for e in Bridge[i]]
+    Deltas = {'pair': [i for i, _ in Entries],
+              'shift': [int(np.round(e[0]/(2*np.pi))) for _, e in Entries],
+              'frontComp': [e[1] for _, e in Entries],
+              'backComp': [e[2] for _, e in Entries],
+              'maskPair': [e[3] for _, e in Entries]}
+
+    Runs = sorted(Hist.keys(), key=int)
+    if Append and Runs:
+        Grp = Hist[Runs[-1]]
+        for Key in FIELDS:
+            Deltas[Key] = np.concatenate([Grp[Key][()], np.asarray(Deltas[Key], dtype=np.int32)])
+    else:
+        Grp = Hist.create_group(str(int(Runs[-1])+1 if Runs else 1))
+        Grp.attrs['created'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    for Key, Value in (Attrs or {}).items():
+        Grp.attrs[Key] = Value
+    # Pairs appended after this run are the new pairs of the next one (stack_append.new_pairs)
+    Grp.attrs['pairCount'] = f['unwrapPhase'].shape[0]
+    _write_run(Grp, Deltas)
+    return int(Grp.name.split('/')[-1])
+
+
+def read_version(f, Pair, Version=0, Index=None):
+    """Unwrapped phase of one pair as it was after run Version (0 is the original)
+
+    Starts from /unwrapPhase and undoes the later runs touching this pair. The
+    result equals the stored version up to float rounding of the 2 pi shifts.
+    """
+    Index = Index or StackIndex(f)
+    Upha = f['unwrapPhase'][Pair,:,:]
+    Flat = Upha.reshape(-1)
+    for Run in list_history(f):
+        if Run['run'] <= Version:
+            continue
+        for k in np.where(Run['pair'] == Pair)[0]:
+            Pix = Index[Run['maskPair'][k]].pixels(Run['backComp'][k])
+            Flat[Pix] = Flat[Pix] + Run['shift'][k]*2*np.pi
+    return Upha
+
+
+def restore_version(f, Version=None, Pairs=None, Index=None):
+    """Bring Pairs (all bridged pairs if None) back to their state after run Version, in place
+
+    Version 0 is the original stack, None the run before the latest one. The
+    corrections of all later runs are summed per pair, so every restored pair
+    is read and written once over the bounding box of its shifted connect
+    components whatever the number of runs undone, and pairs that are not
+    restored are not touched. The restored entries are removed from the later
+    runs, and a run is dropped once it is empty. Returns the restored pairs.
+    """
+    Runs = list_history(f)
+    if not Runs:
+        return []
+    if Version is None:
+        Version = Runs[-2]['run'] if len(Runs) > 1 else 0
+    Later = [Run for Run in Runs if Run['run'] > Version]
+    Sel = [np.ones(len(Run['pair']), dtype=bool) if Pairs is None else np.isin(Run['pair'], Pairs) for Run in Later]
+    Index = Index or StackIndex(f)
+
+    ## One shift list per pair over all the undone runs
+    Shifts = {}
+    for Run, S in zip(Later, Sel):
+        for k in np.where(S)[0]:
+            Shifts.setdefault(int(Run['pair'][k]), []).append((Run['maskPair'][k], Run['backComp'][k], Run['shift'][k]*2*np.pi))
+    shift_pairs(f['unwrapPhase'], Index, Shifts)
+
+    for Run, S in zip(Later, Sel):
+        if np.all(S):
+            del f[HISTORY][str(Run['run'])]
+        elif np.any(S):
+            _write_run(f[HISTORY][str(Run['run'])], {Key: Run[Key][~S] for Key in FIELDS})
+    return sorted(Shifts)
+
+
+def undo_latest(f, Pairs=None, Index=None):
+    """Undo the latest run in place for Pairs (all pairs of the run if None)
+
+    Only the pixels of the shifted connect components are read and written. The
+    restored pairs are removed from the run, and the run is dropped once it is
+    empty. Returns the restored pairs.
+    """
+    return restore_version(f, None, Pairs, Index=Index)
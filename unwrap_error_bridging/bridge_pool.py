@@ -0,0 +1,188 @@
+# ------------------------------------------ #
+# Process-pool bridging across pairs         #
+#                                            #
+# Workers open ifgramStack.h5 read-only by   #
+# themselves and only return the profile     #
+# samples, the shifted component blocks, the #
+# graph shifts or the multilooked frames.    #
+# The main process is the single writer      #
+# ------------------------------------------ #
+
+import time
+import multiprocessing as mp
+import numpy as np
+import h5py
+from stack_io import gather_pixels, gather_windows
+from conncomp_index import StackIndex, read_block, apply_shifts
+from comp_graph import graph_shifts
+from pyramid import multilook, mode_downsample
+from stage_timer import IO, count_io, thread_io, rss_mb
+from prefetch import prefetch, WriteBehind, open_stack
+
+
+def _pool(Workers):
+    # Tasks only use the importable modules, so any start method (fork or spawn) works
+    return mp.Pool(Workers)
+
+
+def _gather_task(Task):
+    Input, Name, Pairs, Rows, Cols, Half = Task
+    Read = IO['read']
+    with h5py.File(Input, 'r') as f:
+        if Half is None:
+            Out = gather_pixels(f[Name], Pairs, Rows, Cols)
+        else:
+            Out = gather_windows(f[Name], Pairs, Rows, Cols, Half=Half)
+    return Out, IO['read'] - Read
+
+
+def pool_gather(Input, Name, Pairs, Rows, Cols, Workers, Half=None):
+    """gather_pixels (or gather_windows with Half) of Input[Name], with the pairs split across Workers"""
+    Pairs = np.atleast_1d(np.asarray(Pairs, dtype=np.int64))
+    Chunks = [x for x in np.array_split(Pairs, min(Workers, max(len(Pairs), 1))) if len(x)]
+    if Workers <= 1 or len(Chunks) <= 1:
+        return _gather_task((Input, Name, Pairs, Rows, Cols, Half))[0]
+    with _pool(len(Chunks)) as Pool:
+        Out = Pool.map(_gather_task, [(Input, Name, x, Rows, Cols, Half) for x in Chunks])
+    # Bytes read by the workers are added to the counter of this process
+    count_io('read', sum(x[1] for x in Out))
+    return np.concatenate([x[0] for x in Out], axis=0)
+
+
+def _bridge_task(Task):
+    Input, Pair, Entries, Cache, Keep = Task
+    Read, Start = IO['read'], time.perf_counter()
+    with h5py.File(Input, 'r') as f:
+        Index = StackIndex(f, Cache=Cache, ReadOnly=True)
+        Shifts = [(Index[MaskPair], ConnBackInd, -AddPhase) for AddPhase, _, ConnBackInd, MaskPair in Entries]
+        Block = read_block(f['unwrapPhase'], Pair, Shifts)
+    # The block before the shift goes back with a checkpoint, for its rollback
+    Original = Block[1].copy() if Block is not None and Keep else None
+    if Block is not None:
+        Block = Block[0], apply_shifts(Block[0], Block[1], Shifts)
+    return Pair, sum(Idx.area(Label) for Idx, Label, _ in Shifts), Block, Original, IO['read'] - Read, rss_mb(), time.perf_counter() - Start
+
+
+def pool_bridge(Input, Bridge, Workers, MemoryMB=1024, Cache=False, Timer=None, Journal=None):
+    """Bridge the pairs of Bridge with Workers processes, writing from this process only
+
+    Pairs are handled in batches that fit MemoryMB. Workers read and shift the
+    bounding box of the back connect component while the file is closed here,
+    then the batch is written in pair order. The time spent on every pair (worker
+    and write), the MB it read and wrote and the resident memory of its
+    worker go to Timer when given. With Journal every pair is written
+    and recorded as one commit (see checkpoint). Returns pair -> shifted pixel count.
+    """
+    Pairs = sorted(Bridge)
+    with h5py.File(Input, 'r') as f:
+        Dset = f['unwrapPhase']
+        FrameBytes = Dset.shape[1]*Dset.shape[2]*Dset.dtype.itemsize
+    Batch = max(Workers, int(MemoryMB*1024**2 // FrameBytes))
+    Area = {}
+    with _pool(Workers) as Pool:
+        for p in range(0, len(Pairs), Batch):
+            Tasks = [(Input, i, Bridge[i], Cache, Journal is not None) for i in Pairs[p:p+Batch]]
+            Out = Pool.map(_bridge_task, Tasks)
+            with h5py.File(Input, 'r+') as f:
+                for Pair, PixCount, Block, Original, Read, RSS, Seconds in Out:
+                    Start, Write = time.perf_counter(), thread_io()[1]
+                    Area[Pair] = PixCount
+                    count_io('read', Read)
+                    if Journal:
+                        Journal.commit(f['unwrapPhase'], Pair, *(Block or (None, None)), Original)
+                    elif Block is not None:
+                        (r0, r1, c0, c1), Data = Block
+                        f['unwrapPhase'][Pair, r0:r1, c0:c1] = Data
+                        count_io('write', Data.nbytes)
+                    if Timer:
+                        Timer.add_pair(Pair, bridgeSeconds=Seconds + time.perf_counter() - Start, readMB=Read/1024**2,
+                                       writeMB=(thread_io()[1] - Write)/1024**2, rssMB=RSS)
+            if Journal:
+                Journal.settle()
+    return Area
+
+
+def _read_frames(f, Pair, Names):
+    Frames = [f[Name][Pair] for Name in Names]
+    count_io('read', sum(x.nbytes for x in Frames))
+    return Frames
+
+
+def _graph_pair(Conn, Upha, RefYX, MinPixels, Method):
+    # Connect component of the reference point, the largest one when it is not in any
+    Reference = int(Conn[RefYX]) if RefYX is not None and Conn[RefYX] > 0 else None
+    return graph_shifts(Conn, Upha, MinPixels=MinPixels, Reference=Reference, Method=Method)
+
+
+def _graph_task(Task):
+    Input, Pair, RefYX, MinPixels, Method = Task
+    Read, Start = IO['read'], time.perf_counter()
+    with h5py.File(Input, 'r') as f:
+        Conn, Upha = _read_frames(f, Pair, ['connectComponent', 'unwrapPhase'])
+    Shift, Reference, NEdge, Misclosure = _graph_pair(Conn, Upha, RefYX, MinPixels, Method)
+    return Pair, Shift, Reference, NEdge, Misclosure, IO['read'] - Read, rss_mb(), time.perf_counter() - Start
+
+
+def _graph_serial(Input, Pairs, RefYX, MinPixels, Method):
+    # One process: the frames of the next pairs are read by the prefetch thread while this one is solved
+    Out = []
+    with open_stack(Input) as f:
+        Start = time.perf_counter()
+        for Pair, (Conn, Upha) in prefetch(lambda i: _read_frames(f, i, ['connectComponent', 'unwrapPhase']), [int(i) for i in Pairs]):
+            Shift, Reference, NEdge, Misclosure = _graph_pair(Conn, Upha, RefYX, MinPixels, Method)
+            Out.append((Pair, Shift, Reference, NEdge, Misclosure, Conn.nbytes + Upha.nbytes, rss_mb(), time.perf_counter() - Start))
+            Start = time.perf_counter()
+    return Out
+
+
+def pool_graph(Input, Pairs, Workers, RefYX=None, MinPixels=10, Method='tree'):
+    """comp_graph.graph_shifts of every pair of Input, with the pairs split across Workers
+
+    Every task reads the two frames of one pair. RefYX (row, col) is the
+    reference point whose connect component stays fixed. With one worker the
+    frames of the next pairs are prefetched in a thread. Returns a list of
+    (pair, shift, reference, edges, misclosures, bytes read, resident MB of the
+    worker after the pair, seconds) in pair order.
+    """
+    Tasks = [(Input, int(i), RefYX, MinPixels, Method) for i in Pairs]
+    if Workers <= 1 or len(Tasks) <= 1:
+        return _graph_serial(Input, Pairs, RefYX, MinPixels, Method)
+    with _pool(Workers) as Pool:
+        Out = Pool.map(_graph_task, Tasks, chunksize=max(1, len(Tasks)//(4*Workers)))
+    count_io('read', sum(x[5] for x in Out))
+    return Out
+
+
+def _multilook_task(Task):
+    Input, Pair, Look = Task
+    with h5py.File(Input, 'r') as f:
+        Upha, Conn = _read_frames(f, Pair, ['unwrapPhase', 'connectComponent'])
+    return Pair, multilook(Upha, Look), mode_downsample(Conn, Look), Upha.nbytes + Conn.nbytes
+
+
+def pool_multilook(Input, Look, Group, Workers):
+    """Write the multilooked unwrapPhase and mode-downsampled connectComponent of Input to Group
+
+    Group is an open HDF5 group (see pyramid). Every task reads one pair,
+    batches of pairs are multilooked by Workers and written from this process.
+    With one worker reads and writes are overlapped with the multilooking.
+    """
+    with h5py.File(Input, 'r') as f:
+        ImgCount, Rows, Cols = f['unwrapPhase'].shape
+        ConnType = f['connectComponent'].dtype
+    Shape = (ImgCount, -(-Rows // Look), -(-Cols // Look))
+    Upha = Group.create_dataset('unwrapPhase', shape=Shape, dtype=np.float32, chunks=(1,)+Shape[1:])
+    Conn = Group.create_dataset('connectComponent', shape=Shape, dtype=ConnType, chunks=(1,)+Shape[1:])
+    Tasks = [(Input, i, Look) for i in range(ImgCount)]
+    if Workers <= 1:
+        # Reads of the next pairs and writes of the coarse frames run in threads
+        def _write(Pair, U, C):
+            Upha[Pair], Conn[Pair] = U, C
+        with open_stack(Input) as f, WriteBehind(_write) as Writer:
+            for Pair, (U, C) in prefetch(lambda i: _read_frames(f, i, ['unwrapPhase', 'connectComponent']), range(ImgCount)):
+                Writer.put(Pair, multilook(U, Look), mode_downsample(C, Look))
+        return
+    with _pool(Workers) as Pool:
+        for Pair, U, C, Read in Pool.imap(_multilook_task, Tasks, chunksize=max(1, ImgCount//(4*Workers))):
+            count_io('read', Read)
+            Upha[Pair], Conn[Pair] = U, C
@@ -0,0 +1,960 @@
+# ------------------------------------------ #
+# Profile bridging engine                    #
+#                                            #
+# Run one or several profiles (jobs) over    #
+# ifgramStack.h5 in a single pass: the       #
+# profile pixels of every job are read once, #
+# jobs are applied in order on the samples   #
+# and every bridged pair is written once     #
+# run_graph bridges all connect components   #
+# of every pair from their adjacency graph   #
+# Used by Profile_Bridging.py, Restore_PB.py #
+# and importable from other Python code      #
+# ------------------------------------------ #
+
+import os
+import sys
+import time
+import json
+import fnmatch
+import numpy as np
+import h5py
+from step_fit import step_fit, segment
+from stack_io import profile_coords, window_coords, gather_pixels, bridge_in_place, copy_pairs, swap_dataset, repair_swaps, SWAP
+from conncomp_index import StackIndex, CACHE_NAME
+from comp_search import search_components
+from closure import triplets, screen_pairs, grid_samples
+from pyramid import PYRAMID_NAME, level_name, has_level, coarse_coords
+from bridge_pool import pool_gather, pool_bridge, pool_graph, pool_multilook
+from stage_timer import StageTimer
+from prefetch import open_stack
+from detect_cache import file_identity, load_cache, save_cache, read_results, write_results
+from checkpoint import open_checkpoint, rollback
+from bridge_history import HISTORY, list_history, record_bridge, restore_version
+
+
+def make_job(Pstart, Pend, Search_step, Pairs=None, ConnPair=None, ReferenceConn=None, Name='', Multi=False, Screen=None, Coarse=None,
+             Only=None):
+    """One profile to bridge, with the same meaning as the Profile_Bridging.py arguments
+
+    Only restricts the automatic detection to these pairs (--newPairs)
+    without forcing them as -p does.
+    """
+    return {'name': Name, 'profileStart': [int(x) for x in Pstart], 'profileEnd': [int(x) for x in Pend], 'searchStep': int(Search_step),
+            'pair': list(Pairs) if Pairs else None, 'conncomponent': list(ConnPair) if ConnPair else None,
+            'refcomp': [int(x) for x in ReferenceConn] if ReferenceConn else None, 'multi': bool(Multi),
+            'screen': None if Screen is None else int(Screen), 'coarse': int(Coarse) if Coarse and Coarse > 1 else None,
+            'only': None if Only is None else [int(x) for x in Only]}
+
+
+def saved_jobs(Input, Only=None):
+    """Profiles of the latest profile bridging run of Input, to bridge the pairs Only (--newPairs)
+
+    The profiles, search step and -rc reference connect components are reused
+    as they were; -p and -c belonged to the pairs of that run and are dropped.
+    Returns an empty list when no run recorded its profiles.
+    """
+    with h5py.File(Input, 'r') as f:
+        Runs = list_history(f)
+    for Run in reversed(Runs):
+        Attrs = Run['attrs']
+        if 'jobs' in Attrs:
+            Jobs = json.loads(Attrs['jobs'])
+        elif 'profileStart' in Attrs:
+            Jobs = [make_job(Attrs['profileStart'], Attrs['profileEnd'], Attrs['searchStep'])]
+        else:
+            # Graph_Bridging.py runs have no profile
+            continue
+        return [make_job(Job['profileStart'], Job['profileEnd'], Job['searchStep'], ReferenceConn=Job.get('refcomp'), Name=Job.get('name', ''),
+                         Multi=Job.get('multi', False), Screen=Job.get('screen'), Coarse=Job.get('coarse'), Only=Only) for Job in Jobs]
+    return []
+
+
+def load_jobs(Path):
+    """Read a job file (JSON, or YAML when PyYAML is installed)
+
+    The file is a list of jobs, or a dict with a 'jobs' list. Each job has
+    profileStart, profileEnd, searchStep and optionally name, pair,
+    conncomponent, refcomp, multi, screen and coarse. Short keys (ps, pe, ss, p, c, rc, m, s) are accepted.
+    """
+    with open(Path) as f:
+        if os.path.splitext(Path)[1].lower() in ['.yml', '.yaml']:
+            import yaml
+            Content = yaml.safe_load(f)
+        else:
+            Content = json.load(f)
+    if isinstance(Content, dict):
+        Content = Content['jobs']
+    Short = {'ps': 'profileStart', 'pe': 'profileEnd', 'ss': 'searchStep', 'p': 'pair', 'c': 'conncomponent', 'rc': 'refcomp', 'm': 'multi', 's': 'screen'}
+    Jobs = []
+    for n, Job in enumerate(Content):
+        Job = {Short.get(k, k): v for k, v in Job.items()}
+        Jobs.append(make_job(Job['profileStart'], Job['profileEnd'], Job['searchStep'], Job.get('pair'),
+                             Job.get('conncomponent'), Job.get('refcomp'), Job.get('name', 'profile'+str(n+1)), Job.get('multi', False),
+                             Job.get('screen'), Job.get('coarse'), Job.get('only')))
+    return Jobs
+
+
+def check_job(Job):
+    """Message describing the job, and whether its arguments contradict each other"""
+    UserPairs, ConnPair, ReferenceConn = Job['pair'], Job['conncomponent'], Job['refcomp']
+    if Job.get('only') is not None and (UserPairs or ConnPair):
+        return False, '*** New pairs are detected automatically, --newPairs cannot be used with -p or -c. ABORT!'
+    elif Job.get('multi') and Job.get('coarse'):
+        return False, '*** Multi-step mode segments the full resolution profile, it cannot be used with --coarse. ABORT!'
+    elif Job.get('multi') and (ConnPair or ReferenceConn):
+        return False, '*** Multi-step mode searches the connect component of every segment, it cannot be used with -c or -rc. ABORT!'
+    elif Job.get('multi') and UserPairs:
+        return True, '*** Bridge user-defined pairs '+str(UserPairs)+' at every phase step along the profile to the first segment'
+    elif Job.get('multi'):
+        return True, '*** Correct for every pair. Bridge every phase step along the profile to the first segment'
+    elif ReferenceConn and ConnPair:
+        return False, '*** Choose either assigning connect component or use the reference connect component. ABORT!'
+    elif ConnPair and not UserPairs:
+        return False, '*** With user-assigned connect component pair, input ifgrm pair is needed. ABORT!'
+    elif ConnPair and (len(UserPairs)>1):
+        return False, '*** Only support 1 ifgram pair with 1 pair of connect component input. ABORT!'
+    elif UserPairs and ReferenceConn:
+        return True, '*** Bridge user-defined pairs '+str(UserPairs)+' with reference connect componeent from pair: '+str(ReferenceConn[0])+' connect component: '+str(ReferenceConn[1:3])
+    elif UserPairs and not ConnPair:
+        return True, '*** Bridge user-defined pairs '+str(UserPairs)+' search for connect components for each individual pair'
+    elif UserPairs and ConnPair:
+        return True, '*** Bridge user-defined pair '+str(UserPairs)+' with its connect component: '+str(ConnPair)
+    elif ReferenceConn:
+        return True, '*** Correct for every pair with reference connect componeent from pair: '+str(ReferenceConn[0])+' connect component: '+str(ReferenceConn[1:3])
+    return True, '*** Correct for every pair. Search for connect components for each individual pair'
+
+
+def report_name(Name, Job):
+    """Text report file name of a job: Name.txt for a single profile run, Name_<job>.txt otherwise"""
+    return Name+'_'+Job['name']+'.txt' if Job['name'] else Name+'.txt'
+
+
+def write_text(Path, Obj):
+    """Text report of Obj as printed by Python, without numpy summarizing long arrays with ..."""
+    with np.printoptions(threshold=sys.maxsize, suppress=True):
+        with open(Path,'w') as f:
+            f.write(str(Obj))
+
+
+def _pair_records(Pairs, Ind, PhaseStep, RMSE, FixPair, Prof_Y, Prof_X, Bridge, Breaks=None, Agreement=None):
+    """Detection and correction of every pair of a job, for the run report
+
+    The single values hold the largest step and the last correction; the
+    multi-step mode (Breaks) also lists every breakpoint and correction. The
+    coarse-to-fine mode adds the full resolution agreement (Agreement).
+    """
+    Records = []
+    for i in Pairs:
+        i = int(i)
+        Record = {'pair': i, 'breakpoint': int(Ind[i,0]), 'row': int(Prof_Y[Ind[i,0]]), 'col': int(Prof_X[Ind[i,0]]),
+                  'frontPhase': float(PhaseStep[i,0]), 'step': float(PhaseStep[i,1]), 'rmse': float(RMSE[i]),
+                  'fix': bool(np.any(FixPair == i)), 'frontComp': None, 'backComp': None, 'maskPair': None, 'shift': None,
+                  'agreement': (Agreement or {}).get(i)}
+        for AddPhase, Front, Back, MaskPair in Bridge.get(i, []):
+            Record.update({'frontComp': int(Front), 'backComp': int(Back), 'maskPair': int(MaskPair),
+                           'shift': int(np.round(AddPhase/(2*np.pi)))})
+        if Breaks is not None:
+            Record['breakpoints'] = Breaks[i].tolist()
+            Record['corrections'] = [{'frontComp': int(e[1]), 'backComp': int(e[2]), 'shift': int(np.round(e[0]/(2*np.pi)))} for e in Bridge.get(i, [])]
+        Records.append(Record)
+    return Records
+
+
+def _shift_samples(Upha, UphaRows, Conn, ConnRows, Bridge):
+    """Apply the corrections of Bridge to sampled unwrapped phase, in place
+
+    Upha (nrow, nsample) holds the pairs UphaRows, Conn the connect component of
+    the pairs ConnRows at the same sample points.
+    """
+    for k, i in enumerate(UphaRows):
+        for AddPhase, _, ConnBackInd, MaskPair in Bridge.get(int(i), []):
+            Upha[k] -= AddPhase*(Conn[ConnRows[MaskPair]] == ConnBackInd)
+
+
+def detect(UphaProf, Pairs, ImgCount, Force):
+    """Step fit of the profile of every pair in Pairs and the pairs that need fixing
+
+    Returns Ind (ImgCount,1), PhaseStep (ImgCount,2), FixPair and the RMSE
+    of the fit (ImgCount,), NaN for the pairs not in Pairs
+    """
+    FixIO = np.zeros([ImgCount,1])
+    Ind = np.int64(np.ones([ImgCount,1]))
+    PhaseStep = np.zeros([ImgCount,2])
+    RMSE = np.full(ImgCount, np.nan)
+    Ind[Pairs,0], PhaseStep[Pairs,:], RMSE[Pairs] = step_fit(UphaProf)
+    for i in Pairs:
+        # Determine whether this profile needs fixing
+        # step < 1 pi:skip; step > 1 pi:fix
+        if np.abs(np.nan_to_num(PhaseStep[i,1])) < np.pi and Force == 0:
+            FixIO[i] = 0
+            print('pair:',i,'No phase step detected')
+        elif np.abs(np.nan_to_num(PhaseStep[i,1])) < np.pi and Force == 1:
+            FixIO[i] = 1
+            print('*************** pair:',i,'Phase step not detected but still correct for it')
+        else:
+            FixIO[i] = 1
+            print('*************** pair:',i,'Phase step detected')
+    return Ind, PhaseStep, np.where(FixIO == 1)[0], RMSE
+
+
+def search(Job, Ind, PhaseStep, FixPair, ImgCount, Prof_Y, Prof_X, ConnFrontPt=None, ConnBackPt=None, UphaFrontWin=None, UphaBackWin=None):
+    """Connect components to bridge for the pairs in FixPair
+
+    The search samples are only needed when the job has neither -c nor -rc.
+    Returns Bridge (pair -> [[2 pi shift, front connComp, back connComp, pair of the connComp mask]])
+    and ConnCompSearch (ImgCount, 3)
+    """
+    Pstart, Pend, Search_step = Job['profileStart'], Job['profileEnd'], Job['searchStep']
+    ConnPair, ReferenceConn = Job['conncomponent'], Job['refcomp']
+
+    ## Search every sample point of every pair in one batched step
+    if not ConnPair and not ReferenceConn:
+        # Searching length: the sample points that stay on each side of the detected step
+        SearchMax = ConnFrontPt.shape[1]
+        Prof_step_X = Prof_X[Ind[FixPair,0]]
+        Prof_step_Y = Prof_Y[Ind[FixPair,0]]
+        Search_tmp1 = np.sqrt((Pend[1] - Prof_step_X)**2+(Pend[0] - Prof_step_Y)**2)/Search_step
+        Search_tmp2 = np.sqrt((Prof_step_X - Pstart[1])**2+(Prof_step_Y - Pstart[0])**2)/Search_step
+        Search_length = np.minimum(np.int64(np.floor(np.minimum(Search_tmp1, Search_tmp2))), SearchMax)
+        print('Searching for the two corresponding connect components to be fixed.....')
+        SearchFront, SearchBack, SearchCount = search_components(ConnFrontPt, ConnBackPt, UphaFrontWin, UphaBackWin,
+                                                                 PhaseStep[FixPair,0], PhaseStep[FixPair,0] + PhaseStep[FixPair,1], Search_length)
+
+    Bridge = {}
+    ConnCompSearch = np.ones((ImgCount,3))
+    for i in range(ImgCount):
+        if np.all(i != FixPair):
+            print('Skip pair',i)
+            ConnCompSearch[i,:] = [i,9999,9999]
+            continue
+
+        print('*************** Fixing pair',i,'***************')
+        Row = np.searchsorted(FixPair, i)
+        ModelPhase = PhaseStep[i,1]
+
+        if not ConnPair and not ReferenceConn:
+            # No input connect component, use the most frequent agreeing pair found by the search
+            if SearchCount[Row] == 0:
+                print('Pair',i,'no phase step detected with assignable connect components')
+                print('Skipping pair',i,'...')
+                continue
+
+            ConnFrontInd = SearchFront[Row]
+            ConnBackInd = SearchBack[Row]
+            MaskPair = i
+
+            ConnCompSearch[i,:] = [i,ConnFrontInd,ConnBackInd]
+            print('Pair',i,'Fixing connect components corresponding to',ConnFrontInd,'and',ConnBackInd)
+
+        elif ConnPair and not ReferenceConn:
+            # There are input connect components, just use them
+            ConnFrontInd = ConnPair[0]
+            ConnBackInd = ConnPair[1]
+            MaskPair = i
+            ConnCompSearch[i,:] = [i,ConnFrontInd,ConnBackInd]
+
+        elif not ConnPair and ReferenceConn:
+            # Use the area of the reference connect components
+            ConnFrontInd = ReferenceConn[1]
+            ConnBackInd = ReferenceConn[2]
+            MaskPair = ReferenceConn[0]
+            ConnCompSearch[i,:] = [i,ConnFrontInd,ConnBackInd]
+
+        # Find the phase value nearest to a factor of 2 pi
+        AddPhase = np.round(ModelPhase/(2*np.pi)) * (2*np.pi)
+        Bridge[i] = [[AddPhase,ConnFrontInd,ConnBackInd,MaskPair]]
+    return Bridge, ConnCompSearch
+
+
+def detect_multi(UphaProf, Pairs, ImgCount, Force, MinStep=np.pi):
+    """Every phase step of at least MinStep along the profile of every pair in Pairs
+
+    The profiles are cut by binary segmentation (step_fit.segment). Returns
+    Breaks and Means (pair -> breakpoints and segment means), Ind, PhaseStep
+    and RMSE as detect() for the largest step of every pair, and FixPair
+    """
+    FixIO = np.zeros([ImgCount,1])
+    Ind = np.int64(np.ones([ImgCount,1]))
+    PhaseStep = np.zeros([ImgCount,2])
+    RMSE = np.full(ImgCount, np.nan)
+    Breaks, Means = {}, {}
+    for k, i in enumerate(Pairs):
+        i = int(i)
+        Breaks[i], Means[i] = segment(UphaProf[k], MinStep=MinStep)
+        Edges = np.concatenate([[0], Breaks[i], [UphaProf.shape[1]]])
+        Model = np.repeat(Means[i], np.diff(Edges))
+        with np.errstate(invalid='ignore'):
+            RMSE[i] = np.sqrt(np.nanmean((UphaProf[k] - Model)**2)) if np.any(~np.isnan(UphaProf[k])) else np.nan
+        if len(Breaks[i]):
+            j = np.argmax(np.abs(np.diff(Means[i])))
+            Ind[i,0] = Breaks[i][j]
+            PhaseStep[i,:] = [Means[i][j], Means[i][j+1] - Means[i][j]]
+            FixIO[i] = 1
+            print('*************** pair:',i,len(Breaks[i]),'phase step(s) detected at',Breaks[i].tolist())
+        elif Force == 1:
+            PhaseStep[i,:] = [Means[i][0], 0]
+            FixIO[i] = 1
+            print('*************** pair:',i,'Phase step not detected but still correct for it')
+        else:
+            PhaseStep[i,:] = [Means[i][0], 0]
+            print('pair:',i,'No phase step detected')
+    return Breaks, Means, Ind, PhaseStep, np.where(FixIO == 1)[0], RMSE
+
+
+def search_multi(Breaks, Means, FixPair, ImgCount, ConnProf, UphaProf, MinCount=3):
+    """Connect components of every segment and their 2 pi shift to the first segment
+
+    ConnProf and UphaProf (len(FixPair), n) are the connect component and the
+    unwrapped phase along the profile. Every connect component with at least
+    MinCount valid samples on the profile takes the shift of the segment that
+    holds most of its samples, so a segment crossing several connect components
+    shifts all of them. Returns Bridge and ConnCompSearch with one row [pair,
+    front connComp, back connComp] per bridged connect component ([pair, 9999,
+    9999] for the pairs not bridged). The front connComp is the main connect
+    component of the first segment.
+    """
+    Bridge = {}
+    ConnCompSearch = []
+    for i in range(ImgCount):
+        if np.all(i != FixPair):
+            print('Skip pair',i)
+            ConnCompSearch.append([i,9999,9999])
+            continue
+
+        print('*************** Fixing pair',i,'***************')
+        Row = np.searchsorted(FixPair, i)
+        Edges = np.concatenate([[0], Breaks[i], [UphaProf.shape[1]]])
+        Seg = np.repeat(np.arange(len(Edges)-1), np.diff(Edges))
+        Ok = ~np.isnan(UphaProf[Row]) & (ConnProf[Row] > 0)
+        Lab = np.int64(ConnProf[Row][Ok])
+        if len(Lab) == 0:
+            print('Pair',i,'no connect component along the profile, skipping')
+            ConnCompSearch.append([i,9999,9999])
+            continue
+        # Valid samples of every label in every segment
+        Count = np.zeros((len(Edges)-1, Lab.max()+1), dtype=np.int64)
+        np.add.at(Count, (Seg[Ok], Lab), 1)
+        ConnFrontInd = int(np.argmax(Count[0])) if Count[0].any() else 0
+
+        for ConnBackInd in np.where(Count.max(axis=0) >= MinCount)[0]:
+            s = np.argmax(Count[:,ConnBackInd])
+            Shift = int(np.round((Means[i][s] - Means[i][0])/(2*np.pi)))
+            if Shift == 0:
+                continue
+            Bridge.setdefault(i, []).append([Shift*2*np.pi,ConnFrontInd,int(ConnBackInd),i])
+            ConnCompSearch.append([i,ConnFrontInd,ConnBackInd])
+            print('Pair',i,'Fixing connect components corresponding to',ConnFrontInd,'and',ConnBackInd,'by',Shift,'x 2 pi')
+        if i not in Bridge:
+            print('Pair',i,'no phase step detected with assignable connect components')
+            ConnCompSearch.append([i,9999,9999])
+    return Bridge, np.array(ConnCompSearch, dtype=np.float64)
+
+
+def residual_check(UphaProfBridge, FixPair, ImgCount):
+    """Step fit of the bridged profiles of FixPair. Returns the pairs with a residual phase step"""
+    FixIO = np.zeros([ImgCount,1])
+    Ind = np.int64(np.zeros([ImgCount,1]))
+    PhaseStep = np.zeros([ImgCount,2])
+    print('Check if there is residual phase step among fixed pairs',FixPair)
+    Ind[FixPair,0], PhaseStep[FixPair,:], _ = step_fit(UphaProfBridge)
+    for i in FixPair:
+        # Determine whether this profile needs fixing
+        # step < 1 pi:skip; step > 1 pi:fix
+        if np.abs(np.nan_to_num(PhaseStep[i,1])) < np.pi:
+            FixIO[i] = 0
+            print('Fixed pair:',i,'No residual phase step detected')
+        else:
+            FixIO[i] = 1
+            print('*************** Fixed pair:',i,'Residual phase step detected')
+    return np.where(FixIO == 1)[0]
+
+
+def run_jobs(Input, Jobs, Fix=False, Workers=1, Memory=1024, CacheIndex=False, Overwrite=False, Timer=None, Cache=None,
+             KeepPyramid=False, Checkpoint=True, Resume=False):
+    """Detect, search and (with Fix) bridge all jobs in one pass over the stack
+
+    Jobs are applied in order: the samples of a job already include the
+    corrections of the jobs before it, as if they were separate runs. The text
+    reports are written per job next to Input. With Fix, the corrections of all
+    jobs are written with one read and one write per pair and recorded as one
+    bridging run. Timer (a stage_timer.StageTimer) collects the time spent in
+    read, detect, search, residual and bridge. With Cache (a file path), the
+    detection and search results are stored there, and reused when the same
+    jobs run again on the unchanged Input. Jobs with coarse use the multilook
+    pyramid level in ifgramStack_pyramid.h5, kept for later runs with
+    KeepPyramid. With Fix and Checkpoint, the results and every bridged pair
+    are committed to Bridging_checkpoint/ and /bridgeHistory as they are
+    done, and Resume goes on with a killed run (see checkpoint). Returns a
+    list of per-job results and the bridging run number (None without Fix).
+    """
+    Timer = Timer or StageTimer()
+    Datadir = os.path.split(Input)[0]
+    with h5py.File(Input, 'r') as f:
+        ImgCount = f['unwrapPhase'].shape[0]
+    Journal = open_checkpoint(Input, {'jobs': Jobs, 'overwrite': Overwrite}, Resume) if Fix and Checkpoint else None
+    Kept = Journal.load_results(_read_results) if Journal and Journal.Resumed else None
+    Results = Kept if Kept is not None else (load_cache(Cache, Input, Jobs) if Cache else None)
+    if Results is not None:
+        if Kept is not None:
+            print('*** Reuse the detection and search results of the interrupted run')
+        else:
+            print('*** Reuse the detection and search results of the previous run from',Cache)
+            print('*** Remove it or use --noCache to detect and search again')
+        for Job, Result in zip(Jobs, Results):
+            print('')
+            print('Profile',Job['name'],'image pairs:\n',Result['fixPair'], 'need to be fixed.')
+            write_text(os.path.join(Datadir,report_name('Detected_phase_step',Job)), [Job['profileStart'],Job['profileEnd'],Result['fixPair']])
+            write_text(os.path.join(Datadir,report_name('ConnComp_pair_fix',Job)), Result['connCompSearch'])
+    else:
+        Results = _detect_search(Input, Jobs, Workers, Timer, KeepPyramid)
+        if Cache:
+            save_cache(Cache, Input, Jobs, Results)
+            print('*** Save detection and search results to',Cache)
+    if Journal and Kept is None:
+        Journal.save_results(lambda Path: _write_results(Path, Results))
+
+    #### Iterate again to see if there is residual phase step
+    ## Guidance for further correction
+    ## The bridged profile is rebuilt from the profile pixels, no full frame is needed
+    Bridge = {}
+    for Job, Result in zip(Jobs, Results):
+        for i, Entries in Result['bridge'].items():
+            Bridge.setdefault(i, []).extend(Entries)
+        if not Fix:
+            continue
+        with Timer('residual'):
+            Result['residualPair'] = residual_check(Result['profile'], Result['fixPair'], ImgCount)
+        print('Image pairs:\n',Result['residualPair'], 'need to be fixed. Save to',report_name('Residual_phase_step_pairs',Job))
+        write_text(os.path.join(Datadir,report_name('Residual_phase_step_pairs',Job)), Result['residualPair'])
+
+    if len(Jobs) > 1:
+        print('')
+        print('######## Summary ########')
+        for Result in Results:
+            print('Profile',Result['name'],': pairs to fix',Result['fixPair'].tolist(),', bridged',sorted(Result['bridge']),
+                  ', residual',None if Result['residualPair'] is None else Result['residualPair'].tolist())
+    if not Fix:
+        return Results, None
+
+    #### Bridge in place and record the corrections as deltas in /bridgeHistory
+    # The jobs (with -rc) are kept for the later --newPairs runs
+    Attrs = {'jobs':json.dumps(Jobs)}
+    if len(Jobs) == 1:
+        Attrs.update({'profileStart':Jobs[0]['profileStart'], 'profileEnd':Jobs[0]['profileEnd'], 'searchStep':Jobs[0]['searchStep']})
+    with Timer('bridge'):
+        Run, Area = bridge(Input, Bridge, Workers=Workers, Memory=Memory, CacheIndex=CacheIndex, Attrs=Attrs, Append=Overwrite, Timer=Timer,
+                           Journal=Journal)
+    for i in Area:
+        Timer.add_pair(i, pixels=Area[i])
+    return Results, Run
+
+
+def _write_results(Path, Results):
+    with h5py.File(Path, 'w') as c:
+        write_results(c, Results)
+
+
+def _read_results(Path):
+    with h5py.File(Path, 'r') as c:
+        return read_results(c)
+
+
+def _detect_search(Input, Jobs, Workers, Timer, KeepPyramid=False):
+    """Detection and search of every job, see run_jobs"""
+    Datadir = os.path.split(Input)[0]
+    with h5py.File(Input, 'r') as f:
+        ImgCount = f['unwrapPhase'].shape[0]
+        Shape = f['unwrapPhase'].shape[1:]
+        Trip = triplets(f['date'][()]) if any(Job.get('screen') is not None for Job in Jobs) else None
+    Grid = {}
+    Pyramid = os.path.join(Datadir,PYRAMID_NAME)
+    Built = False
+    for Look in sorted({Job['coarse'] for Job in Jobs if Job.get('coarse')}):
+        Built |= not has_level(Pyramid, Input, Look)
+        with Timer('pyramid'):
+            pyramid_level(Input, Look, Workers, Pyramid)
+
+    ## Profile pixels of every job, read once for the pairs of all jobs
+    Prof = [profile_coords(Job['profileStart'], Job['profileEnd']) for Job in Jobs]
+    Offset = np.concatenate([[0], np.cumsum([len(y) for y, _ in Prof])])
+    AllY = np.concatenate([y for y, _ in Prof])
+    AllX = np.concatenate([x for _, x in Prof])
+    # The closures of the screening need every pair
+    if all(Job['pair'] or (Job.get('only') is not None and Job.get('screen') is None) for Job in Jobs):
+        Pairs = np.unique(np.concatenate([Job['pair'] or Job['only'] for Job in Jobs]).astype(np.int64))
+    else:
+        Pairs = np.arange(0,ImgCount,1)
+    RefPairs = [Job['refcomp'][0] for Job in Jobs if Job['refcomp']]
+    ConnPairs = np.unique(np.concatenate([Pairs, np.array(RefPairs, dtype=np.int64)]))
+    UphaRow = np.full(ImgCount, -1)
+    UphaRow[Pairs] = np.arange(len(Pairs))
+    ConnRow = np.full(ImgCount, -1)
+    ConnRow[ConnPairs] = np.arange(len(ConnPairs))
+
+    print('**** Read ',Input,' ****')
+    with Timer('read'):
+        UphaAll = pool_gather(Input, 'unwrapPhase', Pairs, AllY, AllX, Workers).astype(np.float64)  ## Modify here for delicate profile setting
+        ConnAll = pool_gather(Input, 'connectComponent', ConnPairs, AllY, AllX, Workers)
+
+    Results = []
+    Bridge = {}
+    for n, Job in enumerate(Jobs):
+        Prof_Y, Prof_X = Prof[n]
+        Sl = slice(Offset[n], Offset[n+1])
+        dist = len(Prof_X)
+        if len(Jobs) > 1:
+            print('')
+            print('######## Profile',Job['name'],':',Job['profileStart'],'->',Job['profileEnd'],'search step',Job['searchStep'],'########')
+            print(check_job(Job)[1])
+
+        #### Find image pairs that need to corrected
+        ## If provided pairs, then only and forcely correct for the pairs
+        ## If pairs not provided, then do an automatic search
+        ## With --newPairs, only the pairs added since the last run are detected
+        if Job['pair']:
+            JobPairs = np.array(Job['pair'])
+        elif Job.get('only') is not None:
+            JobPairs = np.array(Job['only'], dtype=np.int64)
+        else:
+            JobPairs = np.arange(0,ImgCount,1)
+        Force = 1 if Job['pair'] else 0
+        if Job.get('screen') is not None and Job['pair']:
+            print('*** User-defined pairs are not screened by triplet closure')
+        elif Job.get('screen') is not None:
+            with Timer('screen'):
+                Flagged = _screen(Input, Job, UphaAll[:, Sl], Trip, Grid, ImgCount)
+                JobPairs = np.intersect1d(Flagged, JobPairs)
+        UphaProf = UphaAll[UphaRow[JobPairs], Sl]
+        Agreement = None
+        with Timer('detect'):
+            if Job.get('multi'):
+                Breaks, Means, Ind, PhaseStep, FixPair, RMSE = detect_multi(UphaProf, JobPairs, ImgCount, Force)
+            elif Job.get('coarse'):
+                ## Step fit on the multilook level, with the corrections of the previous jobs
+                Coarse = coarse_detect(Pyramid, Job, JobPairs, ImgCount, Force, Bridge)
+                FixPair = Coarse['fixPair']
+            else:
+                Ind, PhaseStep, FixPair, RMSE = detect(UphaProf, JobPairs, ImgCount, Force)
+        Out = [Job['profileStart'],Job['profileEnd'],FixPair]
+        print('Image pairs:\n',FixPair, 'need to be fixed.')
+        print('*** Save to',os.path.join(Datadir,report_name('Detected_phase_step',Job)))
+        print('')
+        write_text(os.path.join(Datadir,report_name('Detected_phase_step',Job)), Out)
+
+        #### Find corresponding connect component to fix the phase step
+        with Timer('search'):
+            Search = {}
+            if Job.get('coarse'):
+                ## Vote on the multilook level, confirm the candidates on the full resolution profile
+                JobBridge, ConnCompSearch, Ind, PhaseStep, RMSE, Agreement = coarse_confirm(Coarse, ImgCount, JobPairs, UphaProf,
+                                                                                            ConnAll[ConnRow[JobPairs]][:, Sl], Prof_Y, Prof_X)
+            elif Job.get('multi'):
+                ## Every segment is matched from the connect component along the profile, no window is read
+                JobBridge, ConnCompSearch = search_multi(Breaks, Means, FixPair, ImgCount,
+                                                         ConnAll[ConnRow[FixPair]][:, Sl], UphaAll[UphaRow[FixPair], Sl])
+            elif not Job['conncomponent'] and not Job['refcomp']:
+                ## Sample points of the search from both ends of the profile
+                ## The 5x5 windows include the corrections of the previous jobs
+                SearchMax = np.int64(np.floor(dist/Job['searchStep']/2)) + 1
+                FrontPt = np.clip(Job['searchStep']*np.arange(SearchMax), 0, dist-1)
+                BackPt = np.clip((dist-1) - Job['searchStep']*np.arange(SearchMax), 0, dist-1)
+                Search['ConnFrontPt'] = ConnAll[ConnRow[FixPair]][:, Offset[n]+FrontPt]
+                Search['ConnBackPt'] = ConnAll[ConnRow[FixPair]][:, Offset[n]+BackPt]
+                for Key, Pt in [('UphaFrontWin', FrontPt), ('UphaBackWin', BackPt)]:
+                    WinY, WinX = window_coords(Prof_Y[Pt], Prof_X[Pt], 2, Shape)
+                    Win = pool_gather(Input, 'unwrapPhase', FixPair, WinY.ravel(), WinX.ravel(), Workers).astype(np.float64)
+                    if Bridge:
+                        Masks = np.unique([e[3] for i in FixPair for e in Bridge.get(int(i), [])])
+                        WinConn = pool_gather(Input, 'connectComponent', Masks, WinY.ravel(), WinX.ravel(), Workers)
+                        _shift_samples(Win, FixPair, WinConn, dict(zip(Masks.tolist(), range(len(Masks)))), Bridge)
+                    Search[Key] = Win.reshape((len(FixPair),) + WinY.shape)
+            if not Job.get('multi') and not Job.get('coarse'):
+                JobBridge, ConnCompSearch = search(Job, Ind, PhaseStep, FixPair, ImgCount, Prof_Y, Prof_X, **Search)
+
+        print('*** Save searched connect component to',report_name('ConnComp_pair_fix',Job))
+        write_text(os.path.join(Datadir,report_name('ConnComp_pair_fix',Job)), ConnCompSearch)
+
+        # Later jobs see the profile samples with this job's corrections applied
+        _shift_samples(UphaAll, Pairs, ConnAll, ConnRow, JobBridge)
+        for i, Entries in JobBridge.items():
+            Bridge.setdefault(i, []).extend(Entries)
+        # The bridged profile of the fixed pairs is kept for the residual check
+        Results.append({'name': Job['name'], 'fixPair': FixPair, 'bridge': JobBridge, 'residualPair': None,
+                        'pairs': _pair_records(JobPairs, Ind, PhaseStep, RMSE, FixPair, Prof_Y, Prof_X, JobBridge,
+                                               Breaks if Job.get('multi') else None, Agreement),
+                        'connCompSearch': ConnCompSearch, 'profile': UphaAll[UphaRow[FixPair], Sl]})
+    if Built and not KeepPyramid:
+        os.remove(Pyramid)
+    return Results
+
+
+def run_graph(Input, Pairs=None, Fix=False, Workers=1, Memory=1024, CacheIndex=False, Overwrite=False,
+              MinPixels=10, Method='tree', Timer=None, Checkpoint=True, Resume=False):
+    """Bridge every connect component of every pair from the adjacency graph, without profiles
+
+    The reference point of the stack (REF_Y/REF_X attributes, the largest
+    connect component when they are missing or fall outside every component)
+    stays fixed, every other connect component is shifted by the integer 2 pi
+    offset found across its boundaries (see comp_graph). Pairs are spread over
+    Workers processes. The shifts go to ConnComp_graph_shift.txt next to Input
+    as [pair, reference, connect component, shift]. With Fix they are written
+    as one bridging run, committed pair by pair with Checkpoint and
+    resumed with Resume as in run_jobs. Returns pair -> {shift, reference,
+    edges, misclosures} and the bridging run number (None without Fix).
+    """
+    Timer = Timer or StageTimer()
+    Datadir = os.path.split(Input)[0]
+    with h5py.File(Input, 'r') as f:
+        ImgCount = f['unwrapPhase'].shape[0]
+        Attrs = f.attrs
+        RefYX = (int(Attrs['REF_Y']), int(Attrs['REF_X'])) if 'REF_Y' in Attrs and 'REF_X' in Attrs else None
+    Pairs = np.arange(ImgCount) if Pairs is None or len(Pairs) == 0 else np.asarray(Pairs, dtype=np.int64)
+    if RefYX is None:
+        print('*** No REF_Y/REF_X in',Input,', the largest connect component of every pair stays fixed')
+    else:
+        print('*** The connect component of the reference point',list(RefYX),'stays fixed')
+
+    Journal = open_checkpoint(Input, {'graph': Method, 'minPixels': MinPixels, 'pair': Pairs.tolist(), 'overwrite': Overwrite}, Resume) if Fix and Checkpoint else None
+    Out = Journal.load_results(_read_graph) if Journal and Journal.Resumed else None
+    if Out is not None:
+        print('*** Reuse the connect component graphs of the interrupted run')
+    else:
+        print('**** Build the connect component graph of',len(Pairs),'pairs ****')
+        with Timer('graph'):
+            Out = pool_graph(Input, Pairs, Workers, RefYX=RefYX, MinPixels=MinPixels, Method=Method)
+        if Journal:
+            Journal.save_results(lambda Path: _write_graph(Path, Out))
+    Results = {}
+    Bridge = {}
+    Rows = []
+    for Pair, Shift, Reference, NEdge, Misclosure, Read, RSS, Seconds in Out:
+        Results[Pair] = {'shift': Shift, 'reference': Reference, 'edges': NEdge, 'misclosures': Misclosure}
+        Timer.add_pair(Pair, graphSeconds=Seconds, readMB=Read/1024**2, rssMB=RSS)
+        if Misclosure:
+            print('Pair',Pair,':',Misclosure,'of',NEdge,'boundaries disagree with the solution')
+        if Shift:
+            Bridge[Pair] = [[2*np.pi*s, Reference, c, Pair] for c, s in sorted(Shift.items())]
+            Rows.extend([Pair, Reference, c, s] for c, s in sorted(Shift.items()))
+    print('Image pairs:\n',np.array(sorted(Bridge)), 'need to be fixed.')
+    print('*** Save connect component shifts to ConnComp_graph_shift.txt')
+    write_text(os.path.join(Datadir,'ConnComp_graph_shift.txt'), np.array(Rows, dtype=np.int64).reshape(-1, 4))
+    if not Fix or not Bridge:
+        if Journal:
+            Journal.finish()
+        return Results, None
+
+    with Timer('bridge'):
+        Run, Area = bridge(Input, Bridge, Workers=Workers, Memory=Memory, CacheIndex=CacheIndex,
+                           Attrs={'graph': Method, 'minPixels': MinPixels}, Append=Overwrite, Timer=Timer, Journal=Journal)
+    for i in Area:
+        Timer.add_pair(i, pixels=Area[i])
+    return Results, Run
+
+
+def _write_graph(Path, Out):
+    # Connect components as string keys in JSON
+    with open(Path, 'w') as f:
+        json.dump([[int(Pair), {str(c): int(x) for c, x in Shift.items()}, None if Reference is None else int(Reference), int(NEdge), int(Misclosure),
+                    int(Read), float(RSS), float(Seconds)]
+                   for Pair, Shift, Reference, NEdge, Misclosure, Read, RSS, Seconds in Out], f)
+
+
+def _read_graph(Path):
+    with open(Path) as f:
+        # The graphs are not built again: no time, I/O or memory for this run
+        return [[Pair, {int(c): x for c, x in Shift.items()}, Reference, NEdge, Misclosure, 0, 0.0, 0.0]
+                for Pair, Shift, Reference, NEdge, Misclosure, _, _, _ in json.load(f)]
+
+
+def pyramid_level(Input, Look, Workers=1, Path=None):
+    """Path of the pyramid file holding the multilook level Look of Input, built when missing or stale"""
+    Path = Path or os.path.join(os.path.split(Input)[0],PYRAMID_NAME)
+    if has_level(Path, Input, Look):
+        print('*** Reuse multilook level',Look,'from',Path)
+        return Path
+    print('*** Build multilook level',Look,'of',Input,'in',Path)
+    Identity = json.dumps(file_identity(Input), sort_keys=True)
+    with h5py.File(Path, 'a') as p:
+        # Levels of an older version of Input are dropped
+        if p.attrs.get('identity') != Identity:
+            for Name in list(p.keys()):
+                del p[Name]
+            p.attrs['identity'] = Identity
+        if level_name(Look) in p:
+            del p[level_name(Look)]
+        Group = p.create_group(level_name(Look))
+        Group.attrs['look'] = Look
+        pool_multilook(Input, Look, Group, Workers)
+        Group.attrs['complete'] = True
+    return Path
+
+
+def coarse_detect(Path, Job, Pairs, ImgCount, Force, Bridge):
+    """detect() on the profile of the multilook level Job['coarse'] stored in Path
+
+    Bridge holds the corrections of the previous jobs, applied to the coarse
+    samples. Returns the coarse job, profile, samples of every pair and the
+    detect() results, for coarse_confirm.
+    """
+    Look = Job['coarse']
+    CoarseJob = dict(Job, profileStart=coarse_coords(Job['profileStart'], Look), profileEnd=coarse_coords(Job['profileEnd'], Look),
+                     searchStep=max(1, Job['searchStep']//Look))
+    Prof_Y, Prof_X = profile_coords(CoarseJob['profileStart'], CoarseJob['profileEnd'])
+    print('*** Detect on multilook level',Look,':',len(Prof_X),'samples instead of',len(profile_coords(Job['profileStart'], Job['profileEnd'])[0]))
+    with h5py.File(Path, 'r') as p:
+        Level = p[level_name(Look)]
+        Upha = gather_pixels(Level['unwrapPhase'], np.arange(ImgCount), Prof_Y, Prof_X).astype(np.float64)
+        Conn = gather_pixels(Level['connectComponent'], np.arange(ImgCount), Prof_Y, Prof_X)
+    _shift_samples(Upha, np.arange(ImgCount), Conn, np.arange(ImgCount), Bridge)
+    Ind, PhaseStep, FixPair, RMSE = detect(Upha[Pairs], Pairs, ImgCount, Force)
+    return {'job': CoarseJob, 'profile': (Prof_Y, Prof_X), 'upha': Upha, 'conn': Conn,
+            'ind': Ind, 'phaseStep': PhaseStep, 'fixPair': FixPair, 'rmse': RMSE}
+
+
+def coarse_confirm(Coarse, ImgCount, Pairs, UphaProf, ConnProf, Prof_Y, Prof_X, MinAgree=0.5):
+    """search() on the multilook level, then confirmation of every candidate at full resolution
+
+    UphaProf, ConnProf are the full resolution profile of Pairs. The step of
+    every candidate pair is fitted again on it, and the agreement is the
+    fraction of the profile pixels of the front and back connect components
+    that lie on their side of the full resolution step. Candidates with an
+    agreement below MinAgree, or whose full resolution 2 pi shift is 0, are
+    not bridged and need a full resolution check. Returns Bridge,
+    ConnCompSearch, Ind, PhaseStep, RMSE (full resolution profile) and pair -> agreement.
+    """
+    Job, FixPair = Coarse['job'], Coarse['fixPair']
+    CoarseY, CoarseX = Coarse['profile']
+    dist = len(CoarseX)
+    Search = {}
+    if not Job['conncomponent'] and not Job['refcomp']:
+        ## The multilooked pixel is already the local mean, no window is read
+        SearchMax = np.int64(np.floor(dist/Job['searchStep']/2)) + 1
+        FrontPt = np.clip(Job['searchStep']*np.arange(SearchMax), 0, dist-1)
+        BackPt = np.clip((dist-1) - Job['searchStep']*np.arange(SearchMax), 0, dist-1)
+        Search['ConnFrontPt'] = Coarse['conn'][FixPair][:, FrontPt]
+        Search['ConnBackPt'] = Coarse['conn'][FixPair][:, BackPt]
+        Search['UphaFrontWin'] = Coarse['upha'][FixPair][:, FrontPt, None, None]
+        Search['UphaBackWin'] = Coarse['upha'][FixPair][:, BackPt, None, None]
+    CoarseBridge, ConnCompSearch = search(Job, Coarse['ind'], Coarse['phaseStep'], FixPair, ImgCount, CoarseY, CoarseX, **Search)
+
+    ## Breakpoints of the other pairs are scaled from the coarse profile
+    Ind = np.minimum(Coarse['ind']*len(Prof_X)//dist, len(Prof_X)-1)
+    PhaseStep = Coarse['phaseStep'].copy()
+    RMSE = Coarse['rmse'].copy()
+    Row = np.full(ImgCount, -1)
+    Row[Pairs] = np.arange(len(Pairs))
+    if len(FixPair):
+        Ind[FixPair,0], PhaseStep[FixPair,:], RMSE[FixPair] = step_fit(UphaProf[Row[FixPair]])
+
+    print('')
+    print('*** Confirm the multilook candidates at full resolution')
+    Bridge, Agreement = {}, {}
+    for i in sorted(CoarseBridge):
+        _, Front, Back, MaskPair = CoarseBridge[i][0]
+        AddPhase = np.round(PhaseStep[i,1]/(2*np.pi))*(2*np.pi)
+        Conn, Break = ConnProf[Row[i]], Ind[i,0]
+        if MaskPair == i:
+            Total = np.sum(Conn == Front) + np.sum(Conn == Back)
+            Agreement[i] = float((np.sum(Conn[:Break] == Front) + np.sum(Conn[Break:] == Back))/max(Total, 1))
+        else:
+            # The connect components of -rc belong to another pair
+            Agreement[i] = 1.0
+        if Agreement[i] < MinAgree or AddPhase == 0:
+            print('Pair',i,'agreement %.2f, full resolution shift %d x 2 pi: needs a full resolution check, not bridged'
+                  % (Agreement[i], np.round(AddPhase/(2*np.pi))))
+            continue
+        print('Pair',i,'agreement %.2f' % Agreement[i])
+        Bridge[i] = [[AddPhase, Front, Back, MaskPair]]
+    if Agreement:
+        print('*** Mean agreement %.3f over %d candidates, %d bridged' % (np.mean(list(Agreement.values())), len(Agreement), len(Bridge)))
+    return Bridge, ConnCompSearch, Ind, PhaseStep, RMSE, Agreement
+
+
+def _screen(Input, Job, UphaProf, Trip, Grid, ImgCount):
+    """Pairs of a job left for detection after the triplet closure screening
+
+    The closures are taken at the profile pixels, and with screen > 0 also on
+    the grid decimated by that step (read once per step, kept in Grid). A
+    pair is kept when either flags it.
+    """
+    Datadir = os.path.split(Input)[0]
+    Flagged, Unscreened, Bad = screen_pairs(UphaProf, Trip)
+    if Job['screen'] > 0:
+        if Job['screen'] not in Grid:
+            with h5py.File(Input, 'r') as f:
+                Grid[Job['screen']] = grid_samples(f['unwrapPhase'], Job['screen'])
+        GridFlagged, _, GridBad = screen_pairs(Grid[Job['screen']], Trip)
+        print('*** Pairs flagged on the grid decimated by',Job['screen'],'only:',np.setdiff1d(GridFlagged, Flagged))
+        Flagged = np.union1d(Flagged, GridFlagged)
+        Bad = np.maximum(Bad, GridBad)
+    print('*** Triplet closure screening:',len(Trip),'triplets,',len(Flagged),'of',ImgCount,'pairs left for detection')
+    if len(Unscreened):
+        print('*** Pairs in no triplet, detected without screening:',Unscreened)
+    print('*** Save to',os.path.join(Datadir,report_name('Closure_flagged_pairs',Job)))
+    write_text(os.path.join(Datadir,report_name('Closure_flagged_pairs',Job)), np.stack([Flagged, Bad[Flagged]], axis=1))
+    return Flagged
+
+
+def write_report(Path, Input, Jobs, Results, Run, Timer, Fix):
+    """Machine-readable report of a run: JSON, or NPZ when Path ends with .npz
+
+    Holds the jobs, the detection and correction of every pair (breakpoint,
+    step, RMSE, connect components, 2 pi shift), the wall time, bytes read and
+    written and memory of every stage (Timer) and the time, MB read and
+    written and resident memory of every bridged pair.
+    """
+    Meta = {'input': os.path.abspath(Input), 'fix': bool(Fix), 'run': Run, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'totalSeconds': Timer.total()}
+    JobInfo = []
+    for Job, Result in zip(Jobs, Results):
+        JobInfo.append(dict(Job, fixPair=Result['fixPair'].tolist(),
+                            residualPair=None if Result['residualPair'] is None else Result['residualPair'].tolist()))
+    if os.path.splitext(Path)[1].lower() == '.npz':
+        Records = [dict(r, job=n) for n, Result in enumerate(Results) for r in Result['pairs']]
+        Out = {Key: np.array([-1 if r[Key] is None else r[Key] for r in Records]) for Key in
+               ['job', 'pair', 'breakpoint', 'row', 'col', 'frontPhase', 'step', 'rmse', 'fix', 'frontComp', 'backComp', 'maskPair', 'shift', 'agreement']}
+        Out['stageName'] = np.array(list(Timer.Stages), dtype=str)
+        for Key in ['seconds', 'calls', 'readMB', 'writeMB', 'rssStartMB', 'rssEndMB', 'peakRSSMB', 'lifetimeMaxRSSMB']:
+            Out['stage_'+Key] = np.array([np.nan if x[Key] is None else x[Key] for x in Timer.Stages.values()])
+        Out['bridgedPair'] = np.array(list(Timer.Pairs), dtype=np.int64)
+        for Key in ['bridgeSeconds', 'graphSeconds', 'pixels', 'readMB', 'writeMB', 'rssMB']:
+            Out['bridged_'+Key] = np.array([x.get(Key, 0) for x in Timer.Pairs.values()])
+        Out['meta'] = np.array(json.dumps(dict(Meta, jobs=JobInfo)))
+        np.savez(Path, **Out)
+        return
+    Report = dict(Meta, jobs=[dict(Info, pairs=Result['pairs']) for Info, Result in zip(JobInfo, Results)],
+                  stages=Timer.Stages, pairs={str(i): x for i, x in Timer.Pairs.items()})
+    with open(Path, 'w') as f:
+        json.dump(Report, f, indent=1)
+
+
+def bridge(Input, Bridge, Workers=1, Memory=1024, CacheIndex=False, Attrs=None, Append=False, Timer=None, Journal=None):
+    """Bridge the pairs of Bridge in place and record the corrections as one run in /bridgeHistory
+
+    No copy of unwrapPhase is kept, restore() undoes a run from its deltas. With
+    Append the corrections are merged into the latest run (--overwrite). The
+    time spent on every pair goes to Timer when given. With Journal (a
+    checkpoint.Checkpoint) the run is created first and every pair is
+    written and recorded as one commit, so a killed run keeps its finished
+    pairs, and the pairs a resumed run finds committed are skipped. Returns
+    the run number and pair -> shifted pixel count
+    """
+    with h5py.File(Input, 'r') as f:
+        Runs = list_history(f)
+    if Runs:
+        print('***Previous manual bridging detected***')
+        print('Manual bridging done',len(Runs),'time(s)')
+    else:
+        print('***No previous manual bridging performed before***')
+
+    Todo = Bridge
+    if Journal:
+        Run, Done = Journal.begin(Bridge, Attrs=Attrs, Append=Append)
+        Todo = {i: Bridge[i] for i in Bridge if i not in Done}
+        if Done:
+            print('*** Resume bridging run',Run,': skip the',len(Done),'pairs already bridged',sorted(Done))
+
+    # Only the pixels of the shifted connect components of /unwrapPhase are rewritten, in place
+    print('Writing bridged pairs',sorted(Todo),'to ifgramStack.h5.....')
+    if Workers > 1:
+        Area = pool_bridge(Input, Todo, Workers, MemoryMB=Memory, Cache=CacheIndex, Timer=Timer, Journal=Journal)
+    else:
+        with open_stack(Input, 'r+') as f:
+            Area = bridge_in_place(f['unwrapPhase'], StackIndex(f, Cache=CacheIndex, MemoryMB=Memory), Todo, Timer=Timer, Journal=Journal)
+    for i in sorted(Todo):
+        print('Pair',i,'shift connect component',[int(e[2]) for e in Todo[i]],'(',Area[i],'pixels ) by',[float(e[0]) for e in Todo[i]],'rad')
+
+    if Journal:
+        Journal.finish()
+        print('Save corrections of',len(Bridge),'pairs to /'+HISTORY+'/'+str(Run))
+        return Run, Area
+
+    with h5py.File(Input, 'r+') as f:
+        if Append and Runs:
+            print('Overwriting unwrapPhase: corrections are merged into bridging run',Runs[-1]['run'])
+        Run = record_bridge(f, Bridge, Attrs=Attrs, Append=Append)
+        print('Save corrections of',len(Bridge),'pairs to /'+HISTORY+'/'+str(Run))
+    return Run, Area
+
+
+def history(Input):
+    """Bridging runs of Input (see bridge_history.list_history) and the full copies left by older versions"""
+    with h5py.File(Input, 'r') as f:
+        return list_history(f), fnmatch.filter(list(f.keys()),'unwrapPhase_*')
+
+
+def restore(Input, Pairs=None, Version=None):
+    """Bring Pairs (all pairs when None) back to history version Version, in place
+
+    Version 0 is the original stack and N the state after bridging run N,
+    None undoes the latest run. Only the restored pairs are read and written,
+    in one step whatever the number of runs undone. Files bridged by older
+    versions (unwrapPhase_orig, unwrapPhase_mBridge_*) are restored from
+    their full copies. Returns the restored pairs, None when there was
+    nothing to restore.
+    """
+    # Pairs half written by a killed --fix run are rolled back first
+    Rolled = rollback(Input)
+    if Rolled:
+        print('*** Roll back pairs',Rolled,'left half written by an interrupted bridging run')
+    with open_stack(Input, 'r+') as f:
+        for Name in repair_swaps(f):
+            print('*** Finish the interrupted move of',Name)
+        Runs = list_history(f)
+        if Runs:
+            print('***Previous manual bridging detected in /'+HISTORY+'***')
+            if Version is None:
+                print('Undo bridging run',Runs[-1]['run'])
+            else:
+                print('Undo bridging runs',[x['run'] for x in Runs if x['run'] > Version],'back to version',Version)
+            # Reuse the connect component label index when Profile_Bridging.py cached it
+            Index = StackIndex(f, Cache=os.path.isfile(os.path.join(os.path.split(Input)[0],CACHE_NAME)))
+            return restore_version(f, Version, Pairs, Index=Index)
+        return _restore_copy(f, Pairs, Version)
+
+
+def _legacy_versions(f):
+    """Full copies written by older versions: version -> dataset (0 unwrapPhase_orig, k unwrapPhase_mBridge_k)"""
+    Versions = {0: 'unwrapPhase_orig'} if 'unwrapPhase_orig' in f else {}
+    for Name in fnmatch.filter(list(f.keys()),'unwrapPhase_mBridge_*'):
+        Suffix = Name[len('unwrapPhase_mBridge_'):]
+        if Suffix.isdigit():
+            Versions[int(Suffix)] = Name
+    return Versions
+
+
+def _restore_copy(f, Pair, Version=None):
+    """Restore from the full copies of unwrapPhase written by older versions
+
+    unwrapPhase_orig holds version 0 and unwrapPhase_mBridge_k the state
+    before bridging k+1. Pairs are copied into /unwrapPhase in place with
+    batched hyperslabs, so its dtype and chunking are kept. Restoring all
+    pairs moves the copy back to /unwrapPhase and drops the later copies.
+    """
+    Versions = _legacy_versions(f)
+    if 0 not in Versions:
+        print('Already at the original state')
+        print('Exit')
+        return None
+    print('***Previous manual bridging detected***')
+    Latest = max(Versions)
+    if Version is None:
+        Version = Latest
+    if Version not in Versions:
+        raise ValueError('No full copy of version '+str(Version)+' in the file, available: '+str(sorted(Versions)))
+    DataSet = Versions[Version]
+    ImgCount = f['unwrapPhase'].shape[0]
+
+    if Pair:
+        print('Restoring pairs:',sorted(set(Pair)),'from',DataSet)
+        return copy_pairs(f[DataSet], f['unwrapPhase'], Pair)
+
+    print('Move',DataSet,'to unwrapPhase')
+    # Linked under a temporary name first, so unwrapPhase is never missing
+    f['unwrapPhase'+SWAP] = f[DataSet]
+    swap_dataset(f, 'unwrapPhase', 'unwrapPhase'+SWAP)
+    for k in sorted(Versions):
+        if k >= Version:
+            del f[Versions[k]]
+    return list(range(ImgCount))
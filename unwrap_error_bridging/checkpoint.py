@@ -0,0 +1,208 @@
+# ------------------------------------------ #
+# Checkpoint of a --fix run                  #
+#                                            #
+# Bridging_checkpoint/ next to               #
+# ifgramStack.h5 holds the detection and     #
+# search results and the state of the run.   #
+# Every pair is committed on its own: the    #
+# original block is saved, the shifted block #
+# written, its deltas appended to the run in #
+# /bridgeHistory and the file flushed. A     #
+# killed run is rolled back to its last      #
+# committed pair and --resume goes on from   #
+# there when the inputs did not change       #
+# ------------------------------------------ #
+
+import os
+import json
+import glob
+import shutil
+import numpy as np
+import h5py
+from detect_cache import file_identity
+from bridge_history import HISTORY, record_bridge
+from stage_timer import count_io
+
+CHECKPOINT_NAME = 'Bridging_checkpoint'
+
+
+class Checkpoint:
+    """Checkpoint of one --fix run on Input, Args (JSON) being what defines the run
+
+    The state is a small JSON file replaced atomically. It is 'dirty' while
+    ifgramStack.h5 is being modified, and otherwise holds the identity (size,
+    modification time) of ifgramStack.h5 after the last commit, which a
+    resumed run must find unchanged.
+    """
+
+    def __init__(self, Input, Args):
+        self.Input = Input
+        self.Args = json.dumps(Args, sort_keys=True)
+        self.Dir = os.path.join(os.path.split(Input)[0], CHECKPOINT_NAME)
+        self.State = {}
+        self.Bridge = {}
+        self.Resumed = False
+
+    def _path(self, Name):
+        return os.path.join(self.Dir, Name)
+
+    def _set(self, **Values):
+        self.State.update(Values)
+        with open(self._path('state.json.tmp'), 'w') as f:
+            json.dump(self.State, f)
+        os.replace(self._path('state.json.tmp'), self._path('state.json'))
+
+    def load(self):
+        """State of a previous run, None when there is none"""
+        if not os.path.isfile(self._path('state.json')):
+            return None
+        with open(self._path('state.json')) as f:
+            self.State = json.load(f)
+        return self.State
+
+    def start(self):
+        """Drop any previous checkpoint and start a new one"""
+        self.discard()
+        os.makedirs(self.Dir)
+        self.State = {}
+        self._set(input=os.path.abspath(self.Input), args=self.Args, stage='detect', dirty=False, identity=file_identity(self.Input))
+
+    def discard(self):
+        if os.path.isdir(self.Dir):
+            shutil.rmtree(self.Dir)
+
+    def check(self):
+        """Whether the run can be resumed: same arguments and ifgramStack.h5 unchanged since the last commit"""
+        if self.State.get('args') != self.Args:
+            return False, 'the arguments (profiles, pairs, --overwrite, ...) differ from the interrupted run'
+        if self.State.get('identity') != file_identity(self.Input):
+            return False, self.Input+' was modified after the interrupted run'
+        return True, ''
+
+    def recover(self):
+        """Roll back the pairs that were being written when the run was killed
+
+        A pair whose deltas are in the run is committed, any other pair with a
+        saved original block gets it back. Returns the rolled back pairs.
+        """
+        if not self.load() or not self.State.get('dirty'):
+            return []
+        Rolled = []
+        with h5py.File(self.Input, 'r+') as f:
+            Run, Base = self.State.get('run'), self.State.get('base', 0)
+            Committed = set()
+            if Run is not None and HISTORY in f and str(Run) in f[HISTORY]:
+                Committed = set(f[HISTORY][str(Run)]['pair'][Base:].tolist())
+            for Path in sorted(glob.glob(self._path('pair_*.npz'))):
+                Pair = int(os.path.basename(Path)[5:-4])
+                if Pair not in Committed:
+                    with np.load(Path) as Saved:
+                        r0, r1, c0, c1 = Saved['box'].tolist()
+                        f['unwrapPhase'][Pair, r0:r1, c0:c1] = Saved['block']
+                    Rolled.append(Pair)
+                os.remove(Path)
+            f.flush()
+        self._set(dirty=False, identity=file_identity(self.Input))
+        return Rolled
+
+    def save_results(self, Write):
+        """Keep the results of the detection: Write(path) writes them, the file is put in place atomically"""
+        Write(self._path('results.tmp'))
+        os.replace(self._path('results.tmp'), self._path('results'))
+        self._set(stage='bridge')
+
+    def load_results(self, Read):
+        """Read(path) of the saved results, None when the run was killed before they were saved"""
+        if not os.path.isfile(self._path('results')):
+            return None
+        return Read(self._path('results'))
+
+    def begin(self, Bridge, Attrs=None, Append=False):
+        """Create (or find again) the bridging run. Returns the run number and the pairs already committed"""
+        self.Bridge = Bridge
+        with h5py.File(self.Input, 'r+') as f:
+            if self.State.get('run') is None:
+                Runs = sorted(f[HISTORY].keys(), key=int) if HISTORY in f else []
+                Merge = bool(Append and Runs)
+                Run = int(Runs[-1]) if Merge else (int(Runs[-1])+1 if Runs else 1)
+                Base = len(f[HISTORY][str(Run)]['pair']) if Merge else 0
+                self._set(dirty=True, run=Run, base=Base, merge=Merge)
+            Run, Base = self.State['run'], self.State['base']
+            # Merging an empty correction is harmless, a new run is only created once
+            if self.State['merge'] or HISTORY not in f or str(Run) not in f[HISTORY]:
+                record_bridge(f, {}, Attrs=Attrs, Append=self.State['merge'])
+            Done = set(f[HISTORY][str(Run)]['pair'][Base:].tolist())
+            f.flush()
+        self._set(dirty=False, identity=file_identity(self.Input))
+        return Run, Done
+
+    def commit(self, Dset, Pair, Box=None, Block=None, Original=None, Map=None):
+        """Write the shifted Block of Pair over Box and record its deltas, as one transaction
+
+        Original (the block before the shift) is saved first so that a killed
+        write can be rolled back. Box None only records the deltas. With Map
+        (the memory map of Dset) the block is written through the map.
+        """
+        Path = self._path('pair_%d.npz' % Pair)
+        self._set(dirty=True)
+        if Box is not None:
+            with open(Path+'.tmp', 'wb') as f:
+                np.savez(f, box=np.array(Box), block=Original)
+            os.replace(Path+'.tmp', Path)
+            count_io('write', Original.nbytes)
+            if Map is None:
+                Dset[Pair, Box[0]:Box[1], Box[2]:Box[3]] = Block
+            else:
+                Map[Pair, Box[0]:Box[1], Box[2]:Box[3]] = Block
+                Map.flush()
+            count_io('write', Block.nbytes)
+        record_bridge(Dset.file, {Pair: self.Bridge[Pair]}, Append=True)
+        Dset.file.flush()
+        self._set(dirty=False, identity=file_identity(self.Input))
+        if os.path.isfile(Path):
+            os.remove(Path)
+
+    def settle(self):
+        """Identity of ifgramStack.h5 after it was closed between commits"""
+        self._set(identity=file_identity(self.Input))
+
+    def finish(self):
+        """The run is complete, the checkpoint is dropped"""
+        self.discard()
+
+
+def rollback(Input):
+    """Roll back the pairs a killed --fix run left half written in Input, returns them"""
+    return Checkpoint(Input, None).recover()
+
+
+def open_checkpoint(Input, Args, Resume=False):
+    """Checkpoint of a --fix run on Input, resumed from an interrupted one with Resume
+
+    Pairs a killed run was writing are always rolled back first. Without
+    Resume an interrupted run is left as it is (its committed pairs are a
+    bridging run of their own) and a new checkpoint is started. With Resume
+    the run must have the same Args and find Input unchanged, otherwise a
+    ValueError is raised.
+    """
+    Journal = Checkpoint(Input, Args)
+    Rolled = Journal.recover()
+    if Rolled:
+        print('*** Roll back pairs',Rolled,'left half written by the interrupted run')
+    if Journal.load() is None:
+        if Resume:
+            print('*** No interrupted run to resume, start a new one')
+        Journal.start()
+        return Journal
+    if not Resume:
+        if Journal.State.get('run') is not None:
+            print('*** The interrupted run kept its committed pairs as bridging run',Journal.State['run'],'(undo with Restore_PB.py)')
+        print('*** Discard the checkpoint of the interrupted run in',Journal.Dir,', use --resume to go on with it')
+        Journal.start()
+        return Journal
+    Ok, Message = Journal.check()
+    if not Ok:
+        raise ValueError('Cannot resume the interrupted run: '+Message+', run without --resume to start a new one')
+    Journal.Resumed = True
+    print('*** Resume the interrupted run from',Journal.Dir)
+    return Journal
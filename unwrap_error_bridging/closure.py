@@ -0,0 +1,97 @@
+# ------------------------------------------ #
+# Triplet phase closure screening            #
+#                                            #
+# Every three acquisitions A < B < C whose   #
+# pairs AB, BC and AC are all in /date form  #
+# a triplet with closure AB + BC - AC. An    #
+# unwrapping error of one pair shows up as   #
+# an integer 2 pi closure over part of the   #
+# samples of all of its triplets. Only the   #
+# pairs flagged here need the step fit       #
+# ------------------------------------------ #
+
+import numpy as np
+from stage_timer import count_io
+
+
+def triplets(Date):
+    """Triplets of the network as pair indices [AB, BC, AC], (ntriplet, 3)
+
+    Date is the /date dataset of ifgramStack.h5, (npair, 2) date strings.
+    Pairs listed more than once keep their first index.
+    """
+    Date = np.asarray(Date)
+    Acq, Inv = np.unique(Date.ravel(), return_inverse=True)
+    Inv = Inv.reshape(Date.shape)
+    Ref, Sec = Inv.min(axis=1), Inv.max(axis=1)
+    Index = np.full((len(Acq), len(Acq)), -1, dtype=np.int64)
+    for i in range(len(Date))[::-1]:
+        Index[Ref[i], Sec[i]] = i
+    Trip = []
+    for a in range(len(Acq)):
+        for b in np.where(Index[a] >= 0)[0]:
+            C = np.where((Index[b] >= 0) & (Index[a] >= 0))[0]
+            C = C[C > b]
+            Trip.append(np.stack([np.full(len(C), Index[a,b]), Index[b,C], Index[a,C]], axis=1))
+    return np.concatenate(Trip).astype(np.int64) if Trip else np.zeros((0, 3), dtype=np.int64)
+
+
+def triplet_closure(Samples, Trip):
+    """Closure AB + BC - AC of every triplet at every sample, (ntriplet, nsample)
+
+    Samples (npair, nsample) is the unwrapped phase of every pair (rows in
+    /date order). The median closure of the triplet is removed, so constant
+    offsets between the pairs (reference point, arbitrary 2 pi of SNAPHU) cancel.
+    """
+    Samples = np.asarray(Samples, dtype=np.float64)
+    C = Samples[Trip[:,0]] + Samples[Trip[:,1]] - Samples[Trip[:,2]]
+    with np.errstate(invalid='ignore'):
+        Med = np.nanmedian(np.where(np.isnan(C).all(axis=1, keepdims=True), 0, C), axis=1)
+    return C - Med[:,None]
+
+
+def screen_pairs(Samples, Trip, Pairs=None, Tol=np.pi/2, MinFraction=0.05, MinRatio=0.0):
+    """Pairs whose triplet closures show integer 2 pi inconsistencies
+
+    A sample is inconsistent when its closure is within Tol of a non-zero
+    multiple of 2 pi, a triplet when at least MinFraction of its valid samples
+    are. A pair is flagged when it is in an inconsistent triplet, and in at
+    least MinRatio of its triplets. Screening must not miss a bad pair, so by
+    default every pair of an inconsistent triplet is kept. Errors that cancel
+    in every triplet of a pair (two pairs of a triplet with the same jump) are
+    invisible to the closure. Pairs (default all rows of Samples) in no
+    triplet cannot be screened and are flagged too. Returns the flagged pairs,
+    the unscreened pairs and the inconsistent triplet count of every pair.
+    """
+    NPair = Samples.shape[0]
+    Pairs = np.arange(NPair) if Pairs is None else np.asarray(Pairs, dtype=np.int64)
+    Total = np.bincount(Trip.ravel(), minlength=NPair)
+    Bad = np.zeros(NPair, dtype=np.int64)
+    if len(Trip):
+        C = triplet_closure(Samples, Trip)/(2*np.pi)
+        K = np.round(C)
+        Valid = ~np.isnan(C)
+        with np.errstate(invalid='ignore'):
+            Wrong = Valid & (K != 0) & (np.abs(C - K)*2*np.pi < Tol)
+        Fraction = Wrong.sum(axis=1)/np.maximum(Valid.sum(axis=1), 1)
+        Bad = np.bincount(Trip[Fraction >= MinFraction].ravel(), minlength=NPair)
+    Unscreened = Pairs[Total[Pairs] == 0]
+    Flagged = Pairs[(Total[Pairs] == 0) | ((Bad[Pairs] > 0) & (Bad[Pairs] >= MinRatio*Total[Pairs]))]
+    return Flagged, Unscreened, Bad
+
+
+def grid_samples(Dset, Step, Pairs=None):
+    """Unwrapped phase of every pair on a grid decimated by Step, (npair, nsample)
+
+    Every pair is read as one strided hyperslab, so only one decimated frame
+    is held at a time besides the output.
+    """
+    Pairs = np.arange(Dset.shape[0]) if Pairs is None else np.asarray(Pairs, dtype=np.int64)
+    Out = None
+    for k, i in enumerate(Pairs):
+        Grid = Dset[int(i), ::Step, ::Step]
+        count_io('read', Grid.nbytes)
+        if Out is None:
+            Out = np.empty((len(Pairs), Grid.size))
+        Out[k] = Grid.ravel()
+    return Out
@@ -0,0 +1,149 @@
+# ------------------------------------------ #
+# Connect component adjacency graph          #
+#                                            #
+# Edges between touching connect components  #
+# from vectorized neighbour comparisons, the #
+# phase offset of every edge as the median   #
+# over its boundary pixels, and the integer  #
+# 2 pi shift of every connect component from #
+# a spanning tree or least squares           #
+# ------------------------------------------ #
+
+import numpy as np
+
+
+def boundary_offsets(Conn, Upha, MinPixels=10):
+    """Edges of the connect component adjacency graph of one frame
+
+    Every pair of 4-neighbour pixels with two different non-zero labels and
+    valid phase is a boundary sample of the edge (a, b), a < b, with the phase
+    difference Upha[b side] - Upha[a side]. Edges with fewer than MinPixels
+    samples are dropped. Returns Edges (m, 2), Offset (m,) the median phase
+    difference and Count (m,) the number of samples.
+    """
+    Conn = np.asarray(Conn)
+    Upha = np.asarray(Upha, dtype=np.float64)
+    A, B, D = [], [], []
+    for c1, c2, u1, u2 in [(Conn[:,:-1], Conn[:,1:], Upha[:,:-1], Upha[:,1:]),
+                           (Conn[:-1,:], Conn[1:,:], Upha[:-1,:], Upha[1:,:])]:
+        Sel = (c1 != c2) & (c1 > 0) & (c2 > 0) & ~np.isnan(u1) & ~np.isnan(u2)
+        a, b, d = c1[Sel].astype(np.int64), c2[Sel].astype(np.int64), u2[Sel] - u1[Sel]
+        Swap = a > b
+        A.append(np.where(Swap, b, a))
+        B.append(np.where(Swap, a, b))
+        D.append(np.where(Swap, -d, d))
+    A, B, D = np.concatenate(A), np.concatenate(B), np.concatenate(D)
+    if len(A) == 0:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+    # Median of every edge from one sort by (edge, difference)
+    Key = A*(B.max()+1) + B
+    Order = np.lexsort((D, Key))
+    Key, D, A, B = Key[Order], D[Order], A[Order], B[Order]
+    _, Start, Count = np.unique(Key, return_index=True, return_counts=True)
+    Offset = (D[Start + (Count-1)//2] + D[Start + Count//2])/2
+    Keep = Count >= MinPixels
+    return np.stack([A[Start], B[Start]], axis=1)[Keep], Offset[Keep], Count[Keep]
+
+
+def _parts(Labels, Edges):
+    """Connected parts of the graph (union-find), as the root label of every label"""
+    Parent = {int(x): int(x) for x in Labels}
+
+    def find(x):
+        while Parent[x] != x:
+            Parent[x] = Parent[Parent[x]]
+            x = Parent[x]
+        return x
+    return Parent, find
+
+
+def solve_shifts(Edges, Offset, Count, Area, Reference=None, Method='tree'):
+    """Integer 2 pi shift of every connect component of the graph
+
+    Edge weights are the boundary sample count, scaled down to 0 as the offset
+    gets close to half a cycle (ambiguous). Method 'tree' follows the maximum
+    weight spanning tree from the reference; 'lsq' rounds the weighted least
+    squares solution of all edges. Every connected part of the graph keeps its
+    largest connect component (by Area, the pixel count of every label) fixed,
+    and the part holding Reference keeps Reference fixed.
+    Returns Shift (label -> integer shift to subtract) and the number of edges
+    whose rounded offset disagrees with the solution (misclosures).
+    """
+    Labels = np.unique(Edges)
+    if len(Labels) == 0:
+        return {}, 0
+    Cycles = Offset/(2*np.pi)
+    K = np.round(Cycles).astype(np.int64)
+    Weight = Count*np.maximum(1 - 2*np.abs(Cycles - K), 0)
+
+    # Maximum weight spanning forest (Kruskal)
+    Parent, find = _parts(Labels, Edges)
+    Tree = []
+    for e in np.argsort(-Weight, kind='stable'):
+        if Weight[e] <= 0:
+            break
+        ra, rb = find(int(Edges[e,0])), find(int(Edges[e,1]))
+        if ra != rb:
+            Parent[ra] = rb
+            Tree.append(e)
+
+    # Fixed connect component of every part
+    Root = {}
+    for x in Labels:
+        r = find(int(x))
+        if r not in Root or Area[x] > Area[Root[r]]:
+            Root[r] = int(x)
+    if Reference is not None and int(Reference) in Parent:
+        Root[find(int(Reference))] = int(Reference)
+
+    Shift = {}
+    if Method == 'lsq':
+        Free = [int(x) for x in Labels if int(x) not in Root.values()]
+        Col = {x: k for k, x in enumerate(Free)}
+        Use = np.where(Weight > 0)[0]
+        M = np.zeros((len(Use), len(Free)))
+        for Row, e in enumerate(Use):
+            a, b = int(Edges[e,0]), int(Edges[e,1])
+            if b in Col:
+                M[Row, Col[b]] = 1
+            if a in Col:
+                M[Row, Col[a]] = -1
+        W = np.sqrt(Weight[Use])
+        x = np.linalg.lstsq(M*W[:,None], Cycles[Use]*W, rcond=None)[0] if len(Free) else []
+        Shift = {r: 0 for r in Root.values()}
+        Shift.update({Label: int(np.round(x[k])) for Label, k in Col.items()})
+    else:
+        Adj = {int(x): [] for x in Labels}
+        for e in Tree:
+            a, b = int(Edges[e,0]), int(Edges[e,1])
+            Adj[a].append((b, K[e]))
+            Adj[b].append((a, -K[e]))
+        for r in Root.values():
+            Shift[r] = 0
+            Todo = [r]
+            while Todo:
+                a = Todo.pop()
+                for b, k in Adj[a]:
+                    if b not in Shift:
+                        Shift[b] = Shift[a] + int(k)
+                        Todo.append(b)
+        for x in Labels:
+            Shift.setdefault(int(x), 0)
+
+    Misclosure = int(np.sum([Weight[e] > 0 and K[e] != Shift[int(Edges[e,1])] - Shift[int(Edges[e,0])] for e in range(len(K))]))
+    return Shift, Misclosure
+
+
+def graph_shifts(Conn, Upha, MinPixels=10, Reference=None, Method='tree'):
+    """Adjacency graph of one frame and the integer 2 pi shift of its connect components
+
+    Returns Shift (label -> shift, non-zero only), the reference connect
+    component, the number of edges and the number of misclosures
+    """
+    Edges, Offset, Count = boundary_offsets(Conn, Upha, MinPixels=MinPixels)
+    Area = np.bincount(np.asarray(Conn).ravel().astype(np.int64))
+    if Reference is None and Area.size > 1:
+        Reference = int(np.argmax(Area[1:]) + 1)
+    Shift, Misclosure = solve_shifts(Edges, Offset, Count, Area, Reference=Reference, Method=Method)
+    return {x: s for x, s in Shift.items() if s != 0}, Reference, len(Edges), Misclosure
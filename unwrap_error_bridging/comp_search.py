@@ -0,0 +1,64 @@
+# ------------------------------------------ #
+# Connect component search along a profile   #
+#                                            #
+# Evaluate every front/back sample point of  #
+# every pair at once and vote for the most   #
+# frequent (front, back) connect component   #
+# ------------------------------------------ #
+
+import numpy as np
+
+
+def window_mean(Win):
+    """NaN-aware box mean of windows (..., h, w) over the last two axes"""
+    Win = np.asarray(Win, dtype=np.float64)
+    Valid = ~np.isnan(Win)
+    Sum = np.where(Valid, Win, 0).sum(axis=(-2,-1))
+    Count = Valid.sum(axis=(-2,-1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return Sum / Count
+
+
+def search_components(ConnFront, ConnBack, UphaFrontWin, UphaBackWin, FrontModPhase, BackModPhase, SearchLength):
+    """Find the connect component pair to bridge for every pair
+
+    ConnFront, ConnBack (npair, nsample): connect component at the front and back sample points
+    UphaFrontWin, UphaBackWin (npair, nsample, h, w): unwrapped phase around those points
+    FrontModPhase, BackModPhase (npair,): modelled phase before and after the step
+    SearchLength (npair,): number of sample points to use for every pair
+
+    A sample point agrees when both local means are within 0.5 pi of the model.
+    The (front, back) pair with the most agreeing points wins, ties going to
+    the smallest labels. Returns Front, Back, Count (npair,), Count = 0 when
+    no sample point agrees.
+    """
+    nPair, nSample = ConnFront.shape
+    FrontAvg = window_mean(UphaFrontWin)
+    BackAvg = window_mean(UphaBackWin)
+    FrontModPhase = np.asarray(FrontModPhase, dtype=np.float64)[:,None]
+    BackModPhase = np.asarray(BackModPhase, dtype=np.float64)[:,None]
+    with np.errstate(invalid='ignore'):
+        IO = (FrontAvg >= (FrontModPhase - 0.5*np.pi)) & (FrontAvg <= (FrontModPhase + 0.5*np.pi)) \
+           & (BackAvg >= (BackModPhase - 0.5*np.pi)) & (BackAvg <= (BackModPhase + 0.5*np.pi))
+    IO &= np.arange(nSample)[None,:] < np.asarray(SearchLength)[:,None]
+
+    # Count agreeing (pair, front, back) triplets in one structured unique
+    PairInd, Sample = np.nonzero(IO)
+    Votes = np.empty(len(PairInd), dtype=[('pair', np.int64), ('front', np.int64), ('back', np.int64)])
+    Votes['pair'] = PairInd
+    Votes['front'] = ConnFront[PairInd, Sample]
+    Votes['back'] = ConnBack[PairInd, Sample]
+    Uniq, Count = np.unique(Votes, return_counts=True)
+
+    # Highest count per pair; the stable sort keeps the smallest labels first on ties
+    Front = np.zeros(nPair, dtype=np.int64)
+    Back = np.zeros(nPair, dtype=np.int64)
+    Best = np.zeros(nPair, dtype=np.int64)
+    Order = np.lexsort((-Count, Uniq['pair']))
+    First = np.ones(len(Order), dtype=bool)
+    First[1:] = Uniq['pair'][Order][1:] != Uniq['pair'][Order][:-1]
+    Win = Order[First]
+    Front[Uniq['pair'][Win]] = Uniq['front'][Win]
+    Back[Uniq['pair'][Win]] = Uniq['back'][Win]
+    Best[Uniq['pair'][Win]] = Count[Win]
+    return Front, Back, Best
@@ -0,0 +1,292 @@
+# ------------------------------------------ #
+# Label index of connectComponent            #
+#                                            #
+# For every pair and label: pixel count,     #
+# bounding box and sorted flat indices,      #
+# built with one argsort/bincount pass.      #
+# Optionally cached next to the stack in     #
+# connectComponent_index.h5                  #
+# ------------------------------------------ #
+
+import os
+import time
+from collections import OrderedDict
+import numpy as np
+import h5py
+from stage_timer import count_io, thread_io, rss_mb
+from stack_layout import mapped_array
+
+CACHE_NAME = 'connectComponent_index.h5'
+BBOX_SLICE = 1 << 20    # pixels of Order turned into rows and columns at a time
+
+
+class LabelIndex:
+    """Pixels of every connect component label of one frame"""
+
+    def __init__(self, Shape, Order, Start, Count, BBox):
+        self.Shape = tuple(int(x) for x in Shape)
+        self.Order = Order      # flat pixel indices sorted by label
+        self.Start = Start      # offset of each label in Order
+        self.Count = Count      # pixel count of each label
+        self.BBox = BBox        # [row0, row1, col0, col1) of each label
+
+    @classmethod
+    def from_frame(cls, Conn):
+        Flat = np.asarray(Conn).ravel()
+        if Flat.size and Flat.min() < 0:
+            raise ValueError('connectComponent labels must be non-negative')
+        # int32 pixel indices (4 B/pixel) unless the frame is too large for them
+        Order = np.argsort(Flat, kind='stable')
+        Order = Order.astype(np.int32 if Flat.size < 2**31 else np.int64, copy=False)
+        Count = np.bincount(Flat, minlength=1).astype(np.int64)
+        Start = np.concatenate([[0], np.cumsum(Count)[:-1]])
+        End = Start + Count
+
+        # Bounding box of every non-empty label from the sorted pixel indices,
+        # in slices of Order so that only a slice is held as rows and columns
+        BBox = np.zeros((len(Count), 4), dtype=np.int64)
+        Has = np.where(Count > 0)[0]
+        BBox[Has] = [Conn.shape[0], -1, Conn.shape[1], -1]
+        for i in range(0, Flat.size, BBOX_SLICE):
+            j = min(i+BBOX_SLICE, Flat.size)
+            Label = Has[(Start[Has] < j) & (End[Has] > i)]
+            Cut = np.maximum(Start[Label], i) - i
+            Rows, Cols = np.divmod(Order[i:j], Conn.shape[1])
+            BBox[Label,0] = np.minimum(BBox[Label,0], np.minimum.reduceat(Rows, Cut))
+            BBox[Label,1] = np.maximum(BBox[Label,1], np.maximum.reduceat(Rows, Cut))
+            BBox[Label,2] = np.minimum(BBox[Label,2], np.minimum.reduceat(Cols, Cut))
+            BBox[Label,3] = np.maximum(BBox[Label,3], np.maximum.reduceat(Cols, Cut))
+        BBox[Has,1] += 1
+        BBox[Has,3] += 1
+        return cls(Conn.shape, Order, Start, Count, BBox)
+
+    @property
+    def nbytes(self):
+        return self.Order.nbytes + self.Start.nbytes + self.Count.nbytes + self.BBox.nbytes
+
+    def area(self, Label):
+        """Pixel count of Label"""
+        Label = int(Label)
+        return int(self.Count[Label]) if 0 <= Label < len(self.Count) else 0
+
+    def bbox(self, Label):
+        """Bounding box [row0, row1, col0, col1) of Label"""
+        return tuple(int(x) for x in self.BBox[int(Label)])
+
+    def pixels(self, Label):
+        """Sorted flat indices of the pixels of Label"""
+        Label = int(Label)
+        if not 0 <= Label < len(self.Count):
+            return np.zeros(0, dtype=np.int64)
+        return self.Order[self.Start[Label]:self.Start[Label]+self.Count[Label]]
+
+    def mask(self, Label):
+        """Boolean mask of Label over the full frame"""
+        Mask = np.zeros(self.Shape[0]*self.Shape[1], dtype=bool)
+        Mask[self.pixels(Label)] = True
+        return Mask.reshape(self.Shape)
+
+    def save(self, Grp):
+        Grp.attrs['shape'] = self.Shape
+        for Key, Value in [('order', self.Order), ('start', self.Start), ('count', self.Count), ('bbox', self.BBox)]:
+            if Key in Grp:
+                del Grp[Key]
+            Grp.create_dataset(Key, data=Value)
+
+    @classmethod
+    def load(cls, Grp):
+        return cls(Grp.attrs['shape'], Grp['order'][()], Grp['start'][()], Grp['count'][()], Grp['bbox'][()])
+
+
+def _pair_key(f, Pair):
+    """Identity of a pair to validate the cache: the date pair when the stack has one"""
+    if 'date' in f:
+        return '_'.join(x.decode() if isinstance(x, bytes) else str(x) for x in f['date'][Pair])
+    return str(Pair)
+
+
+class StackIndex:
+    """Label index of every pair of a stack, built on demand
+
+    Indices are kept in memory up to MemoryMB (least recently used dropped first).
+    With Cache, they are also written to connectComponent_index.h5 next to the
+    stack and reused by later runs when the pair dates and frame shape match.
+    With ReadOnly the cache is used but never written (for parallel workers).
+    """
+
+    def __init__(self, f, Cache=False, MemoryMB=1024, ReadOnly=False):
+        self.f = f
+        self.MemoryMB = MemoryMB
+        self.ReadOnly = ReadOnly
+        self.Memo = OrderedDict()
+        self.CachePath = os.path.join(os.path.split(f.filename)[0], CACHE_NAME) if Cache else None
+
+    def _from_cache(self, Pair, Key):
+        if not self.CachePath or not os.path.isfile(self.CachePath):
+            return None
+        with h5py.File(self.CachePath, 'r') as c:
+            Name = str(Pair)
+            if Name in c and c[Name].attrs.get('pairKey') == Key and tuple(c[Name].attrs['shape']) == self.f['connectComponent'].shape[1:]:
+                return LabelIndex.load(c[Name])
+        return None
+
+    def _to_cache(self, Pair, Key, Idx):
+        with h5py.File(self.CachePath, 'a') as c:
+            Grp = c.require_group(str(Pair))
+            Idx.save(Grp)
+            Grp.attrs['pairKey'] = Key
+
+    def __getitem__(self, Pair):
+        Pair = int(Pair)
+        if Pair in self.Memo:
+            self.Memo.move_to_end(Pair)
+            return self.Memo[Pair]
+        Key = _pair_key(self.f, Pair)
+        Idx = self._from_cache(Pair, Key)
+        if Idx is None:
+            Frame = self.f['connectComponent'][Pair,:,:]
+            count_io('read', Frame.nbytes)
+            Idx = LabelIndex.from_frame(Frame)
+            if self.CachePath and not self.ReadOnly:
+                self._to_cache(Pair, Key, Idx)
+        self.Memo[Pair] = Idx
+        while len(self.Memo) > 1 and sum(x.nbytes for x in self.Memo.values()) > self.MemoryMB*1024**2:
+            self.Memo.popitem(last=False)
+        return Idx
+
+
+def read_block(Dset, Pair, Shifts):
+    """Read Dset[Pair] once over the union bounding box of the labels of Shifts
+
+    Shifts is a list of (LabelIndex, Label, Value). Returns (r0, r1, c0, c1), Block,
+    or None when no label has a pixel
+    """
+    Shifts = [(Idx, Label, Value) for Idx, Label, Value in Shifts if Idx.area(Label) > 0]
+    if not Shifts:
+        return None
+    Box = np.array([Idx.bbox(Label) for Idx, Label, _ in Shifts])
+    r0, r1, c0, c1 = Box[:,0].min(), Box[:,1].max(), Box[:,2].min(), Box[:,3].max()
+    Block = Dset[Pair, r0:r1, c0:c1]
+    count_io('read', Block.nbytes)
+    return (int(r0), int(r1), int(c0), int(c1)), Block
+
+
+def apply_shifts(Box, Block, Shifts):
+    """Add the Value of every (LabelIndex, Label, Value) of Shifts to its pixels in Block read over Box"""
+    r0, r1, c0, c1 = Box
+    Flat = Block.reshape(-1)
+    for Idx, Label, Value in Shifts:
+        Pix = Idx.pixels(Label)
+        Local = (Pix // Idx.Shape[1] - r0)*(c1 - c0) + (Pix % Idx.Shape[1] - c0)
+        # Add in float64 whatever the type of Value, then store in the dataset dtype
+        Flat[Local] = Flat[Local] + np.float64(Value)
+    return Block
+
+
+def shift_mapped(Map, Pair, Shifts):
+    """Add the Value of every (LabelIndex, Label, Value) of Shifts to its pixels of Map[Pair], in place
+
+    Map is the memory map of the dataset (stack_layout.mapped_array): only the
+    pixels of the labels are read and written. Returns the shifted pixel count.
+    """
+    Count = 0
+    for Idx, Label, Value in Shifts:
+        Rows, Cols = np.divmod(Idx.pixels(Label), Idx.Shape[1])
+        Map[Pair, Rows, Cols] = Map[Pair, Rows, Cols] + np.float64(Value)
+        count_io('read', len(Rows)*Map.dtype.itemsize)
+        count_io('write', len(Rows)*Map.dtype.itemsize)
+        Count += len(Rows)
+    return Count
+
+
+def shifted_block(Dset, Pair, Shifts):
+    """Read Dset[Pair] once over the union bounding box of several labels and shift them
+
+    Shifts is a list of (LabelIndex, Label, Value): Value is added to the pixels
+    of Label. Returns (r0, r1, c0, c1), Block, or None when no label has a pixel
+    """
+    Out = read_block(Dset, Pair, Shifts)
+    if Out is None:
+        return None
+    return Out[0], apply_shifts(Out[0], Out[1], Shifts)
+
+
+def shift_component(Dset, Pair, Shifts):
+    """Apply Shifts [(LabelIndex, Label, Value), ...] to Dset[Pair] with one read and one write
+
+    Only the bounding box of the labels is read and written. Returns the shifted pixel count.
+    """
+    Out = shifted_block(Dset, Pair, Shifts)
+    if Out is None:
+        return 0
+    (r0, r1, c0, c1), Block = Out
+    Dset[Pair, r0:r1, c0:c1] = Block
+    count_io('write', Block.nbytes)
+    return sum(Idx.area(Label) for Idx, Label, _ in Shifts)
+
+
+def shift_pairs(Dset, Index, Shifts, Timer=None, Key='bridgeSeconds', Journal=None):
+    """shift_component of many pairs with their I/O overlapped with the shifting
+
+    Shifts maps pair -> [(mask pair, Label, Value), ...], the labels being
+    looked up in Index (a StackIndex). The label index and the block of the
+    next pairs are read by a prefetch thread and the shifted blocks written by
+    a write-behind thread (see prefetch), so only one frame of each pair is
+    read and written. An uncompressed contiguous dataset is memory mapped
+    and only the pixels of the labels are shifted, in place. The time spent
+    on every pair goes to Timer under Key, with the MB it read (label index
+    and block, in the prefetch thread) and wrote, and the resident memory
+    after it (rssMB). With Journal (a
+    checkpoint.Checkpoint) every pair is written and recorded as one
+    commit. Returns pair -> shifted pixel count.
+    """
+    from prefetch import prefetch, WriteBehind
+
+    Map = mapped_array(Dset, 'r+')
+    # A commit saves the block before the shift, so a journaled pair still goes through a block
+    Direct = Map is not None and not Journal
+
+    def _read(Pair):
+        Read = thread_io()[0]
+        Resolved = [(Index[MaskPair], Label, Value) for MaskPair, Label, Value in Shifts[Pair]]
+        Out = None
+        if not Direct:
+            Out = read_block(Dset if Map is None else Map, Pair, Resolved)
+            if Out is not None and Map is not None:
+                Out = Out[0], np.array(Out[1])
+        return Resolved, Out, thread_io()[0] - Read
+
+    def _write(Pair, Box, Block, Original=None):
+        Write = thread_io()[1]
+        if Journal:
+            Journal.commit(Dset, Pair, Box, Block, Original, Map=Map)
+        else:
+            Dset[Pair, Box[0]:Box[1], Box[2]:Box[3]] = Block
+            count_io('write', Block.nbytes)
+        if Timer:
+            Timer.add_pair(Pair, writeMB=(thread_io()[1] - Write)/1024**2)
+
+    Area = {}
+    Start = time.perf_counter()
+    with WriteBehind(_write) as Writer:
+        for Pair, (Resolved, Out, Read) in prefetch(_read, sorted(Shifts)):
+            Area[Pair] = 0
+            if Direct:
+                Read0, Write0 = thread_io()
+                Area[Pair] = shift_mapped(Map, Pair, Resolved)
+                Read += thread_io()[0] - Read0
+                if Timer:
+                    Timer.add_pair(Pair, writeMB=(thread_io()[1] - Write0)/1024**2)
+            elif Out is not None:
+                # The block before the shift is kept for the rollback of the commit
+                Original = Out[1].copy() if Journal else None
+                Writer.put(Pair, Out[0], apply_shifts(Out[0], Out[1], Resolved), Original)
+                Area[Pair] = sum(Idx.area(Label) for Idx, Label, _ in Resolved)
+            elif Journal:
+                Writer.put(Pair, None, None, None)
+            if Timer:
+                Timer.add_pair(Pair, readMB=Read/1024**2, rssMB=rss_mb(), **{Key: time.perf_counter() - Start})
+            Start = time.perf_counter()
+    if Direct:
+        Map.flush()
+    return Area
@@ -0,0 +1,82 @@
+# ------------------------------------------ #
+# Cache of the detection and search results  #
+#                                            #
+# A check-only run stores its results in     #
+# Bridging_cache.h5 next to ifgramStack.h5.  #
+# The --fix run with the same file (path,    #
+# size, modification time) and the same      #
+# profiles reuses them instead of reading    #
+# and fitting the profiles again. Bridging   #
+# modifies the file, which invalidates them  #
+# ------------------------------------------ #
+
+import os
+import json
+import hashlib
+import numpy as np
+import h5py
+
+CACHE_NAME = 'Bridging_cache.h5'
+
+
+def file_identity(Input):
+    """Path, size and modification time of Input"""
+    Stat = os.stat(Input)
+    return {'path': os.path.abspath(Input), 'size': Stat.st_size, 'mtime': Stat.st_mtime_ns}
+
+
+def cache_key(Input, Jobs):
+    """Name of the cache entry of Jobs on Input, and the identity of Input"""
+    Identity = json.dumps(file_identity(Input), sort_keys=True)
+    Args = json.dumps(Jobs, sort_keys=True)
+    return hashlib.sha1((Identity+Args).encode()).hexdigest(), Identity
+
+
+def load_cache(Path, Input, Jobs):
+    """Results of a previous run of Jobs on the unchanged Input, None when there is none"""
+    if not os.path.isfile(Path):
+        return None
+    Key, _ = cache_key(Input, Jobs)
+    with h5py.File(Path, 'r') as c:
+        if Key not in c:
+            return None
+        return read_results(c[Key])
+
+
+def read_results(Entry):
+    """Per-job results stored by write_results in the group Entry"""
+    Results = []
+    for n in range(Entry.attrs['njob']):
+        Grp = Entry[str(n)]
+        Bridge = {int(i): Entries for i, Entries in json.loads(Grp.attrs['bridge']).items()}
+        Results.append({'name': Grp.attrs['name'], 'fixPair': Grp['fixPair'][()], 'bridge': Bridge, 'residualPair': None,
+                        'pairs': json.loads(Grp.attrs['pairs']), 'connCompSearch': Grp['connCompSearch'][()],
+                        'profile': Grp['profile'][()]})
+    return Results
+
+
+def save_cache(Path, Input, Jobs, Results):
+    """Store Results of Jobs on Input. Entries of an older version of Input are dropped"""
+    Key, Identity = cache_key(Input, Jobs)
+    with h5py.File(Path, 'a') as c:
+        for Name in list(c.keys()):
+            if c[Name].attrs.get('identity') != Identity or Name == Key:
+                del c[Name]
+        Entry = c.create_group(Key)
+        Entry.attrs['identity'] = Identity
+        Entry.attrs['jobs'] = json.dumps(Jobs)
+        write_results(Entry, Results)
+
+
+def write_results(Entry, Results):
+    """Store the per-job results of run_jobs (detection, search, bridged profile) in the group Entry"""
+    Entry.attrs['njob'] = len(Results)
+    for n, Result in enumerate(Results):
+        Grp = Entry.create_group(str(n))
+        Grp.attrs['name'] = Result['name']
+        Grp.attrs['bridge'] = json.dumps({str(i): [[float(e[0])]+[int(x) for x in e[1:]] for e in Entries]
+                                          for i, Entries in Result['bridge'].items()})
+        Grp.attrs['pairs'] = json.dumps(Result['pairs'])
+        Grp.create_dataset('fixPair', data=np.asarray(Result['fixPair'], dtype=np.int64))
+        Grp.create_dataset('connCompSearch', data=Result['connCompSearch'])
+        Grp.create_dataset('profile', data=Result['profile'])
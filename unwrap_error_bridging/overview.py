@@ -0,0 +1,53 @@
+# ------------------------------------------ #
+# Decimated overviews of ifgramStack.h5 for  #
+# figures                                    #
+#                                            #
+# A frame is read as one strided hyperslab   #
+# that fits the pixel budget of a panel, or  #
+# from a multilook level kept by             #
+# Profile_Bridging.py --keepPyramid. Full    #
+# resolution is only read for small windows  #
+# ------------------------------------------ #
+
+import os
+import numpy as np
+import h5py
+from pyramid import PYRAMID_NAME, level_name, has_level
+from stage_timer import count_io
+
+
+def overview_step(Shape, MaxPixels):
+    """Decimation step so that the longest side of Shape fits in MaxPixels"""
+    return max(1, -(-max(Shape) // int(MaxPixels)))
+
+
+def read_overview(Input, Name, Pair, Step, Pyramid=True):
+    """Frame Pair of Input[Name] decimated by about Step, and the step actually used
+
+    With Pyramid, the coarsest level of ifgramStack_pyramid.h5 with a look
+    of at most Step is used when it is up to date (multilooked phase and
+    most frequent label instead of single pixels).
+    """
+    Path = os.path.join(os.path.split(Input)[0],PYRAMID_NAME)
+    if Pyramid and Step > 1 and os.path.isfile(Path):
+        for Look in range(Step, 1, -1):
+            if has_level(Path, Input, Look):
+                Sub = Step // Look
+                with h5py.File(Path, 'r') as p:
+                    Frame = p[level_name(Look)][Name][Pair, ::Sub, ::Sub]
+                count_io('read', Frame.nbytes)
+                return Frame, Look*Sub
+    with h5py.File(Input, 'r') as f:
+        Frame = f[Name][Pair, ::Step, ::Step]
+    count_io('read', Frame.nbytes)
+    return Frame, Step
+
+
+def polyline(Prof_Y, Prof_X, MaxVertices=200):
+    """Indices of at most MaxVertices profile points, both ends included, to draw the profile as a line"""
+    return np.unique(np.round(np.linspace(0, len(Prof_X)-1, min(len(Prof_X), MaxVertices))).astype(np.int64))
+
+
+def window_slices(Shape, Row, Col, Half):
+    """Row and column slices of the (2*Half+1)^2 window centred on Row, Col, clipped to the frame"""
+    return (slice(max(0, Row-Half), min(Shape[0], Row+Half+1)), slice(max(0, Col-Half), min(Shape[1], Col+Half+1)))
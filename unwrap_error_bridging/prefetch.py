@@ -0,0 +1,154 @@
+# ------------------------------------------ #
+# Overlap HDF5 I/O with computation          #
+#                                            #
+# A reader thread fills a bounded queue with #
+# the next pairs while the current one is    #
+# processed, and a writer thread drains a    #
+# bounded queue of corrected slices. The     #
+# time the main thread still waits for I/O   #
+# is counted through count_wait, and the     #
+# HDF5 chunk cache size is set when the      #
+# stack is opened                            #
+# ------------------------------------------ #
+
+import time
+import queue
+import threading
+import h5py
+from stage_timer import count_wait
+
+# Queue depth (pairs read ahead / slices waiting to be written, 0 for plain
+# blocking I/O) and HDF5 chunk cache in MB (None keeps the h5py default)
+PREFETCH = {'depth': 2, 'cacheMB': None}
+
+_DONE = object()
+
+
+def set_prefetch(Depth=None, CacheMB=None):
+    """Set the queue depth and the chunk cache size used by this process"""
+    if Depth is not None:
+        PREFETCH['depth'] = max(0, int(Depth))
+    if CacheMB is not None:
+        PREFETCH['cacheMB'] = float(CacheMB)
+
+
+def open_stack(Input, Mode='r'):
+    """h5py.File of Input with the chunk cache of PREFETCH['cacheMB']"""
+    if not PREFETCH['cacheMB']:
+        return h5py.File(Input, Mode)
+    return h5py.File(Input, Mode, rdcc_nbytes=int(PREFETCH['cacheMB']*1024**2), rdcc_nslots=100003)
+
+
+def _put(Queue, Item, Stop):
+    # Give up when the consumer has stopped, so the thread never blocks forever
+    while not Stop.is_set():
+        try:
+            Queue.put(Item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def prefetch(Read, Keys, Depth=None):
+    """Yield (key, Read(key)) for every key, with Read running up to Depth keys ahead in a thread
+
+    The main thread only blocks when the reader is behind, and that time is
+    counted as I/O wait. Errors of Read are raised here. With Depth 0 the
+    keys are read in turn and the whole read counts as wait.
+    """
+    Depth = PREFETCH['depth'] if Depth is None else Depth
+    if Depth <= 0:
+        for Key in Keys:
+            Start = time.perf_counter()
+            Data = Read(Key)
+            count_wait(time.perf_counter() - Start)
+            yield Key, Data
+        return
+
+    Queue = queue.Queue(Depth)
+    Stop = threading.Event()
+
+    def _reader():
+        try:
+            for Key in Keys:
+                if not _put(Queue, (Key, Read(Key), None), Stop):
+                    return
+        except BaseException as Err:
+            _put(Queue, (None, None, Err), Stop)
+            return
+        _put(Queue, _DONE, Stop)
+
+    Thread = threading.Thread(target=_reader, daemon=True)
+    Thread.start()
+    try:
+        while True:
+            Start = time.perf_counter()
+            Item = Queue.get()
+            count_wait(time.perf_counter() - Start)
+            if Item is _DONE:
+                return
+            Key, Data, Err = Item
+            if Err is not None:
+                raise Err
+            yield Key, Data
+    finally:
+        Stop.set()
+        Thread.join()
+
+
+class WriteBehind:
+    """Call Write(*Args) in a thread for every put(*Args), at most Depth calls pending
+
+    with WriteBehind(Write) as Writer:
+        Writer.put(Pair, Block)
+    put only blocks when the queue is full, and close waits for the pending
+    writes; both are counted as I/O wait. Errors of Write are raised by the
+    next put or by close. With Depth 0 put writes right away.
+    """
+
+    def __init__(self, Write, Depth=None):
+        self.Write = Write
+        self.Depth = PREFETCH['depth'] if Depth is None else Depth
+        self.Error = None
+        if self.Depth > 0:
+            self.Queue = queue.Queue(self.Depth)
+            self.Thread = threading.Thread(target=self._writer, daemon=True)
+            self.Thread.start()
+
+    def _writer(self):
+        while True:
+            Args = self.Queue.get()
+            if Args is _DONE:
+                return
+            if self.Error is None:
+                try:
+                    self.Write(*Args)
+                except BaseException as Err:
+                    self.Error = Err
+
+    def put(self, *Args):
+        if self.Error is not None:
+            raise self.Error
+        Start = time.perf_counter()
+        if self.Depth > 0:
+            self.Queue.put(Args)
+        else:
+            self.Write(*Args)
+        count_wait(time.perf_counter() - Start)
+
+    def close(self):
+        if self.Depth > 0 and self.Thread.is_alive():
+            Start = time.perf_counter()
+            self.Queue.put(_DONE)
+            self.Thread.join()
+            count_wait(time.perf_counter() - Start)
+        if self.Error is not None:
+            raise self.Error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, Type, Value, Traceback):
+        # On an error of the caller the pending writes are still flushed
+        self.close()
@@ -0,0 +1,77 @@
+# ------------------------------------------ #
+# Multilooked pyramid level of the stack     #
+#                                            #
+# unwrapPhase averaged over Look x Look      #
+# blocks (NaN-aware) and connectComponent    #
+# reduced to the most frequent label of each #
+# block, stored in ifgramStack_pyramid.h5    #
+# next to ifgramStack.h5. A level is reused  #
+# while ifgramStack.h5 is unchanged          #
+# ------------------------------------------ #
+
+import json
+import numpy as np
+import h5py
+from detect_cache import file_identity
+
+PYRAMID_NAME = 'ifgramStack_pyramid.h5'
+
+
+def _blocks(Frame, Look, Fill):
+    """Frame padded to a multiple of Look with Fill, as (rows/Look, cols/Look, Look*Look) blocks"""
+    Rows, Cols = Frame.shape
+    R, C = -(-Rows // Look), -(-Cols // Look)
+    Pad = np.full((R*Look, C*Look), Fill, dtype=Frame.dtype)
+    Pad[:Rows, :Cols] = Frame
+    return Pad.reshape(R, Look, C, Look).transpose(0, 2, 1, 3).reshape(R, C, Look*Look)
+
+
+def multilook(Frame, Look):
+    """NaN-aware mean of Frame over Look x Look blocks, NaN where a block has no valid pixel"""
+    Block = _blocks(np.asarray(Frame, dtype=np.float32), Look, np.nan)
+    Valid = ~np.isnan(Block)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (np.where(Valid, Block, 0).sum(axis=2, dtype=np.float64)/Valid.sum(axis=2)).astype(np.float32)
+
+
+def mode_downsample(Conn, Look):
+    """Most frequent non-zero label of Conn over Look x Look blocks, 0 where a block has none
+
+    Ties go to the smallest label. All blocks are counted with one unique over
+    (block, label) keys.
+    """
+    Conn = np.asarray(Conn)
+    Block = _blocks(Conn, Look, 0).astype(np.int64)
+    R, C, _ = Block.shape
+    Block = Block.reshape(R*C, -1)
+    Cell, Sample = np.nonzero(Block > 0)
+    Out = np.zeros(R*C, dtype=Conn.dtype)
+    if len(Cell) == 0:
+        return Out.reshape(R, C)
+    Base = Block.max() + 1
+    Uniq, Count = np.unique(Cell*Base + Block[Cell, Sample], return_counts=True)
+    Cell, Label = Uniq // Base, Uniq % Base
+    Order = np.lexsort((-Count, Cell))
+    First = np.ones(len(Order), dtype=bool)
+    First[1:] = Cell[Order][1:] != Cell[Order][:-1]
+    Out[Cell[Order][First]] = Label[Order][First]
+    return Out.reshape(R, C)
+
+
+def level_name(Look):
+    return 'look'+str(int(Look))
+
+
+def has_level(Path, Input, Look):
+    """Whether Path holds a complete level Look of the unchanged Input"""
+    try:
+        with h5py.File(Path, 'r') as p:
+            return p.attrs.get('identity') == json.dumps(file_identity(Input), sort_keys=True) \
+                and p.get(level_name(Look)) is not None and p[level_name(Look)].attrs.get('complete', False)
+    except OSError:
+        return False
+
+
+def coarse_coords(Point, Look):
+    """Pixel [Row Col] of the level Look holding the full resolution pixel Point"""
+    return [int(Point[0]) // Look, int(Point[1]) // Look]
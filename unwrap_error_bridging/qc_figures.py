@@ -0,0 +1,98 @@
+# ------------------------------------------ #
+# Quality check figures of bridged pairs     #
+#                                            #
+# One before / after / difference thumbnail  #
+# per modified pair, drawn from decimated    #
+# frames on a process pool, saved as PNGs    #
+# and tiled into one mosaic. The "before"    #
+# frame is rebuilt from the corrections, so  #
+# every pair is read once                    #
+# ------------------------------------------ #
+
+import os
+import multiprocessing as mp
+import numpy as np
+from overview import overview_step, read_overview
+
+
+def _colorize(Frame, Lim, Cmap):
+    """RGB uint8 image of Frame with the colormap Cmap over Lim, NaN in white"""
+    from matplotlib import colormaps
+    Scaled = (np.asarray(Frame, dtype=np.float32) - Lim[0])/max(Lim[1] - Lim[0], 1e-6)
+    Rgb = colormaps[Cmap](np.clip(np.nan_to_num(Scaled, nan=0.5), 0, 1), bytes=True)[..., :3]
+    Rgb[np.isnan(Frame)] = 255
+    return Rgb
+
+
+def _thumb_task(Task):
+    Input, Pair, Entries, MaxPixels, Applied, OutDir, VMinMax = Task
+    import h5py
+    from matplotlib.image import imsave
+    with h5py.File(Input, 'r') as f:
+        Shape = f['unwrapPhase'].shape[1:]
+    Step = overview_step(Shape, MaxPixels)
+    Upha, Step = read_overview(Input, 'unwrapPhase', Pair, Step)
+    Upha = Upha.astype(np.float32)
+    Shift = np.zeros_like(Upha)
+    for AddPhase, _, ConnBackInd, MaskPair in Entries:
+        Conn, _ = read_overview(Input, 'connectComponent', int(MaskPair), Step)
+        Shift += np.float32(AddPhase)*(Conn == ConnBackInd)
+    Before = Upha + Shift if Applied else Upha
+    After = Before - Shift
+
+    # Panels are coloured with numpy and put side by side, no figure is drawn per pair
+    Lim = max(np.nanmax(np.abs(Shift)), 1.0)
+    Gap = np.full((Upha.shape[0], max(2, Upha.shape[1]//40), 3), 255, dtype=np.uint8)
+    Image = np.concatenate([_colorize(Before, VMinMax, 'viridis'), Gap, _colorize(After, VMinMax, 'viridis'), Gap,
+                            _colorize(After - Before, (-Lim, Lim), 'RdBu_r')], axis=1)
+    Path = os.path.join(OutDir, 'pair_'+str(Pair)+'.png')
+    imsave(Path, Image, pil_kwargs={'compress_level': 1})
+    return Pair, Path, Image
+
+
+def render_qc(Input, Bridge, OutDir, Mosaic, Applied=True, Workers=1, MaxPixels=300, VMinMax=(-5, 5), MosaicPixels=4000):
+    """Thumbnails of the pairs of Bridge in OutDir, tiled into the image Mosaic
+
+    Bridge maps pair -> [[2 pi shift, front connComp, back connComp, pair of
+    the connComp mask]]. With Applied the corrections are already in Input
+    (after a --fix run), otherwise the "after" frame is a preview of them.
+    Every thumbnail is before | after (VMinMax, viridis) | difference (RdBu),
+    from frames decimated to MaxPixels on their longest side. Only the
+    mosaic (about MosaicPixels wide) is drawn by matplotlib, with the pair
+    numbers. Returns the PNG path of every pair.
+    """
+    os.makedirs(OutDir, exist_ok=True)
+    Tasks = [(Input, int(i), Bridge[i], MaxPixels, Applied, OutDir, VMinMax) for i in sorted(Bridge)]
+    if not Tasks:
+        return {}
+    if Workers <= 1 or len(Tasks) <= 1:
+        Out = [_thumb_task(x) for x in Tasks]
+    else:
+        with mp.Pool(min(Workers, len(Tasks))) as Pool:
+            Out = Pool.map(_thumb_task, Tasks, chunksize=max(1, len(Tasks)//(4*Workers)))
+
+    ## Mosaic: thumbnails tiled in pair order on a near square grid, at most MosaicPixels on its longest side
+    h, w, _ = Out[0][2].shape
+    Sub = max(1, int(np.ceil(np.sqrt(len(Out)*h*w)/MosaicPixels)))
+    Out = [(Pair, Path, Image[::Sub, ::Sub]) for Pair, Path, Image in Out]
+    h, w, _ = Out[0][2].shape
+    Cols = max(1, int(np.round(np.sqrt(len(Out)*h/w))))
+    Rows = -(-len(Out) // Cols)
+    Pad = max(2, h//10)
+    Tile = np.full((Rows*(h+Pad), Cols*(w+Pad), 3), 255, dtype=np.uint8)
+    for k, (_, _, Image) in enumerate(Out):
+        r, c = divmod(k, Cols)
+        Tile[r*(h+Pad)+Pad:r*(h+Pad)+Pad+h, c*(w+Pad):c*(w+Pad)+w] = Image[:h, :w]
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    Dpi = 100
+    Fig = Figure(figsize=(Tile.shape[1]/Dpi, Tile.shape[0]/Dpi), dpi=Dpi)
+    FigureCanvasAgg(Fig)
+    Ax = Fig.add_axes([0, 0, 1, 1])
+    Ax.imshow(Tile, interpolation='nearest')
+    Ax.set_axis_off()
+    for k, (Pair, _, _) in enumerate(Out):
+        r, c = divmod(k, Cols)
+        Ax.text(c*(w+Pad), r*(h+Pad)+Pad, 'pair '+str(Pair), fontsize=max(6, Pad*0.6*72/Dpi), va='bottom')
+    Fig.savefig(Mosaic, dpi=Dpi, pil_kwargs={'compress_level': 1})
+    return {Pair: Path for Pair, Path, _ in Out}
@@ -0,0 +1,156 @@
+# ------------------------------------------ #
+# Append new pairs to ifgramStack.h5         #
+#                                            #
+# The pairs of a newer stack (the added      #
+# topsStack loaded by MintPy alone) that the #
+# file does not hold yet are appended to     #
+# every dataset with one row per pair        #
+# (unwrapPhase, connectComponent, date,      #
+# bperp, ...), made resizable once. Each     #
+# append is recorded in /stackAppend/<n>,    #
+# and bridging runs record the number of     #
+# pairs they saw, so later runs can bridge   #
+# only the pairs added since                 #
+# ------------------------------------------ #
+
+import os
+import time
+import fnmatch
+import numpy as np
+import h5py
+from stack_io import copy_pairs, swap_dataset, repair_swaps, BLOCK_BYTES, SWAP
+from bridge_history import list_history
+
+APPEND = 'stackAppend'
+
+
+def pair_names(f):
+    """Date pair of every pair (yyyymmdd_yyyymmdd)"""
+    return ['_'.join(x.decode() if isinstance(x, bytes) else str(x) for x in Row) for Row in f['date'][()]]
+
+
+def pair_datasets(f):
+    """Top level datasets with one row per pair: unwrapPhase, connectComponent, coherence, date, bperp, dropIfgram, ..."""
+    NPair = f['date'].shape[0]
+    return [Name for Name, Obj in f.items() if isinstance(Obj, h5py.Dataset) and Obj.ndim and Obj.shape[0] == NPair]
+
+
+def _source_name(Name):
+    # Full copies of older versions (unwrapPhase_orig, unwrapPhase_mBridge_*) take the new pairs as they are
+    if Name == 'unwrapPhase_orig' or fnmatch.fnmatch(Name, 'unwrapPhase_mBridge_*'):
+        return 'unwrapPhase'
+    return Name
+
+
+def list_appends(f):
+    """Appends recorded in the file, oldest first: number, attributes and the appended pairs"""
+    if APPEND not in f:
+        return []
+    return [{'append': int(Name), 'attrs': dict(f[APPEND][Name].attrs), 'pair': f[APPEND][Name]['pair'][()]}
+            for Name in sorted(f[APPEND].keys(), key=int)]
+
+
+def new_pairs(f):
+    """Pairs appended since the latest bridging run, all appended pairs when there is no run
+
+    Runs record the number of pairs they saw (pairCount), the pairs after it
+    are new. For runs written before pairCount existed, the pairs of the
+    appends made after the run are new.
+    """
+    Runs = list_history(f)
+    NPair = f['date'].shape[0]
+    if Runs and 'pairCount' in Runs[-1]['attrs']:
+        return list(range(int(Runs[-1]['attrs']['pairCount']), NPair))
+    After = Runs[-1]['attrs'].get('created', '') if Runs else ''
+    return sorted(int(p) for x in list_appends(f) if x['attrs']['created'] >= After for p in x['pair'])
+
+
+def make_resizable(f, Name, Bytes=BLOCK_BYTES):
+    """Rewrite dataset Name once with an unlimited pair axis, keeping its dtype, filters and attributes
+
+    Datasets that can already grow are left alone. Returns True when rewritten.
+    """
+    Dset = f[Name]
+    if Dset.maxshape[0] is None:
+        return False
+    if Dset.chunks:
+        Chunks = Dset.chunks
+    elif Dset.ndim == 3:
+        Chunks = (1,) + tuple(min(256, x) for x in Dset.shape[1:])
+    else:
+        Chunks = True
+    Tmp = f.create_dataset(Name+SWAP, shape=Dset.shape, maxshape=(None,)+Dset.shape[1:], dtype=Dset.dtype, chunks=Chunks,
+                           compression=Dset.compression, compression_opts=Dset.compression_opts, shuffle=Dset.shuffle,
+                           fletcher32=Dset.fletcher32, fillvalue=Dset.fillvalue)
+    if Dset.ndim == 3:
+        copy_pairs(Dset, Tmp, range(Dset.shape[0]), Bytes)
+    else:
+        Tmp[...] = Dset[()]
+    for Key, Value in Dset.attrs.items():
+        Tmp.attrs[Key] = Value
+    # The full copy is complete before the old dataset is unlinked
+    swap_dataset(f, Name, Name+SWAP)
+    return True
+
+
+def check_frame(f, s):
+    """Raise when the stack s does not cover the same frame as f"""
+    for Name in ['unwrapPhase', 'connectComponent']:
+        if Name in f and Name in s and f[Name].shape[1:] != s[Name].shape[1:]:
+            raise ValueError(Name+' frame '+str(s[Name].shape[1:])+' of '+s.filename+' does not match '+str(f[Name].shape[1:])+' of '+f.filename)
+    Missing = [x for x in pair_datasets(f) if _source_name(x) not in s]
+    if Missing:
+        raise ValueError('No '+', '.join(Missing)+' in '+s.filename+' to append to '+f.filename)
+
+
+def append_stack(Input, Source, Bytes=BLOCK_BYTES):
+    """Append the pairs of Source whose date pairs Input does not hold yet, in place
+
+    Every dataset of Input with one row per pair grows by the new pairs; only
+    their frames are read from Source and written, in batched hyperslabs of
+    at most Bytes. Datasets with a fixed size are made resizable first (a one
+    time copy). The append is recorded in /stackAppend/<n>. Returns the
+    indices of the new pairs in Input.
+    """
+    with h5py.File(Source, 'r') as s, h5py.File(Input, 'r+') as f:
+        for Name in repair_swaps(f):
+            print('*** Finish the interrupted rewrite of',Name)
+        check_frame(f, s)
+        Have = set(pair_names(f))
+        Sel = []
+        for k, Name in enumerate(pair_names(s)):
+            if Name not in Have:
+                Sel.append(k)
+                Have.add(Name)
+        if not Sel:
+            return []
+        NPair = f['date'].shape[0]
+        for Key in ['REF_Y', 'REF_X']:
+            if Key in f.attrs and Key in s.attrs and str(f.attrs[Key]) != str(s.attrs[Key]):
+                print('*** Warning:',Key,'is',s.attrs[Key],'in',Source,'and',f.attrs[Key],'in',Input,', the one of',Input,'is kept')
+
+        Datasets = pair_datasets(f)
+        for Name in Datasets:
+            Contiguous = f[Name].chunks is None
+            if make_resizable(f, Name, Bytes):
+                print('*** Rewrite',Name,'once with a resizable pair axis')
+                if Contiguous and Name in ['unwrapPhase', 'connectComponent']:
+                    print('***',Name,'was contiguous (Optimize_Stack.py --layout contiguous) and is no longer memory mapped')
+        for Name in Datasets:
+            Dst, Src = f[Name], s[_source_name(Name)]
+            Dst.resize(NPair+len(Sel), axis=0)
+            if Dst.ndim == 3:
+                copy_pairs(Src, Dst, Sel, Bytes, Start=NPair)
+            else:
+                Dst[NPair:] = Src[()][Sel].astype(Dst.dtype)
+            print('Append',len(Sel),'rows to',Name)
+
+        Pairs = list(range(NPair, NPair+len(Sel)))
+        Grp = f.require_group(APPEND)
+        Runs = sorted(Grp.keys(), key=int)
+        Entry = Grp.create_group(str(int(Runs[-1])+1 if Runs else 1))
+        Entry.attrs['created'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        Entry.attrs['source'] = os.path.abspath(Source)
+        Entry.attrs['pairCount'] = NPair
+        Entry.create_dataset('pair', data=np.asarray(Pairs, dtype=np.int32))
+    return Pairs
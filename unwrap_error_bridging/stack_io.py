@@ -0,0 +1,200 @@
+# ------------------------------------------ #
+# Sparse I/O of ifgramStack.h5               #
+#                                            #
+# Gather the pixels on a profile (and their  #
+# neighbourhoods) for many pairs without     #
+# loading the whole cube. Reads are grouped  #
+# per HDF5 chunk so each chunk is touched    #
+# once per batch of pairs, or picked from    #
+# the memory map of a contiguous dataset     #
+#                                            #
+# Bridge pairs in place, touching only the   #
+# pixels of the shifted connect component,   #
+# and copy whole pairs between datasets (or  #
+# files) in batched hyperslabs. Datasets are #
+# replaced through a complete <name>_swap so #
+# a crash never leaves the name missing      #
+# ------------------------------------------ #
+
+import numpy as np
+from conncomp_index import shift_pairs
+from stack_layout import mapped_array
+from stage_timer import count_io
+
+# Upper bound of a single hyperslab read in bytes
+BLOCK_BYTES = 64*1024**2
+# Suffix of a dataset about to replace another one
+SWAP = '_swap'
+
+
+def profile_coords(Pstart, Pend):
+    """Row and column indices of the profile from Pstart to Pend [Row Col]"""
+    dist = np.int64(np.sqrt((Pend[1]-Pstart[1])**2+(Pend[0]-Pstart[0])**2))
+    Prof_X = np.int64(np.round(np.linspace(Pstart[1],Pend[1],num=dist)))
+    Prof_Y = np.int64(np.round(np.linspace(Pstart[0],Pend[0],num=dist)))
+    return Prof_Y, Prof_X
+
+
+def window_coords(Rows, Cols, Half, Shape):
+    """Pixel indices of the (2*Half+1)^2 windows centred on Rows, Cols
+
+    Returns WinY, WinX of shape (npoint, 2*Half+1, 2*Half+1), clipped to the frame
+    """
+    Off = np.arange(-Half, Half+1)
+    WinY = np.clip(np.asarray(Rows)[:,None,None] + Off[None,:,None], 0, Shape[0]-1)
+    WinX = np.clip(np.asarray(Cols)[:,None,None] + Off[None,None,:], 0, Shape[1]-1)
+    WinY, WinX = np.broadcast_arrays(WinY, WinX)
+    return WinY, WinX
+
+
+def _tile_shape(Dset):
+    """Spatial tile used to group reads: the chunk shape or a virtual tile for contiguous data"""
+    if Dset.chunks:
+        return Dset.chunks[0], Dset.chunks[1], Dset.chunks[2]
+    return 1, min(256, Dset.shape[1]), min(256, Dset.shape[2])
+
+
+def gather_pixels(Dset, Pairs, Rows, Cols):
+    """Read Dset[Pairs][:, Rows, Cols] from a (pair, row, col) HDF5 dataset
+
+    Pixels are grouped by the chunk that holds them and every group is read
+    with one hyperslab over its bounding box, for a batch of pairs at a time.
+    An uncompressed contiguous dataset is memory mapped instead and only the
+    pixels themselves are read (see stack_layout.mapped_array).
+    Returns an array of shape (len(Pairs), len(Rows)) in the dataset dtype.
+    """
+    Pairs = np.atleast_1d(np.asarray(Pairs, dtype=np.int64))
+    Rows = np.asarray(Rows, dtype=np.int64).ravel()
+    Cols = np.asarray(Cols, dtype=np.int64).ravel()
+    Out = np.empty((len(Pairs), len(Rows)), dtype=Dset.dtype)
+    if len(Pairs) == 0 or len(Rows) == 0:
+        return Out
+    Map = mapped_array(Dset)
+    if Map is not None:
+        Out[:] = Map[Pairs[:,None], Rows[None,:], Cols[None,:]]
+        count_io('read', Out.nbytes)
+        return Out
+
+    # h5py list selection needs increasing unique indices
+    PairList, PairInv = np.unique(Pairs, return_inverse=True)
+    _, cy, cx = _tile_shape(Dset)
+    nTileX = -(-Dset.shape[2] // cx)
+    TileKey = (Rows // cy) * nTileX + Cols // cx
+    Tiles, TileInv = np.unique(TileKey, return_inverse=True)
+    Order = np.argsort(TileInv, kind='stable')
+    Bounds = np.searchsorted(TileInv[Order], np.arange(len(Tiles)+1))
+
+    Buf = np.empty((len(PairList), len(Rows)), dtype=Dset.dtype)
+    for k in range(len(Tiles)):
+        Sel = Order[Bounds[k]:Bounds[k+1]]
+        r0, r1 = Rows[Sel].min(), Rows[Sel].max()+1
+        c0, c1 = Cols[Sel].min(), Cols[Sel].max()+1
+        PairBatch = max(1, BLOCK_BYTES // ((r1-r0)*(c1-c0)*Dset.dtype.itemsize))
+        for p in range(0, len(PairList), PairBatch):
+            Batch = PairList[p:p+PairBatch]
+            if Batch[-1] - Batch[0] + 1 == len(Batch):
+                Block = Dset[Batch[0]:Batch[-1]+1, r0:r1, c0:c1]
+            else:
+                Block = Dset[list(Batch), r0:r1, c0:c1]
+            count_io('read', Block.nbytes)
+            Buf[p:p+len(Batch)][:, Sel] = Block[:, Rows[Sel]-r0, Cols[Sel]-c0]
+    Out[:] = Buf[PairInv]
+    return Out
+
+
+def gather_windows(Dset, Pairs, Rows, Cols, Half=2):
+    """Read the (2*Half+1)^2 neighbourhood of every point for every pair
+
+    Returns an array of shape (len(Pairs), npoint, 2*Half+1, 2*Half+1)
+    """
+    WinY, WinX = window_coords(Rows, Cols, Half, Dset.shape[1:])
+    Win = gather_pixels(Dset, Pairs, WinY.ravel(), WinX.ravel())
+    return Win.reshape((Win.shape[0],) + WinY.shape)
+
+
+def pair_batches(Pairs, Frame, Chunk=1, Bytes=BLOCK_BYTES):
+    """Split sorted unique Pairs into runs of consecutive pairs of at most Bytes
+
+    Frame is the byte size of one pair. A run is cut at multiples of Chunk
+    (the pair size of the HDF5 chunks) so that a batch does not share a chunk
+    with the next one. Returns a list of (first, last+1).
+    """
+    Pairs = np.unique(np.asarray(Pairs, dtype=np.int64))
+    Size = max(1, int(Bytes // max(1, Frame)))
+    if Size >= Chunk:
+        Size -= Size % Chunk
+    Batches = []
+    for Run in np.split(Pairs, np.where(np.diff(Pairs) != 1)[0]+1):
+        if len(Run) == 0:
+            continue
+        p0, p1 = int(Run[0]), int(Run[-1])+1
+        Cut = [p0] + list(range((p0 // Size + 1)*Size, p1, Size)) + [p1]
+        Batches += list(zip(Cut[:-1], Cut[1:]))
+    return Batches
+
+
+def copy_pairs(Src, Dst, Pairs, Bytes=BLOCK_BYTES, Start=None):
+    """Copy the frames Pairs of Src into Dst in place
+
+    Consecutive pairs are moved with one hyperslab read and one write per batch
+    of at most Bytes (cut along the rows when a single frame is larger). Only
+    these frames are touched, Dst keeps its dtype, chunking and compression.
+    With Start, the pairs go one after the other to the frames of Dst from
+    Start on (used to append pairs). Returns the copied pairs.
+    """
+    Pairs = np.unique(np.asarray(Pairs, dtype=np.int64))
+    Target = dict(zip(Pairs.tolist(), range(Start, Start+len(Pairs)))) if Start is not None else None
+    Frame = int(np.prod(Dst.shape[1:]))*Src.dtype.itemsize
+    Rows = Dst.shape[1]
+    RowStep = max(1, int(Bytes // max(1, Frame // Rows)))
+    for p0, p1 in pair_batches(Pairs, Frame, Dst.chunks[0] if Dst.chunks else 1, Bytes):
+        q0 = p0 if Target is None else Target[p0]
+        for r0 in range(0, Rows, RowStep):
+            Block = Src[p0:p1, r0:r0+RowStep, :]
+            count_io('read', Block.nbytes)
+            Dst[q0:q0+p1-p0, r0:r0+RowStep, :] = Block.astype(Dst.dtype, copy=False)
+            count_io('write', Block.nbytes)
+    return Pairs.tolist()
+
+
+def bridge_in_place(Dset, Index, Bridge, Timer=None, Journal=None):
+    """Shift the back connect components of the bridged pairs, one pair at a time
+
+    Bridge maps pair -> list of [2 pi shift, front connComp, back connComp, pair of the connComp mask].
+    Index is a StackIndex of connectComponent: every pair is read and written
+    once, over the bounding box of its back connect components, and only their
+    pixels are shifted. The next pairs are read ahead and the shifted blocks
+    written behind in threads (see conncomp_index.shift_pairs). The dataset dtype, chunking and compression are kept.
+    The time spent on every pair goes to Timer (a StageTimer) when given.
+    With Journal every pair is committed on its own (see checkpoint).
+    Returns pair -> shifted pixel count.
+    """
+    Shifts = {i: [(MaskPair, ConnBackInd, -AddPhase) for AddPhase, _, ConnBackInd, MaskPair in Bridge[i]] for i in Bridge}
+    return shift_pairs(Dset, Index, Shifts, Timer=Timer, Journal=Journal)
+
+
+def swap_dataset(f, Name, Tmp):
+    """Replace dataset Name by the complete dataset Tmp
+
+    Tmp is marked complete before Name is unlinked, so a crash at any step
+    leaves either Name or a complete Tmp that repair_swaps puts in place.
+    """
+    f[Tmp].attrs['swapOf'] = Name
+    f.flush()
+    if Name in f:
+        del f[Name]
+    f.move(Tmp, Name)
+    del f[Name].attrs['swapOf']
+
+
+def repair_swaps(f):
+    """Finish the swaps interrupted by a crash, drop the incomplete ones. Returns the repaired names"""
+    Repaired = []
+    for Tmp in [x for x in f.keys() if x.endswith(SWAP)]:
+        Name = Tmp[:-len(SWAP)]
+        if f[Tmp].attrs.get('swapOf') == Name:
+            swap_dataset(f, Name, Tmp)
+            Repaired.append(Name)
+        else:
+            del f[Tmp]
+    return Repaired
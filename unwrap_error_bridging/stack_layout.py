@@ -0,0 +1,153 @@
+# ------------------------------------------ #
+# Storage layout of ifgramStack.h5           #
+#                                            #
+# unwrapPhase and connectComponent are       #
+# rewritten in place as contiguous or        #
+# (1, tile, tile) chunks, with a choice of   #
+# compression, and the throughput of the     #
+# access patterns of the bridging tools is   #
+# measured on the file itself. Uncompressed  #
+# contiguous datasets are memory mapped at   #
+# their offset in the file, so profile       #
+# gathers and masked in-place shifts touch   #
+# only their pixels                          #
+# ------------------------------------------ #
+
+import time
+import numpy as np
+import h5py
+
+LAYOUTS = ['chunked', 'contiguous']
+COMPRESSIONS = ['none', 'gzip', 'lzf']
+
+
+def mapped_array(Dset, Mode='r'):
+    """np.memmap of Dset at its offset in the file, None when its layout does not allow it
+
+    Only datasets stored as one contiguous block, without filters and
+    already allocated, in a file opened with the default driver, can be
+    mapped. Mode 'r+' writes through to the file.
+    """
+    if not isinstance(Dset, h5py.Dataset) or Dset.chunks is not None or Dset.external:
+        return None
+    if Dset.dtype.kind not in 'biuf' or Dset.file.driver not in ('sec2', 'stdio'):
+        return None
+    Offset = Dset.id.get_offset()
+    if Offset is None or Dset.size == 0:
+        return None
+    return np.memmap(Dset.file.filename, mode=Mode, dtype=Dset.dtype, offset=Offset, shape=Dset.shape)
+
+
+def describe(Dset):
+    """Layout of Dset in words: chunks, compression and whether it is memory mapped"""
+    if Dset.chunks is None:
+        Text = 'contiguous'
+    else:
+        Text = 'chunks '+str(Dset.chunks)
+    Text += ', '+(Dset.compression or 'no')+' compression'
+    if Dset.compression_opts is not None:
+        Text += ' '+str(Dset.compression_opts)
+    if Dset.maxshape[0] is None:
+        Text += ', resizable'
+    if mapped_array(Dset) is not None:
+        Text += ', memory mapped'
+    return Text
+
+
+def layout_args(Shape, Layout='chunked', Tile=256, Compression='none', Level=None):
+    """create_dataset keywords of the layout for a (pair, row, col) dataset of Shape
+
+    Chunks of one pair by Tile x Tile pixels (clipped to the frame) keep a
+    pair slice or a bounding box to the chunks it covers; they can grow
+    along the pairs for Append_Stack.py. A contiguous dataset has a fixed
+    size and cannot be compressed.
+    """
+    if Layout not in LAYOUTS:
+        raise ValueError('Unknown layout '+str(Layout)+', choose from '+str(LAYOUTS))
+    if Compression not in COMPRESSIONS:
+        raise ValueError('Unknown compression '+str(Compression)+', choose from '+str(COMPRESSIONS))
+    Compression = None if Compression == 'none' else Compression
+    if Layout == 'contiguous':
+        if Compression:
+            raise ValueError('A contiguous dataset cannot be compressed (HDF5 filters need chunks), use the chunked layout')
+        return {'chunks': None, 'maxshape': None}
+    Args = {'chunks': (1, min(Tile, Shape[1]), min(Tile, Shape[2])), 'maxshape': (None,)+tuple(Shape[1:])}
+    if Compression:
+        Args.update(compression=Compression, compression_opts=Level if Compression == 'gzip' else None, shuffle=True)
+    return Args
+
+
+def same_layout(Dset, Args):
+    """Whether Dset is already stored with the create_dataset keywords Args"""
+    return (Dset.chunks == Args['chunks'] and Dset.compression == Args.get('compression') and
+            (Args.get('compression_opts') is None or Dset.compression_opts == Args['compression_opts']) and
+            (Args['maxshape'] is None or Dset.maxshape == Args['maxshape']))
+
+
+def rewrite_layout(f, Name, Args, Bytes=None):
+    """Rewrite dataset Name of the open file f with the create_dataset keywords Args, in place
+
+    Every pair is copied in batched hyperslabs of at most Bytes to
+    <Name>_swap, which then replaces Name (see stack_io.swap_dataset). The
+    dtype, fill value and attributes are kept. Returns True when rewritten,
+    False when Name is already in this layout.
+    """
+    from stack_io import copy_pairs, swap_dataset, BLOCK_BYTES, SWAP
+
+    Dset = f[Name]
+    if same_layout(Dset, Args):
+        return False
+    Tmp = f.create_dataset(Name+SWAP, shape=Dset.shape, dtype=Dset.dtype, fillvalue=Dset.fillvalue, **Args)
+    copy_pairs(Dset, Tmp, range(Dset.shape[0]), Bytes or BLOCK_BYTES)
+    for Key, Value in Dset.attrs.items():
+        Tmp.attrs[Key] = Value
+    swap_dataset(f, Name, Name+SWAP)
+    return True
+
+
+def _best(Run, Rounds):
+    # Fastest of the rounds: the later rounds read from the page cache as a bridging run over the same pairs would
+    Best = None
+    for _ in range(max(1, Rounds)):
+        Start = time.perf_counter()
+        Bytes = Run()
+        Seconds = time.perf_counter() - Start
+        Best = Seconds if Best is None else min(Best, Seconds)
+    return Bytes, Best
+
+
+def measure_throughput(Input, Name, Pairs, Window=512, Rounds=2):
+    """Throughput of the access patterns of the bridging tools on dataset Name of Input
+
+    frame: whole pairs as read for a label index; profile: the pixels of the
+    frame diagonal for all Pairs at once (stack_io.gather_pixels, as the
+    detection); window: a Window x Window box of every pair (the bounding box
+    of a shifted connect component). Returns pattern -> (MB/s, ms per pair).
+    """
+    from stack_io import profile_coords, gather_pixels
+
+    Pairs = np.asarray(Pairs, dtype=np.int64)
+    with h5py.File(Input, 'r') as f:
+        Dset = f[Name]
+        _, NRow, NCol = Dset.shape
+        Map = mapped_array(Dset)
+        Data = Dset if Map is None else Map
+        # h5py returns a new array, the pixels of a memory map are only read once copied
+        Copy = np.asarray if Map is None else np.array
+        r0, c0 = max(0, NRow//2 - Window//2), max(0, NCol//2 - Window//2)
+        Prof_Y, Prof_X = profile_coords([0, 0], [NRow-1, NCol-1])
+
+        def _frame():
+            return sum(Copy(Data[i]).nbytes for i in Pairs)
+
+        def _profile():
+            return gather_pixels(Dset, Pairs, Prof_Y, Prof_X).nbytes
+
+        def _window():
+            return sum(Copy(Data[i, r0:r0+Window, c0:c0+Window]).nbytes for i in Pairs)
+
+        Out = {}
+        for Pattern, Run in [('frame', _frame), ('profile', _profile), ('window', _window)]:
+            Bytes, Seconds = _best(Run, Rounds)
+            Out[Pattern] = (Bytes/1024**2/max(Seconds, 1e-9), 1e3*Seconds/max(1, len(Pairs)))
+    return Out
@@ -0,0 +1,204 @@
+# ------------------------------------------ #
+# Wall time, I/O and memory of named stages  #
+#                                            #
+# Used by bridging.run_jobs and the          #
+# benchmark to split a run into read,        #
+# detect, search, residual and bridge.       #
+# Bytes read and written are counted by the  #
+# readers/writers through count_io, the time #
+# spent waiting for I/O through count_wait.  #
+# The resident memory peak of a stage is     #
+# reset at its start (Linux VmHWM)           #
+# ------------------------------------------ #
+
+import sys
+import time
+import threading
+import resource
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Bytes read from and written to HDF5 datasets by this process, and the
+# seconds the main thread waited for them (prefetch readers/writers are threads)
+IO = {'read': 0, 'write': 0, 'wait': 0.0}
+_LOCK = threading.Lock()
+# The same counts per thread, so the I/O of one pair is told apart from the prefetch threads
+_THREAD = threading.local()
+# Per pair values that keep their maximum instead of being summed
+PAIR_PEAKS = ('rssMB',)
+
+
+def count_io(Kind, Bytes):
+    """Add Bytes to the 'read' or 'write' counter"""
+    with _LOCK:
+        IO[Kind] += int(Bytes)
+    setattr(_THREAD, Kind, getattr(_THREAD, Kind, 0) + int(Bytes))
+
+
+def thread_io():
+    """Bytes (read, written) so far by the calling thread"""
+    return getattr(_THREAD, 'read', 0), getattr(_THREAD, 'write', 0)
+
+
+def count_wait(Seconds):
+    """Add Seconds to the time spent blocked on I/O"""
+    with _LOCK:
+        IO['wait'] += Seconds
+
+
+def max_rss_mb(Who=resource.RUSAGE_SELF):
+    """Peak resident memory so far in MB (ru_maxrss is in KB on Linux and in bytes on macOS)"""
+    return resource.getrusage(Who).ru_maxrss/(1024**2 if sys.platform == 'darwin' else 1024)
+
+
+def _status_mb(Key):
+    # VmRSS, VmHWM, ... of /proc/self/status in MB, None without /proc
+    try:
+        with open('/proc/self/status') as f:
+            for Line in f:
+                if Line.startswith(Key+':'):
+                    return int(Line.split()[1])/1024
+    except OSError:
+        return None
+    return None
+
+
+def rss_mb():
+    """Resident memory of this process now in MB, the peak so far where /proc is missing"""
+    Now = _status_mb('VmRSS')
+    return max_rss_mb() if Now is None else Now
+
+
+def reset_peak_rss():
+    """Restart the resident memory peak (VmHWM) from the current RSS, False when the system cannot"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class StageTimer:
+    """Accumulate wall time, bytes read/written and memory of named stages, and per pair values
+
+    with Timer('detect'):
+        ...
+    The same stage can be entered several times (e.g. once per job). peakMB is
+    the peak Python memory of the stage while tracemalloc runs. rssStartMB and
+    rssEndMB are the resident memory of this process when the stage is
+    entered and left, peakRSSMB its peak during the stage (None where the
+    peak cannot be reset, see reset_peak_rss), lifetimeMaxRSSMB the peak of
+    the process and of its finished workers since they started. ioWait is
+    the fraction of the wall time spent blocked on I/O (see prefetch).
+    """
+
+    def __init__(self):
+        self.Stages = OrderedDict()
+        self.Pairs = OrderedDict()
+        self.Lock = threading.Lock()
+        # Running resident peak of every open stage: a nested stage resets VmHWM
+        self.Open = []
+
+    def _fold_peak(self):
+        Now = _status_mb('VmHWM')
+        for Peak in self.Open:
+            Peak[0] = max(Peak[0], Now)
+
+    @contextmanager
+    def __call__(self, Name):
+        Tracing = tracemalloc.is_tracing()
+        if Tracing:
+            Before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        Reset = _status_mb('VmHWM') is not None
+        if Reset:
+            self._fold_peak()
+            Reset = reset_peak_rss()
+        RSS = rss_mb()
+        Peak = [RSS]
+        self.Open.append(Peak)
+        Read, Write, Wait = IO['read'], IO['write'], IO['wait']
+        Start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if Reset:
+                self._fold_peak()
+            self.Open.remove(Peak)
+            Stage = self.Stages.setdefault(Name, {'seconds': 0.0, 'calls': 0, 'readMB': 0.0, 'writeMB': 0.0, 'peakMB': None,
+                                                  'rssStartMB': RSS, 'rssEndMB': 0.0, 'peakRSSMB': None, 'lifetimeMaxRSSMB': 0.0,
+                                                  'waitSeconds': 0.0, 'ioWait': 0.0})
+            Stage['seconds'] += time.perf_counter() - Start
+            Stage['waitSeconds'] += IO['wait'] - Wait
+            Stage['ioWait'] = Stage['waitSeconds']/Stage['seconds'] if Stage['seconds'] > 0 else 0.0
+            Stage['calls'] += 1
+            Stage['readMB'] += (IO['read'] - Read)/1024**2
+            Stage['writeMB'] += (IO['write'] - Write)/1024**2
+            Stage['rssEndMB'] = rss_mb()
+            if Reset:
+                Stage['peakRSSMB'] = max(Stage['peakRSSMB'] or 0.0, Peak[0])
+            Stage['lifetimeMaxRSSMB'] = max(max_rss_mb(), max_rss_mb(resource.RUSAGE_CHILDREN))
+            if Tracing:
+                Peak = (tracemalloc.get_traced_memory()[1] - Before)/1024**2
+                Stage['peakMB'] = max(Stage['peakMB'] or 0.0, Peak)
+
+    def add_pair(self, Pair, **Values):
+        """Add Values (seconds, MB, ...) to the record of Pair, the PAIR_PEAKS keep their maximum
+
+        Safe to call from the prefetch threads.
+        """
+        with self.Lock:
+            Record = self.Pairs.setdefault(int(Pair), {})
+            for Key, Value in Values.items():
+                Record[Key] = max(Record.get(Key, 0), Value) if Key in PAIR_PEAKS else Record.get(Key, 0) + Value
+
+    def total(self):
+        return sum(x['seconds'] for x in self.Stages.values())
+
+    def summary(self):
+        """One line per stage"""
+        Lines = []
+        for Name, x in self.Stages.items():
+            Mem = '' if x['peakMB'] is None else '  Python peak %8.1f MB' % x['peakMB']
+            Peak = '' if x['peakRSSMB'] is None else '  RSS peak %8.1f MB' % x['peakRSSMB']
+            Wait = '  I/O wait %5.1f %%' % (100*x['ioWait']) if x['waitSeconds'] > 0 else ''
+            Lines.append('%-10s %9.3f s  (%d calls)  read %9.1f MB  write %9.1f MB  RSS %8.1f -> %8.1f MB%s%s%s'
+                         % (Name, x['seconds'], x['calls'], x['readMB'], x['writeMB'], x['rssStartMB'], x['rssEndMB'], Peak, Mem, Wait))
+        return Lines
+
+
+@contextmanager
+def profiled(Path, Top=30):
+    """Run the block under cProfile and tracemalloc
+
+    The cProfile statistics go to Path.prof (for snakeviz/pstats) and a text
+    summary of the Top functions by cumulative time and the Top allocation
+    sites to Path.txt.
+    """
+    import cProfile
+    import pstats
+    import io
+    Started = not tracemalloc.is_tracing()
+    if Started:
+        tracemalloc.start()
+    Prof = cProfile.Profile()
+    Prof.enable()
+    try:
+        yield
+    finally:
+        Prof.disable()
+        Snapshot = tracemalloc.take_snapshot()
+        Current, Peak = tracemalloc.get_traced_memory()
+        if Started:
+            tracemalloc.stop()
+        Prof.dump_stats(Path+'.prof')
+        Text = io.StringIO()
+        pstats.Stats(Prof, stream=Text).sort_stats('cumulative').print_stats(Top)
+        Text.write('\nPython memory: current %.1f MB, peak %.1f MB\n' % (Current/1024**2, Peak/1024**2))
+        Text.write('Top %d allocation sites still held at the end:\n' % Top)
+        for Stat in Snapshot.statistics('lineno')[:Top]:
+            Text.write(str(Stat)+'\n')
+        with open(Path+'.txt', 'w') as f:
+            f.write(Text.getvalue())
@@ -0,0 +1,130 @@
+# ------------------------------------------ #
+# Closed-form step fit along a profile       #
+#                                            #
+# Fit d = a + b*H(x-j) for every breakpoint  #
+# j with prefix sums, for all pairs at once  #
+# Multi-step segmentation of a profile by    #
+# binary segmentation on the same sums       #
+# Used by Profile_Bridging.py and            #
+# Check_profile.py                           #
+# ------------------------------------------ #
+
+import numpy as np
+
+
+def step_fit_all(D):
+    """Least-squares step model at every breakpoint of every profile.
+
+    D is a profile (n,) or a stack of profiles (npair, n). NaN samples are
+    ignored. For breakpoint j the samples [0, j) are the front and [j, n) the
+    back; j = 0 and j = n-1 are skipped as in the original grid search.
+
+    Returns m (npair, n, 2) with [intercept, step] and RMSE (npair, n).
+    Breakpoints with an empty front or back are NaN.
+    """
+    D = np.atleast_2d(np.asarray(D, dtype=np.float64))
+    Valid = ~np.isnan(D)
+    # Remove the mean of each profile to keep the prefix sums well conditioned
+    Count = Valid.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Mu = np.where(Valid, D, 0).sum(axis=1, keepdims=True) / Count
+    Dc = np.where(Valid, D - Mu, 0)
+
+    # Prefix sums of count, sum and sum of squares for the front part [0, j)
+    zero = np.zeros((D.shape[0], 1))
+    nF = np.hstack([zero, np.cumsum(Valid, axis=1)])[:, :-1]
+    sF = np.hstack([zero, np.cumsum(Dc, axis=1)])[:, :-1]
+    nB = Count - nF
+    sB = Dc.sum(axis=1, keepdims=True) - sF
+    SS = (Dc**2).sum(axis=1, keepdims=True)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        MeanF = sF / nF
+        MeanB = sB / nB
+        SSE = SS - sF*MeanF - sB*MeanB
+        RMSE = np.sqrt(np.maximum(SSE, 0) / Count)
+
+    Bad = (nF == 0) | (nB == 0)
+    Bad[:, 0] = True
+    Bad[:, -1] = True
+    RMSE[Bad] = np.nan
+
+    m = np.empty(D.shape + (2,))
+    m[:, :, 0] = MeanF + Mu
+    m[:, :, 1] = MeanB - MeanF
+    m[Bad, :] = np.nan
+    return m, RMSE
+
+
+def step_fit(D):
+    """Best breakpoint of every profile in D (n,) or (npair, n).
+
+    Returns Ind (npair,), PhaseStep (npair, 2) with [intercept, step] and the
+    minimum RMSE (npair,). Profiles without a valid breakpoint get Ind = 0 and
+    NaN for PhaseStep and RMSE.
+    """
+    m, RMSE = step_fit_all(D)
+    Ok = ~np.all(np.isnan(RMSE), axis=1)
+    Ind = np.zeros(RMSE.shape[0], dtype=np.int64)
+    Ind[Ok] = np.nanargmin(RMSE[Ok], axis=1)
+    Rows = np.arange(RMSE.shape[0])
+    PhaseStep = m[Rows, Ind, :]
+    MinRMSE = RMSE[Rows, Ind]
+    PhaseStep[~Ok] = np.nan
+    MinRMSE[~Ok] = np.nan
+    return Ind, PhaseStep, MinRMSE
+
+
+def _segment_means(S, N, Breaks, n):
+    Edges = np.concatenate([[0], Breaks, [n]]).astype(np.int64)
+    Count = N[Edges[1:]] - N[Edges[:-1]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (S[Edges[1:]] - S[Edges[:-1]]) / Count
+
+
+def segment(D, MinStep=np.pi, MinSize=3, MaxBreaks=None):
+    """Every step of at least MinStep along one profile D (n,), NaN samples ignored
+
+    Binary segmentation: the segment is split at the breakpoint with the
+    largest drop of squared error, found for all breakpoints at once from
+    prefix sums, while the two sides differ by MinStep/4 or more and hold at
+    least MinSize valid samples. Neighbouring segments that differ by less
+    than MinStep are then merged back, so a bump is not split in the middle.
+
+    Returns the breakpoints (first sample after each step, sorted) and the
+    mean of every segment (len(Breaks)+1,).
+    """
+    D = np.asarray(D, dtype=np.float64).ravel()
+    n = len(D)
+    Valid = ~np.isnan(D)
+    Mu = D[Valid].mean() if Valid.any() else 0.0
+    N = np.concatenate([[0], np.cumsum(Valid)])
+    S = np.concatenate([[0], np.cumsum(np.where(Valid, D - Mu, 0))])
+
+    Breaks = []
+    Todo = [(0, n)]
+    while Todo and not (MaxBreaks and len(Breaks) >= MaxBreaks):
+        a, b = Todo.pop()
+        k = np.arange(a+1, b)
+        nL = N[k] - N[a]
+        nR = N[b] - N[k]
+        Ok = (nL >= MinSize) & (nR >= MinSize)
+        if not np.any(Ok):
+            continue
+        k, nL, nR = k[Ok], nL[Ok], nR[Ok]
+        Diff = (S[b] - S[k])/nR - (S[k] - S[a])/nL
+        j = np.argmax(nL*nR/(nL + nR)*Diff**2)
+        if np.abs(Diff[j]) < MinStep/4:
+            continue
+        Breaks.append(int(k[j]))
+        Todo += [(a, int(k[j])), (int(k[j]), b)]
+
+    # Merge the neighbours closer than MinStep, smallest difference first
+    Breaks = sorted(Breaks)
+    while Breaks:
+        Diff = np.abs(np.diff(_segment_means(S, N, Breaks, n)))
+        j = np.argmin(Diff)
+        if Diff[j] >= MinStep:
+            break
+        del Breaks[j]
+    return np.array(Breaks, dtype=np.int64), _segment_means(S, N, Breaks, n) + Mu
@@ -0,0 +1,133 @@
+# ------------------------------------------ #
+# Synthetic ifgramStack.h5 for benchmarking  #
+#                                            #
+# Connect components are horizontal bands    #
+# with wavy boundaries. Known integer 2 pi   #
+# jumps are added to the bands of each pair  #
+# and NaN holes are cut in unwrapPhase.      #
+# The ground truth is saved next to the file #
+# in <name>_truth.npz                        #
+# ------------------------------------------ #
+
+import os
+import argparse
+import numpy as np
+import h5py
+from bridging import make_job
+
+
+def truth_name(Path):
+    """Ground truth file of the synthetic stack Path"""
+    return os.path.splitext(Path)[0]+'_truth.npz'
+
+
+def make_stack(Path, NPair=50, Shape=(1000, 800), NComp=3, JumpRate=0.3, MaxJump=2, Holes=5,
+               Noise=0.3, Seed=0, Chunk=128, Compression=None):
+    """Write a synthetic ifgramStack.h5 and return its ground truth
+
+    Every pair has a smooth deformation signal plus noise. Band c (1..NComp) of
+    a pair is offset by Jump[pair, c-1] * 2 pi, band 1 never jumps. Returns a dict
+    with jump (NPair, NComp), the boundary rows (NComp-1, cols) and the band
+    labels conn (rows, cols).
+    """
+    Rng = np.random.default_rng(Seed)
+    Rows, Cols = Shape
+    NComp = max(int(NComp), 1)
+
+    ## Band boundaries: equally spaced rows with a gentle sine along the columns
+    Base = np.linspace(0, Rows, NComp+1)[1:-1]
+    Wave = 0.05*Rows/NComp*np.sin(2*np.pi*np.arange(Cols)/Cols*Rng.uniform(1, 3))
+    Boundary = np.int64(np.round(Base[:,None] + Wave[None,:]))
+    Conn = np.ones(Shape, dtype=np.int16)
+    for b in Boundary:
+        Conn += (np.arange(Rows)[:,None] >= b[None,:]).astype(np.int16)
+
+    ## Integer 2 pi jumps of every band but the first
+    Jump = np.zeros((NPair, NComp), dtype=np.int64)
+    if NComp > 1:
+        Has = Rng.random((NPair, NComp-1)) < JumpRate
+        Size = Rng.integers(1, MaxJump+1, size=(NPair, NComp-1))*Rng.choice([-1, 1], size=(NPair, NComp-1))
+        Jump[:,1:] = np.where(Has, Size, 0)
+
+    ## Pair network: each acquisition connected to the next three
+    NDate = max(4, int(np.ceil((NPair + 6)/3)))
+    Dates = np.datetime64('2020-01-01') + 12*np.arange(NDate)
+    Net = sorted((a, a+k) for k in (1, 2, 3) for a in range(NDate-k))[:NPair]
+    Date = np.array([[str(Dates[a]).replace('-', ''), str(Dates[b]).replace('-', '')] for a, b in Net], dtype='S8')
+
+    Kw = {'chunks': (1, min(Chunk, Rows), min(Chunk, Cols))} if Chunk else {}
+    if Compression:
+        Kw['compression'] = Compression
+    Y, X = np.mgrid[0:Rows, 0:Cols]
+    Bowl = np.exp(-(((Y - Rows/2)/(0.3*Rows))**2 + ((X - Cols/2)/(0.3*Cols))**2))
+    with h5py.File(Path, 'w') as f:
+        f.attrs['FILE_TYPE'] = 'ifgramStack'
+        f.attrs['LENGTH'] = Rows
+        f.attrs['WIDTH'] = Cols
+        # Reference point in band 1, as written by MintPy reference_point
+        f.attrs['REF_Y'] = int(Boundary[0, Cols//2]//2) if NComp > 1 else Rows//2
+        f.attrs['REF_X'] = Cols//2
+        Upha = f.create_dataset('unwrapPhase', shape=(NPair,)+tuple(Shape), dtype=np.float32, **Kw)
+        f.create_dataset('connectComponent', data=np.broadcast_to(Conn, (NPair,)+tuple(Shape)), dtype=np.int16, **Kw)
+        f.create_dataset('date', data=Date)
+        f.create_dataset('bperp', data=Rng.normal(0, 50, NPair).astype(np.float32))
+        f.create_dataset('dropIfgram', data=np.ones(NPair, dtype=bool))
+        for i in range(NPair):
+            Frame = Rng.uniform(-1, 1)*Bowl + Rng.normal(0, Noise, Shape) + 2*np.pi*Jump[i][Conn-1]
+            for _ in range(Holes):
+                r0, c0 = Rng.integers(0, Rows), Rng.integers(0, Cols)
+                Frame[r0:r0+Rows//20+1, c0:c0+Cols//20+1] = np.nan
+            Upha[i] = Frame.astype(np.float32)
+
+    Truth = {'jump': Jump, 'boundary': Boundary, 'conn': Conn}
+    np.savez(truth_name(Path), **Truth)
+    return Truth
+
+
+def profile_jobs(Truth, SearchStep=None, Multi=False):
+    """One vertical profile per band boundary, from the middle of band c to the middle of band c+1
+
+    Returned as bridging.make_job dicts, in boundary order, so that running them
+    in order shifts every band back to band 1. With Multi, a single multi-step
+    profile from the middle of the first band to the middle of the last one.
+    """
+    Boundary = Truth['boundary']
+    Rows, Cols = Truth['conn'].shape
+    Col = Cols//2
+    Edges = np.concatenate([[0], Boundary[:,Col], [Rows]])
+    if Multi:
+        r0 = int((Edges[0] + Edges[1])//2)
+        r1 = int((Edges[-2] + Edges[-1])//2)
+        return [make_job([r0, Col], [r1, Col], SearchStep or max(1, (r1 - r0)//20), Name='multi', Multi=True)]
+    Jobs = []
+    for c in range(len(Boundary)):
+        r0 = int((Edges[c] + Edges[c+1])//2)
+        r1 = int((Edges[c+1] + Edges[c+2])//2)
+        Step = SearchStep or max(1, (r1 - r0)//20)
+        Jobs.append(make_job([r0, Col], [r1, Col], Step, Name='boundary'+str(c+1)))
+    return Jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic ifgramStack.h5 with known 2 pi jumps for benchmarking the bridging scripts')
+    parser.add_argument('--output','-o',type=str,required=True,help='Output ifgramStack.h5. The ground truth goes to <name>_truth.npz [Example: -o /tmp/bench/ifgramStack.h5]')
+    parser.add_argument('--npair','-n',type=int,default=50,required=False,help='Number of pairs [Default: 50]')
+    parser.add_argument('--size','-s',type=int,nargs=2,default=[1000,800],required=False,help='Frame size [Rows Cols] [Default: 1000 800]')
+    parser.add_argument('--ncomp','-c',type=int,default=3,required=False,help='Number of connect components (bands) [Default: 3]')
+    parser.add_argument('--jumpRate',type=float,default=0.3,required=False,help='Probability of a jump for every band of every pair [Default: 0.3]')
+    parser.add_argument('--maxJump',type=int,default=2,required=False,help='Largest jump in multiples of 2 pi [Default: 2]')
+    parser.add_argument('--holes',type=int,default=5,required=False,help='NaN holes per pair [Default: 5]')
+    parser.add_argument('--seed',type=int,default=0,required=False,help='Random seed [Default: 0]')
+    parser.add_argument('--chunk',type=int,default=128,required=False,help='Chunk tile size, 0 for a contiguous layout [Default: 128]')
+    parser.add_argument('--compression',type=str,default=None,required=False,help='h5py compression (gzip, lzf) [Default: none]')
+    args = parser.parse_args()
+
+    Truth = make_stack(args.output, NPair=args.npair, Shape=tuple(args.size), NComp=args.ncomp, JumpRate=args.jumpRate,
+                       MaxJump=args.maxJump, Holes=args.holes, Seed=args.seed, Chunk=args.chunk, Compression=args.compression)
+    print('Write',args.output,'with',args.npair,'pairs of',args.size,'and',args.ncomp,'connect components')
+    print('Pairs with jumps:',np.where(np.any(Truth['jump'] != 0, axis=1))[0].tolist())
+    print('Ground truth saved to',truth_name(args.output))
+
+
+if __name__ == '__main__':
+    main()